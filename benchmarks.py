@@ -0,0 +1,295 @@
+"""
+Benchmarks of the hot paths, run against fakebluez on a private bus.
+
+    python benchmarks.py
+    python benchmarks.py -o run.json --baseline previous.json --tolerance 0.25
+
+Results are printed as JSON. Keys ending with _us / _ms are lower-is-better, keys ending
+with _per_sec are higher-is-better; with --baseline the exit code is 1 if any of them
+regressed more than tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import components.conf as c
+
+ADAPTER_PROPERTIES = ('powered', 'discoverable', 'discovering', 'pairable', 'alias', 'address', 'uuids')
+
+# upper bounds of bench_startup, checked by tests.TestStartup if BT_TEST_STARTUP_BUDGETS is set.
+STARTUP_BUDGETS_MS = {'startup_import_ms': 150, 'startup_init_ms': 10}
+# modules that must not be imported before the bus is used.
+STARTUP_LAZY_MODULES = ('dbus', 'gi', 'numpy')
+
+_STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import components.bluetoothcontroller as bc
+imported = time.perf_counter()
+bc.BluetoothController()
+bc.Adapter()
+bc.BluetoothScanner()
+created = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1e3, 'init_ms': (created - imported) * 1e3,
+                  'modules': [name for name in %r if name in sys.modules]}))
+""" % (STARTUP_LAZY_MODULES,)
+
+
+def measure(func, number, repeat=5):
+    """
+    Return : best seconds per call of func over repeat runs of number calls.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_startup(repeat=5):
+    """
+    Import of components.bluetoothcontroller and construction of a controller, an adapter and a scanner,
+    in fresh interpreters (best of repeat). No bus is needed : nothing may connect before first use.
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT], check=True, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        runs.append(json.loads(output))
+    return {'startup_import_ms': min(run['import_ms'] for run in runs),
+            'startup_init_ms': min(run['init_ms'] for run in runs),
+            'startup_eager_modules': sorted(set().union(*(run['modules'] for run in runs)))}
+
+
+def bench_adapter_properties():
+    from components.bluetoothcontroller import Adapter
+
+    adapter = Adapter()
+    results = {f"adapter_{name}_us": measure(lambda: getattr(adapter, name), 10000) * 1e6
+               for name in ADAPTER_PROPERTIES}
+    results['adapter_snapshot_us'] = measure(adapter.snapshot, 10000) * 1e6
+    results['adapter_refresh_us'] = measure(adapter.refresh, 200) * 1e6
+    return results
+
+
+def bench_dbus_to_python(devices=1000):
+    import components.utils as u
+    from fakebluez import device_properties
+
+    payloads = [device_properties(i, c.BluetoothConstants.ADAPTER_PATH) for i in range(devices)]
+
+    def convert_all():
+        for payload in payloads:
+            u.dbus_to_python(payload)
+
+    return {'dbus_to_python_device_per_sec': devices / measure(convert_all, 5)}
+
+
+def bench_controller_handlers(devices=5000):
+    import components.utils as u
+    from components.bluetoothcontroller import BluetoothController
+    from components.coalescer import ChangeCoalescer
+    from components.dispatcher import EventDispatcher
+    from fakebluez import device_properties
+    import dbus
+
+    adapter_path = c.BluetoothConstants.ADAPTER_PATH
+    signals = [(u.device_address_to_path(str(props['Address']), adapter_path),
+                {c.BluetoothConstants.DEVICE_INTERFACE: props})
+               for props in (device_properties(i, adapter_path) for i in range(devices))]
+    changes = [dbus.Dictionary({'RSSI': dbus.Int16(-40 - i % 50)}, signature='sv') for i in range(devices)]
+
+    results = {}
+    for coalesce in (False, True):
+        controller = BluetoothController()
+        controller._scan_adapters = {adapter_path}
+        # every signal goes the whole way.
+        controller.min_rssi = None
+        controller._dispatcher = EventDispatcher(lambda events: None, max_size=4 * devices)
+        controller._dispatcher.start()
+        if coalesce:
+            controller._coalescer = ChangeCoalescer(controller._emit_device_changes, records=controller._devices)
+
+        start = time.perf_counter()
+        for path, interfaces in signals:
+            controller.new_device_found(path, interfaces)
+        added = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for (path, _), changed in zip(signals, changes):
+            controller.device_properties_changed(c.BluetoothConstants.DEVICE_INTERFACE, changed, [], path)
+        changed = time.perf_counter() - start
+        controller._dispatcher.stop(drain=False)
+
+        suffix = '_coalesced' if coalesce else ''
+        if not coalesce:
+            results['interfaces_added_per_sec'] = devices / added
+        results[f'properties_changed{suffix}_per_sec'] = devices / changed
+    return results
+
+
+def bench_found_devices(fake, sizes=(10, 100, 1000, 10000)):
+    import components.utils as u
+    from components.registry import DeviceRegistry
+    from fakebluez import FAKE_CONTROL_INTERFACE
+
+    control = u.bus_connection.get_interface('/', FAKE_CONTROL_INTERFACE)
+    results = {}
+    current = fake.devices
+    for size in sizes:
+        if size > current:
+            control.AddDevices(size - current, timeout=600)
+            current = size
+        results[f'get_found_devices_{size}_ms'] = measure(u.get_found_devices, 3, repeat=3) * 1e3
+
+        registry = DeviceRegistry()
+        registry.load()
+        results[f'get_found_devices_registry_{size}_ms'] = measure(lambda: u.get_found_devices(registry),
+                                                                   3, repeat=3) * 1e3
+    return results
+
+
+def bench_discovery_filter(duration=2, discovery_filter=None):
+    """
+    Run scan-all with and without a discovery filter, count the device signals that reached the
+    process and the ones fakebluez dropped because of the filter.
+    """
+    import components.utils as u
+    from common.logger import LogLevels
+    from components.bluetoothcontroller import BluetoothController, OperationModes
+    from fakebluez import FAKE_CONTROL_INTERFACE
+
+    discovery_filter = discovery_filter or {'RSSI': c.BluetoothConstants.MIN_ACCEPTABLE_VALUE_RSSI}
+    control = u.bus_connection.get_interface('/', FAKE_CONTROL_INTERFACE)
+    level = u.logger.level
+    u.logger.level = LogLevels.WARNING
+    results = {}
+    try:
+        for name, scan_filter in (('unfiltered', None), ('filtered', discovery_filter)):
+            controller = BluetoothController()
+            controller.scan_duration = duration
+            controller.evict_stale_devices = False
+            controller.discovery_filter = scan_filter
+            suppressed = control.GetStats()['suppressed']
+
+            controller.start(OperationModes.SCAN_ALL)
+            time.sleep(duration + 0.5)
+
+            received = controller.metrics.get('interfaces_added') + controller.metrics.get('properties_changed')
+            results[f'discovery_signals_{name}'] = received
+            results[f'discovery_signals_{name}_rejected'] = controller.metrics.get('filter_rejected')
+            results[f'discovery_signals_{name}_saved'] = int(control.GetStats()['suppressed'] - suppressed)
+    finally:
+        u.logger.level = level
+    return results
+
+
+def bench_advertisement(devices=1000):
+    """
+    Decoded advertisements per second, re-advertised payloads (cache hits) and new payloads.
+    """
+    import components.advertisement as adv
+    from fakebluez import device_properties
+
+    payloads = [{'ManufacturerData': {int(key): bytes(value) for key, value in props['ManufacturerData'].items()}}
+                for props in (device_properties(i, c.BluetoothConstants.ADAPTER_PATH) for i in range(devices))]
+
+    def decode_all():
+        for payload in payloads:
+            adv.decode_advertisement(payload)
+
+    def decode_all_uncached():
+        adv.decode_manufacturer_data.cache_clear()
+        decode_all()
+
+    return {'advertisement_cached_per_sec': devices / measure(decode_all, 20),
+            'advertisement_uncached_per_sec': devices / measure(decode_all_uncached, 20)}
+
+
+def bench_proximity(devices=5000, updates=100000, tick_every=10000):
+    """
+    RSSI updates per second through the proximity engine, ticks included.
+    """
+    import random
+    from components.proximity import ProximityEngine, SmoothingMethods
+
+    addresses = [f"02:00:00:00:{i // 256:02X}:{i % 256:02X}" for i in range(devices)]
+    samples = [(addresses[i % devices], random.randint(-95, -35)) for i in range(updates)]
+
+    results = {}
+    for smoothing in (SmoothingMethods.EMA, SmoothingMethods.KALMAN):
+        engine = ProximityEngine(smoothing=smoothing)
+
+        def feed():
+            for i, (address, rssi) in enumerate(samples, 1):
+                engine.update(address, rssi)
+                if i % tick_every == 0:
+                    engine.tick()
+
+        results[f'proximity_{smoothing}_updates_per_sec'] = updates / measure(feed, 1, repeat=3)
+        results[f'proximity_{smoothing}_tick_{devices}_ms'] = engine.metrics.get('tick_ms')
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return : list of (key, baseline value, value) that regressed more than tolerance.
+    """
+    regressions = []
+    for key, value in results.items():
+        old = baseline.get(key)
+        if not isinstance(old, (int, float)) or not old:
+            continue
+        if key.endswith('_per_sec') and value < old * (1 - tolerance):
+            regressions.append((key, old, value))
+        elif key.endswith(('_us', '_ms')) and value > old * (1 + tolerance):
+            regressions.append((key, old, value))
+    return regressions
+
+
+def main():
+    from fakebluez import FakeBluezProcess
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", help="write results to this file")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--max-devices", type=int, default=10000)
+    args = parser.parse_args()
+
+    results = bench_startup()
+    # rates only apply while discovering, i.e. in bench_discovery_filter.
+    with FakeBluezProcess(devices=10, added_rate=100, changed_rate=1000) as fake:
+        results.update(bench_adapter_properties())
+        results.update(bench_dbus_to_python())
+        results.update(bench_advertisement())
+        results.update(bench_controller_handlers())
+        results.update(bench_found_devices(fake, [size for size in (10, 100, 1000, 10000) if size <= args.max_devices]))
+        results.update(bench_discovery_filter())
+    results.update(bench_proximity())
+
+    report = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'results': results}
+    output = json.dumps(report, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        for key, old, value in regressions:
+            print(f"REGRESSION {key} : {old:.3f} -> {value:.3f}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
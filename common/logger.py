@@ -1,32 +1,156 @@
 from datetime import datetime
+import atexit
+import os
+import queue
 import threading
 import json
 import uuid
 
 
+class LogLevels:
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+
+    NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+
 class Logger:
     """
     c: console
     f: file
     * Multiple available. example : "cf"
+
+    Messages are queued and written by a background thread, the log file stays open
+    and is rotated when it grows over max_bytes (0 : no rotation).
+    Messages below level are dropped before they are formatted.
+    json_lines : write file records as JSON lines (id, time, app, level, msg).
     """
 
-    def __init__(self, app_name, lock: threading.Lock, file_name=None):
+    def __init__(self, app_name, lock: threading.Lock, file_name=None, level=LogLevels.INFO,
+                 max_bytes=10 * 1024 * 1024, backup_count=3, json_lines=False, queue_size=10000):
         self.app_name = app_name
         self.file_name = file_name
         self.lock = lock
+        self.level = level
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.json_lines = json_lines
 
         if self.file_name is None:
             self.file_name = self.app_name + ".log"
 
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def is_enabled_for(self, level):
+        return level >= self.level
+
     def log_direct(self, log_data, log_type):
+        self.log(LogLevels.INFO, log_data, log_type=log_type)
+
+    def log(self, level, msg, *args, log_type='c'):
+        """
+        Queue a message, msg % args is formatted on the writer thread.
+        """
+        if level < self.level:
+            return
+        self._start_writer()
+        try:
+            self._queue.put_nowait((level, msg, args, log_type, datetime.now()))
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, msg, *args, log_type='c'):
+        self.log(LogLevels.DEBUG, msg, *args, log_type=log_type)
+
+    def info(self, msg, *args, log_type='c'):
+        self.log(LogLevels.INFO, msg, *args, log_type=log_type)
+
+    def warning(self, msg, *args, log_type='c'):
+        self.log(LogLevels.WARNING, msg, *args, log_type=log_type)
+
+    def error(self, msg, *args, log_type='c'):
+        self.log(LogLevels.ERROR, msg, *args, log_type=log_type)
+
+    def flush(self):
+        """
+        Block until every queued message is written.
+        """
+        if self._writer is not None:
+            self._queue.join()
+
+    def close(self):
+        with self._writer_lock:
+            writer = self._writer
+            self._writer = None
+        if writer is None:
+            return
+        self._queue.put(None)
+        writer.join()
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _start_writer(self):
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name=f"{self.app_name}-logger", daemon=True)
+                self._writer.start()
+                atexit.register(self.close)
+
+    def _write_loop(self):
+        while True:
+            record = self._queue.get()
+            try:
+                if record is None:
+                    return
+                self._write(*record)
+            except Exception as e:
+                print(f"Error at Logger : {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, level, msg, args, log_type, created):
+        log_data = msg % args if args else str(msg)
+
         if "f" in log_type:
-            self.lock.acquire()
-            with open(self.file_name, 'a') as log_file:
-                log_file.write(log_data)
-            self.lock.release()
+            if self.json_lines:
+                line = json.dumps({'id': uuid.uuid4().hex, 'time': created.isoformat(), 'app': self.app_name,
+                                   'level': LogLevels.NAMES.get(level, level), 'msg': log_data})
+            else:
+                line = log_data
+            with self.lock:
+                self._write_file(line + "\n")
 
         if "c" in log_type:
             print(log_data)
 
+    def _write_file(self, line):
+        if self._file is None:
+            self._file = open(self.file_name, 'a')
+        if self.max_bytes and self._file.tell() + len(line) > self.max_bytes:
+            self._rotate()
+        self._file.write(line)
+        if self._queue.empty():
+            self._file.flush()
 
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.file_name}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.file_name}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.file_name, self.file_name + ".1")
+        else:
+            os.remove(self.file_name)
+        self._file = open(self.file_name, 'a')
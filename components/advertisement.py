@@ -0,0 +1,132 @@
+import collections
+import functools
+import struct
+import uuid
+
+import components.conf as c
+
+APPLE_COMPANY_ID = 0x004C
+RUUVI_COMPANY_ID = 0x0499
+EDDYSTONE_UUID = '0000feaa-0000-1000-8000-00805f9b34fb'
+
+IBeacon = collections.namedtuple('IBeacon', 'uuid major minor tx_power')
+AltBeacon = collections.namedtuple('AltBeacon', 'company_id uuid major minor tx_power reserved')
+EddystoneUID = collections.namedtuple('EddystoneUID', 'namespace instance tx_power')
+EddystoneURL = collections.namedtuple('EddystoneURL', 'url tx_power')
+EddystoneTLM = collections.namedtuple('EddystoneTLM', 'version battery_mv temperature adv_count uptime_sec')
+RuuviData = collections.namedtuple('RuuviData', 'temperature humidity pressure acceleration battery_mv tx_power '
+                                                'movements sequence mac')
+
+# type 0x02, length 0x15, proximity UUID, major, minor, measured power at 1m
+_IBEACON = struct.Struct('>BB16sHHb')
+# beacon code 0xBEAC, beacon id (UUID, major, minor), reference RSSI, reserved
+_ALTBEACON = struct.Struct('>H16sHHbB')
+# frame type, tx power at 0m, namespace, instance (2 reserved bytes may follow)
+_EDDYSTONE_UID = struct.Struct('>Bb10s6s')
+# frame type, tx power at 0m, URL scheme, encoded URL follows
+_EDDYSTONE_URL = struct.Struct('>BbB')
+# frame type, version, battery mV, temperature (8.8 fixed point), advertisements, uptime (0.1s)
+_EDDYSTONE_TLM = struct.Struct('>BBHhII')
+# RAWv2 : format 5, temperature, humidity, pressure, acceleration x y z, power info, movements, sequence, MAC
+_RUUVI_V5 = struct.Struct('>BhHHhhhHBH6s')
+
+_URL_SCHEMES = ('http://www.', 'https://www.', 'http://', 'https://')
+_URL_EXPANSIONS = ('.com/', '.org/', '.edu/', '.net/', '.info/', '.biz/', '.gov/',
+                   '.com', '.org', '.edu', '.net', '.info', '.biz', '.gov')
+
+
+def _ibeacon(data):
+    if len(data) != _IBEACON.size or data[0] != 0x02 or data[1] != 0x15:
+        return None
+    _, _, proximity_uuid, major, minor, tx_power = _IBEACON.unpack(data)
+    return IBeacon(str(uuid.UUID(bytes=proximity_uuid)), major, minor, tx_power)
+
+
+def _altbeacon(company_id, data):
+    if len(data) != _ALTBEACON.size or data[0] != 0xBE or data[1] != 0xAC:
+        return None
+    _, beacon_uuid, major, minor, tx_power, reserved = _ALTBEACON.unpack(data)
+    return AltBeacon(company_id, str(uuid.UUID(bytes=beacon_uuid)), major, minor, tx_power, reserved)
+
+
+def _ruuvi(data):
+    if len(data) != _RUUVI_V5.size or data[0] != 5:
+        return None
+    _, temperature, humidity, pressure, x, y, z, power, movements, sequence, mac = _RUUVI_V5.unpack(data)
+    return RuuviData(temperature * 0.005, humidity * 0.0025, pressure + 50000, (x, y, z),
+                     (power >> 5) + 1600, (power & 0x1F) * 2 - 40, movements, sequence,
+                     ':'.join('%02X' % byte for byte in mac))
+
+
+def _eddystone(data):
+    if not data:
+        return None
+    frame_type = data[0]
+    if frame_type == 0x00 and len(data) >= _EDDYSTONE_UID.size:
+        _, tx_power, namespace, instance = _EDDYSTONE_UID.unpack_from(data)
+        return EddystoneUID(namespace.hex(), instance.hex(), tx_power)
+    if frame_type == 0x10 and len(data) > _EDDYSTONE_URL.size:
+        _, tx_power, scheme = _EDDYSTONE_URL.unpack_from(data)
+        if scheme >= len(_URL_SCHEMES):
+            return None
+        url = [_URL_SCHEMES[scheme]]
+        for byte in data[_EDDYSTONE_URL.size:]:
+            url.append(_URL_EXPANSIONS[byte] if byte < len(_URL_EXPANSIONS) else chr(byte))
+        return EddystoneURL(''.join(url), tx_power)
+    if frame_type == 0x20 and len(data) == _EDDYSTONE_TLM.size:
+        _, version, battery_mv, temperature, adv_count, uptime = _EDDYSTONE_TLM.unpack(data)
+        return EddystoneTLM(version, battery_mv, temperature / 256, adv_count, uptime / 10)
+    return None
+
+
+@functools.lru_cache(maxsize=c.BluetoothConstants.ADVERTISEMENT_CACHE_SIZE)
+def decode_manufacturer_data(company_id: int, data: bytes):
+    """
+    Return : IBeacon, AltBeacon or RuuviData decoded from one ManufacturerData entry, None if unknown.
+    Results are cached by (company_id, data), beacons re-advertise the same bytes.
+    """
+    if company_id == APPLE_COMPANY_ID:
+        return _ibeacon(data)
+    if company_id == RUUVI_COMPANY_ID:
+        return _ruuvi(data)
+    return _altbeacon(company_id, data)
+
+
+@functools.lru_cache(maxsize=c.BluetoothConstants.ADVERTISEMENT_CACHE_SIZE)
+def decode_service_data(service_uuid: str, data: bytes):
+    """
+    Return : EddystoneUID, EddystoneURL or EddystoneTLM decoded from one ServiceData entry, None if unknown.
+    Results are cached by (service_uuid, data).
+    """
+    if service_uuid.lower() == EDDYSTONE_UUID:
+        return _eddystone(data)
+    return None
+
+
+def decode_advertisement(device_properties):
+    """
+    Decode ManufacturerData and ServiceData of Device1 properties (as converted by utils.dbus_to_python).
+    Return : list of decoded frames, empty if none is known.
+    """
+    decoded = []
+    manufacturer_data = device_properties.get('ManufacturerData')
+    if manufacturer_data:
+        for company_id, data in manufacturer_data.items():
+            frame = decode_manufacturer_data(int(company_id), bytes(data))
+            if frame is not None:
+                decoded.append(frame)
+    service_data = device_properties.get('ServiceData')
+    if service_data:
+        for service_uuid, data in service_data.items():
+            frame = decode_service_data(str(service_uuid), bytes(data))
+            if frame is not None:
+                decoded.append(frame)
+    return decoded
+
+
+def cache_info():
+    """
+    Return : {'manufacturer_data' : lru_cache info, 'service_data' : lru_cache info}
+    """
+    return {'manufacturer_data': decode_manufacturer_data.cache_info(),
+            'service_data': decode_service_data.cache_info()}
@@ -0,0 +1,136 @@
+from concurrent import futures
+
+import dbus
+import dbus.service
+
+import components.conf as c
+import components.utils as u
+
+
+class AgentCapabilities:
+    DISPLAY_ONLY = 'DisplayOnly'
+    DISPLAY_YES_NO = 'DisplayYesNo'
+    KEYBOARD_ONLY = 'KeyboardOnly'
+    NO_INPUT_NO_OUTPUT = 'NoInputNoOutput'
+    KEYBOARD_DISPLAY = 'KeyboardDisplay'
+
+
+class Rejected(dbus.DBusException):
+    _dbus_error_name = "org.bluez.Error.Rejected"
+
+
+class PairingAgent(dbus.service.Object):
+    """
+    org.bluez.Agent1 that accepts pairing requests without user interaction.
+        pin_code : returned for legacy pairing (RequestPinCode)
+        passkey : returned for RequestPasskey
+        accept : callable(device_path) -> bool, decides confirmations/authorizations, None accepts all
+    """
+
+    def __init__(self, bus, path=c.BluetoothConstants.AGENT_PATH,
+                 capability=c.BluetoothConstants.AGENT_CAPABILITY, pin_code="0000", passkey=0, accept=None):
+        super().__init__(bus, path)
+        self.path = path
+        self.capability = capability
+        self.pin_code = pin_code
+        self.passkey = passkey
+        self.accept = accept
+        self.registered = False
+
+    def register(self, default=True):
+        """
+        Register with org.bluez.AgentManager1, default=True makes it the default agent.
+        Return : true(success), false(fail)
+        """
+        manager = u.bus_connection.get_interface(c.BluetoothConstants.AGENT_MANAGER_PATH,
+                                                 c.BluetoothConstants.AGENT_MANAGER_INTERFACE)
+        try:
+            manager.RegisterAgent(self.path, self.capability)
+            if default:
+                manager.RequestDefaultAgent(self.path)
+        except dbus.exceptions.DBusException as e:
+            u.log_direct(f"Error at PairingAgent.register() : {str(e.args)}", c.LOG_TYPE)
+            return False
+        self.registered = True
+        return True
+
+    def register_async(self, default=True):
+        """
+        register() without blocking, for callers on the main loop thread.
+        Return : concurrent.futures.Future of true(success), false(fail)
+        """
+        future = futures.Future()
+        manager = u.bus_connection.get_interface(c.BluetoothConstants.AGENT_MANAGER_PATH,
+                                                 c.BluetoothConstants.AGENT_MANAGER_INTERFACE)
+
+        def on_default(result, error):
+            if error is not None:
+                u.log_direct(f"Error at PairingAgent.register_async() : {error}", c.LOG_TYPE)
+            future.set_result(error is None)
+
+        def on_registered(result, error):
+            if error is not None:
+                u.log_direct(f"Error at PairingAgent.register_async() : {error}", c.LOG_TYPE)
+                future.set_result(False)
+                return
+            self.registered = True
+            if default:
+                u.call_async(manager.RequestDefaultAgent, self.path, callback=on_default)
+            else:
+                future.set_result(True)
+
+        u.call_async(manager.RegisterAgent, self.path, self.capability, callback=on_registered)
+        return future
+
+    def unregister(self):
+        if not self.registered:
+            return
+        manager = u.bus_connection.get_interface(c.BluetoothConstants.AGENT_MANAGER_PATH,
+                                                 c.BluetoothConstants.AGENT_MANAGER_INTERFACE)
+        try:
+            manager.UnregisterAgent(self.path)
+        except dbus.exceptions.DBusException as e:
+            u.log_direct(f"Error at PairingAgent.unregister() : {str(e.args)}", c.LOG_TYPE)
+        self.registered = False
+
+    def _check(self, device):
+        if self.accept is not None and not self.accept(str(device)):
+            raise Rejected("Rejected by agent")
+
+    @dbus.service.method(c.BluetoothConstants.AGENT_INTERFACE, in_signature="", out_signature="")
+    def Release(self):
+        self.registered = False
+
+    @dbus.service.method(c.BluetoothConstants.AGENT_INTERFACE, in_signature="os", out_signature="")
+    def AuthorizeService(self, device, uuid):
+        self._check(device)
+
+    @dbus.service.method(c.BluetoothConstants.AGENT_INTERFACE, in_signature="o", out_signature="s")
+    def RequestPinCode(self, device):
+        self._check(device)
+        return self.pin_code
+
+    @dbus.service.method(c.BluetoothConstants.AGENT_INTERFACE, in_signature="o", out_signature="u")
+    def RequestPasskey(self, device):
+        self._check(device)
+        return dbus.UInt32(self.passkey)
+
+    @dbus.service.method(c.BluetoothConstants.AGENT_INTERFACE, in_signature="ouq", out_signature="")
+    def DisplayPasskey(self, device, passkey, entered):
+        pass
+
+    @dbus.service.method(c.BluetoothConstants.AGENT_INTERFACE, in_signature="os", out_signature="")
+    def DisplayPinCode(self, device, pincode):
+        pass
+
+    @dbus.service.method(c.BluetoothConstants.AGENT_INTERFACE, in_signature="ou", out_signature="")
+    def RequestConfirmation(self, device, passkey):
+        self._check(device)
+
+    @dbus.service.method(c.BluetoothConstants.AGENT_INTERFACE, in_signature="o", out_signature="")
+    def RequestAuthorization(self, device):
+        self._check(device)
+
+    @dbus.service.method(c.BluetoothConstants.AGENT_INTERFACE, in_signature="", out_signature="")
+    def Cancel(self):
+        pass
@@ -0,0 +1,202 @@
+import asyncio
+import collections
+import threading
+
+import components.conf as c
+import components.utils as u
+from components.dispatcher import DeviceEvents
+from components.lazyimport import lazy_import
+from components.mainloop import MainLoopThread
+from components.subscriptions import SignalRouter
+
+dbus = lazy_import('dbus')
+
+DeviceEvent = collections.namedtuple('DeviceEvent', ['kind', 'path', 'address', 'properties'])
+
+
+class _EventBridge:
+    """
+    Moves events from the GLib thread to an asyncio loop.
+    Events are buffered and the loop is woken up once per batch, not once per signal.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        self._scheduled = False
+
+        self.queues = set()
+
+    def push(self, event):
+        with self._lock:
+            self._pending.append(event)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._loop.call_soon_threadsafe(self._drain)
+
+    def _drain(self):
+        with self._lock:
+            events = self._pending
+            self._pending = collections.deque()
+            self._scheduled = False
+
+        for queue in self.queues:
+            for event in events:
+                queue.put_nowait(event)
+
+
+class AsyncBluetoothController:
+    """
+    asyncio front-end of the BlueZ adapter.
+    Signals are received on the shared GLib main loop thread (components.mainloop) and D-Bus
+    methods are called with reply handlers, so no thread is blocked or started per scan.
+
+        async for event in controller.discover(duration=30):
+            print(event.kind, event.address, event.properties)
+    """
+
+    def __init__(self, adapter_path=c.BluetoothConstants.ADAPTER_PATH):
+        self.adapter_path = adapter_path
+
+        self._bridge = None
+        self._subscriptions = []
+        self._discovering = 0
+
+    # D-Bus calls.
+
+    async def _call(self, path, interface, method, *args):
+        iface = u.bus_connection.get_interface(path, interface)
+        return await asyncio.wrap_future(u.call_async(getattr(iface, method), *args))
+
+    async def get_properties(self):
+        """
+        Return : all adapter properties as dict.
+        """
+        return await self._call(self.adapter_path, c.BluetoothConstants.DBUS_PROPERTIES, 'GetAll',
+                                c.BluetoothConstants.ADAPTER_INTERFACE)
+
+    async def get_property(self, name):
+        return await self._call(self.adapter_path, c.BluetoothConstants.DBUS_PROPERTIES, 'Get',
+                                c.BluetoothConstants.ADAPTER_INTERFACE, name)
+
+    async def set_property(self, name, value):
+        await self._call(self.adapter_path, c.BluetoothConstants.DBUS_PROPERTIES, 'Set',
+                         c.BluetoothConstants.ADAPTER_INTERFACE, name, value)
+
+    async def powered(self):
+        return await self.get_property('Powered')
+
+    async def discoverable(self):
+        return await self.get_property('Discoverable')
+
+    async def discovering(self):
+        return await self.get_property('Discovering')
+
+    async def pairable(self):
+        return await self.get_property('Pairable')
+
+    async def alias(self):
+        return await self.get_property('Alias')
+
+    async def set_powered(self, powered: bool):
+        await self.set_property('Powered', dbus.Boolean(powered))
+
+    async def set_discoverable(self, discoverable: bool):
+        await self.set_property('Discoverable', dbus.Boolean(discoverable))
+
+    async def set_pairable(self, pairable: bool):
+        await self.set_property('Pairable', dbus.Boolean(pairable))
+
+    async def set_alias(self, alias: str):
+        await self.set_property('Alias', dbus.String(alias))
+
+    async def start_discovery(self):
+        await self._call(self.adapter_path, c.BluetoothConstants.ADAPTER_INTERFACE, 'StartDiscovery')
+
+    async def stop_discovery(self):
+        await self._call(self.adapter_path, c.BluetoothConstants.ADAPTER_INTERFACE, 'StopDiscovery')
+
+    # discovery.
+
+    async def discover(self, duration=None):
+        """
+        Async iterator of DeviceEvent while discovery is running.
+            :param duration : stop after duration seconds, None = until the iterator is closed.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        self._subscribe(loop, queue)
+
+        try:
+            if self._discovering == 1:
+                await self.start_discovery()
+
+            deadline = None if duration is None else loop.time() + duration
+            while True:
+                timeout = None if deadline is None else deadline - loop.time()
+                if timeout is not None and timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                yield event
+        finally:
+            if self._unsubscribe(queue) == 0:
+                try:
+                    await self.stop_discovery()
+                except dbus.exceptions.DBusException as e:
+                    u.log_direct(f"Error at AsyncBluetoothController.discover() : {str(e.args)}", c.LOG_TYPE)
+
+    def _subscribe(self, loop, queue):
+        if self._bridge is None or self._bridge._loop is not loop:
+            self._bridge = _EventBridge(loop)
+        self._bridge.queues.add(queue)
+        self._discovering += 1
+
+        if self._subscriptions:
+            return
+
+        MainLoopThread.get()
+        # only the devices of the adapter wake the process (components.subscriptions).
+        router = SignalRouter.get()
+        self._subscriptions = [
+            router.subscribe(c.BluetoothConstants.DBUS_OM_IFACE, "InterfacesAdded", self._on_interfaces_added,
+                             path='/', arg0path=self.adapter_path + '/'),
+            router.subscribe(c.BluetoothConstants.DBUS_OM_IFACE, "InterfacesRemoved", self._on_interfaces_removed,
+                             path='/', arg0path=self.adapter_path + '/'),
+            router.subscribe(c.BluetoothConstants.DBUS_PROPERTIES, "PropertiesChanged", self._on_properties_changed,
+                             path_namespace=self.adapter_path, arg0=c.BluetoothConstants.DEVICE_INTERFACE,
+                             path_keyword='path'),
+        ]
+
+    def _unsubscribe(self, queue):
+        self._bridge.queues.discard(queue)
+        self._discovering -= 1
+        if self._discovering == 0:
+            for subscription in self._subscriptions:
+                subscription.remove()
+            self._subscriptions = []
+        return self._discovering
+
+    # signal handlers, GLib thread, only called for paths below adapter_path.
+
+    def _on_interfaces_added(self, path, interfaces):
+        path = str(path)
+        if c.BluetoothConstants.DEVICE_INTERFACE not in interfaces:
+            return
+        properties, _ = u.get_device_properties_from_signal(path, interfaces)
+        self._bridge.push(DeviceEvent(DeviceEvents.FOUND, path, properties.get('Address'), properties))
+
+    def _on_interfaces_removed(self, path, interfaces):
+        path = str(path)
+        if c.BluetoothConstants.DEVICE_INTERFACE not in interfaces:
+            return
+        self._bridge.push(DeviceEvent(DeviceEvents.REMOVED, path, u.path_to_device_address(path), {}))
+
+    def _on_properties_changed(self, interface, changed, invalidated, path):
+        path = str(path)
+        self._bridge.push(DeviceEvent(DeviceEvents.CHANGED, path, u.path_to_device_address(path),
+                                      u.dbus_to_python(changed)))
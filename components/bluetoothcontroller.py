@@ -1,119 +1,234 @@
 import time
 
-import dbus
 import threading
 import components.conf as c
 import components.utils as u
-from gi.repository import GObject
-from dbus.mainloop.glib import DBusGMainLoop
+from common.logger import LogLevels
+from components.advertisement import decode_advertisement
+from components.coalescer import ChangeCoalescer
+from components.device import DeviceRecord, memory_per_device
+from components.discovery import DiscoveryFilter
+from components.eviction import DeviceEvictor
+from components.dispatcher import DeviceEvents, EventDispatcher
+from components.lazyimport import lazy_import
+from components.mainloop import MainLoopThread
+from components.metrics import Metrics
+from components.pairing import PairingPipeline, PairingResult
+from components.proximity import ProximityEngine
+from components.scheduler import ScanScheduler, ScanStates
+from components.store import DeviceStore
+from components.subscriptions import SignalRouter
+
+dbus = lazy_import('dbus')
+GObject = lazy_import('gi.repository.GObject')
+
+# D-Bus types of the writable org.bluez.Adapter1 properties (names in dbus, resolved on use).
+_ADAPTER_PROPERTY_TYPES = {
+    'Powered': 'Boolean',
+    'Discoverable': 'Boolean',
+    'Pairable': 'Boolean',
+    'Alias': 'String',
+    'DiscoverableTimeout': 'UInt32',
+    'PairableTimeout': 'UInt32',
+}
 
 
 class Adapter:
-    def __init__(self):
-        self.__adapter_interface = u.get_bt_adapter()
-        self.__properties_interface = u.get_adapter_props_iface()
+    """
+    org.bluez.Adapter1 with cached properties. Connects lazily : proxies, the PropertiesChanged
+    subscription and the first GetAll are made on first use, not at construction.
+    The cache follows PropertiesChanged, dispatched by the shared main loop thread (components.mainloop).
+    """
+
+    def __init__(self, adapter_path=c.BluetoothConstants.ADAPTER_PATH):
+        self.path = adapter_path
+        self.__adapter_iface = None
+        self.__properties_iface = None
+        self.__properties_match = None
+
+        # local copy of org.bluez.Adapter1 properties, kept current by PropertiesChanged.
+        self.__properties_lock = threading.RLock()
+        self.__adapter_properties = {}
+        self.__stale = True
+
+        # filter set by this process, BlueZ keeps one per D-Bus client.
+        self.discovery_filter = None
+
+    @property
+    def __adapter_interface(self):
+        if self.__adapter_iface is None:
+            self.__connect()
+        return self.__adapter_iface
+
+    @property
+    def __properties_interface(self):
+        if self.__properties_iface is None:
+            self.__connect()
+        return self.__properties_iface
+
+    def __connect(self):
+        with self.__properties_lock:
+            if self.__properties_iface is not None:
+                return
+            self.__adapter_iface = u.bus_connection.get_interface(self.path, c.BluetoothConstants.ADAPTER_INTERFACE)
+            properties_iface = u.get_adapter_props_iface(self.path)
+            # PropertiesChanged only reaches the cache while a GLib loop dispatches.
+            MainLoopThread.get()
+            self.__properties_match = properties_iface.connect_to_signal(
+                "PropertiesChanged", self.__on_properties_changed, arg0=c.BluetoothConstants.ADAPTER_INTERFACE)
+            self.__properties_iface = properties_iface
+
+    def refresh(self):
+        """
+        Reload all adapter properties with a single GetAll call.
+        Return : snapshot of the adapter properties (dict)
+        """
+        properties = u.dbus_to_python(self.__properties_interface.GetAll(c.BluetoothConstants.ADAPTER_INTERFACE))
+        with self.__properties_lock:
+            self.__adapter_properties = properties
+            self.__stale = False
+            return dict(self.__adapter_properties)
+
+    def snapshot(self):
+        """
+        Return : all cached adapter properties as dict, no D-Bus round-trip.
+        """
+        with self.__properties_lock:
+            if self.__stale:
+                return self.refresh()
+            return dict(self.__adapter_properties)
 
-        self.__adapter_properties = self.__properties_interface.GetAll('org.bluez.Adapter1')
+    def close(self):
+        """
+        Stop tracking PropertiesChanged signals of the adapter.
+        """
+        if self.__properties_match is not None:
+            self.__properties_match.remove()
+            self.__properties_match = None
+        with self.__properties_lock:
+            self.__stale = True
+
+    def __on_properties_changed(self, interface, changed, invalidated):
+        if interface != c.BluetoothConstants.ADAPTER_INTERFACE:
+            return
+        with self.__properties_lock:
+            self.__adapter_properties.update(u.dbus_to_python(changed))
+            if invalidated:
+                self.__stale = True
+
+    def __get_property(self, name):
+        with self.__properties_lock:
+            if self.__stale:
+                self.refresh()
+            return self.__adapter_properties[name]
+
+    def __set_property(self, name, value):
+        self.__properties_interface.Set(c.BluetoothConstants.ADAPTER_INTERFACE, name, value)
+        with self.__properties_lock:
+            self.__adapter_properties[name] = u.dbus_to_python(value)
 
     @property
     def uuids(self):
-        self.__adapter_properties = self.__properties_interface.GetAll('org.bluez.Adapter1')
-        uuids = u.dbus_to_python(self.__adapter_properties['UUIDs'])
-        return uuids
+        return list(self.__get_property('UUIDs'))
 
     @property
     def discoverable(self):
-        self.__adapter_properties = self.__properties_interface.GetAll('org.bluez.Adapter1')
-        discoverable = u.dbus_to_python(self.__adapter_properties['Discoverable'])
-        return discoverable
+        return self.__get_property('Discoverable')
 
     @property
     def discovering(self):
-        self.__adapter_properties = self.__properties_interface.GetAll('org.bluez.Adapter1')
-        discovering = u.dbus_to_python(self.__adapter_properties['Discovering'])
-        return discovering
+        return self.__get_property('Discovering')
 
     @property
     def pairable(self):
-        self.__adapter_properties = self.__properties_interface.GetAll('org.bluez.Adapter1')
-        pairable = u.dbus_to_python(self.__adapter_properties['Pairable'])
-        return pairable
+        return self.__get_property('Pairable')
 
     @property
     def powered(self):
-        self.__adapter_properties = self.__properties_interface.GetAll('org.bluez.Adapter1')
-        powered = u.dbus_to_python(self.__adapter_properties['Powered'])
-        return powered
+        return self.__get_property('Powered')
 
     @property
     def address(self):
-        self.__adapter_properties = self.__properties_interface.GetAll('org.bluez.Adapter1')
-        address = u.dbus_to_python(self.__adapter_properties['Address'])
-        return address
+        return self.__get_property('Address')
 
     @property
     def alias(self):
-        self.__adapter_properties = self.__properties_interface.GetAll('org.bluez.Adapter1')
-        alias = u.dbus_to_python(self.__adapter_properties['Alias'])
-        return alias
+        return self.__get_property('Alias')
 
     def modalias(self):
-        self.__adapter_properties = self.__properties_interface.GetAll('org.bluez.Adapter1')
-        modalias = u.dbus_to_python(self.__adapter_properties['Modalias'])
-        return modalias
+        return self.__get_property('Modalias')
 
     @property
     def name(self):
-        self.__adapter_properties = self.__properties_interface.GetAll('org.bluez.Adapter1')
-        name = u.dbus_to_python(self.__adapter_properties['Name'])
-        return name
+        return self.__get_property('Name')
 
     @property
     def _class(self):
-        self.__adapter_properties = self.__properties_interface.GetAll('org.bluez.Adapter1')
-        _class = u.dbus_to_python(self.__adapter_properties['Class'])
-        return _class
+        return self.__get_property('Class')
 
     @property
     def discoverable_timeout(self):
-        self.__adapter_properties = self.__properties_interface.GetAll('org.bluez.Adapter1')
-        discoverable_timeout = u.dbus_to_python(self.__adapter_properties['DiscoverableTimeout'])
-        return discoverable_timeout
+        return self.__get_property('DiscoverableTimeout')
 
     @property
     def pairable_timeout(self):
-        self.__adapter_properties = self.__properties_interface.GetAll('org.bluez.Adapter1')
-        pairable_timeout = u.dbus_to_python(self.__adapter_properties['PairableTimeout'])
-        return pairable_timeout
+        return self.__get_property('PairableTimeout')
 
     def set_discoverable(self, discoverable: bool):
-        self.__properties_interface.Set('org.bluez.Adapter1', 'Discoverable', discoverable)
+        self.__set_property('Discoverable', dbus.Boolean(discoverable))
 
     def set_pairable(self, pairable: bool):
-        self.__properties_interface.Set('org.bluez.Adapter1', 'Pairable', pairable)
+        self.__set_property('Pairable', dbus.Boolean(pairable))
 
     def set_powered(self, powered: bool):
-        self.__properties_interface.Set('org.bluez.Adapter1', 'Powered', powered)
+        self.__set_property('Powered', dbus.Boolean(powered))
 
     def set_alias(self, alias: str):
-        self.__properties_interface.Set('org.bluez.Adapter1', 'Alias', alias)
+        self.__set_property('Alias', dbus.String(alias))
 
     def set_discoverable_timeout(self, discoverable_timeout: int):
-        self.__properties_interface.Set('org.bluez.Adapter1', 'DiscoverableTimeout', discoverable_timeout)
+        self.__set_property('DiscoverableTimeout', dbus.UInt32(discoverable_timeout))
 
     def set_pairable_timeout(self, pairable_timeout: int):
-        self.__properties_interface.Set('org.bluez.Adapter1', 'PairableTimeout', pairable_timeout)
+        self.__set_property('PairableTimeout', dbus.UInt32(pairable_timeout))
+
+    def get_discovery_filters(self):
+        """
+        Return : filter names supported by the adapter (list)
+        """
+        return list(u.dbus_to_python(self.__adapter_interface.GetDiscoveryFilters()))
+
+    def set_discovery_filter(self, discovery_filter):
+        """
+        discovery_filter : DiscoveryFilter or dict (see DiscoveryFilter.from_dict), None clears the filter.
+        Return : true(success), false(fail)
+        """
+        discovery_filter = DiscoveryFilter.from_dict(discovery_filter)
+        arguments = discovery_filter.to_dbus() if discovery_filter is not None else dbus.Dictionary({}, signature='sv')
+        try:
+            self.__adapter_interface.SetDiscoveryFilter(arguments)
+        except dbus.exceptions.DBusException as e:
+            u.log_direct(f"Error at Adapter.set_discovery_filter() : {str(e.args)}", c.LOG_TYPE)
+            return False
+
+        self.discovery_filter = discovery_filter
+        return True
 
-    def start_discovery(self):
+    def start_discovery(self, discovery_filter=None):
         """
+        discovery_filter : set before starting if given (see set_discovery_filter)
         Return : true(success), false(fail)
         """
+        if discovery_filter is not None and not self.set_discovery_filter(discovery_filter):
+            return False
         try:
             self.__adapter_interface.StartDiscovery(byte_arrays=True)
         except dbus.exceptions.DBusException as e:
             u.log_direct(f"Error at Adapter.start_discovery() : {str(e.args)}", c.LOG_TYPE)
             return False
 
+        with self.__properties_lock:
+            self.__adapter_properties['Discovering'] = True
         return True
 
     def stop_discovery(self):
@@ -126,22 +241,101 @@ class Adapter:
             u.log_direct(f"Error at Adapter.stop_discovery() : {str(e.args)}", c.LOG_TYPE)
             return False
 
+        with self.__properties_lock:
+            self.__adapter_properties['Discovering'] = False
         return True
 
+    # non-blocking variants : return a concurrent.futures.Future, callback(result, error) runs on the
+    # GLib main loop thread (see utils.call_async). The property cache is updated before either.
+
+    def __call_async(self, method, *args, on_success=None, callback=None):
+        def on_done(result, error):
+            if error is None and on_success is not None:
+                with self.__properties_lock:
+                    on_success(result)
+            if callback is not None:
+                callback(result, error)
+
+        return u.call_async(method, *args, callback=on_done)
+
+    def __cache_property(self, name, value):
+        self.__adapter_properties[name] = value
+
+    def __set_property_async(self, name, value, callback=None):
+        value = getattr(dbus, _ADAPTER_PROPERTY_TYPES[name])(value)
+        return self.__call_async(self.__properties_interface.Set, c.BluetoothConstants.ADAPTER_INTERFACE, name, value,
+                                 on_success=lambda _: self.__cache_property(name, u.dbus_to_python(value)),
+                                 callback=callback)
+
+    def set_properties_async(self, properties, callback=None):
+        """
+        Write several properties at once, e.g. {'Powered': True, 'Alias': 'line-3'}; the Set calls are
+        in flight together instead of one round-trip after the other.
+        Return : list of futures, in the order of properties.
+        """
+        return [self.__set_property_async(name, value, callback) for name, value in properties.items()]
+
+    def set_powered_async(self, powered: bool, callback=None):
+        return self.__set_property_async('Powered', powered, callback)
+
+    def set_discoverable_async(self, discoverable: bool, callback=None):
+        return self.__set_property_async('Discoverable', discoverable, callback)
+
+    def set_pairable_async(self, pairable: bool, callback=None):
+        return self.__set_property_async('Pairable', pairable, callback)
+
+    def set_alias_async(self, alias: str, callback=None):
+        return self.__set_property_async('Alias', alias, callback)
+
+    def set_discoverable_timeout_async(self, discoverable_timeout: int, callback=None):
+        return self.__set_property_async('DiscoverableTimeout', discoverable_timeout, callback)
+
+    def set_pairable_timeout_async(self, pairable_timeout: int, callback=None):
+        return self.__set_property_async('PairableTimeout', pairable_timeout, callback)
+
+    def refresh_async(self, callback=None):
+        """
+        Future of the adapter properties (dict), see refresh.
+        """
+        def on_success(properties):
+            self.__adapter_properties = dict(properties)
+            self.__stale = False
+
+        return self.__call_async(self.__properties_interface.GetAll, c.BluetoothConstants.ADAPTER_INTERFACE,
+                                 on_success=on_success, callback=callback)
+
+    def set_discovery_filter_async(self, discovery_filter, callback=None):
+        discovery_filter = DiscoveryFilter.from_dict(discovery_filter)
+        arguments = discovery_filter.to_dbus() if discovery_filter is not None else dbus.Dictionary({}, signature='sv')
+        return self.__call_async(self.__adapter_interface.SetDiscoveryFilter, arguments,
+                                 on_success=lambda _: setattr(self, 'discovery_filter', discovery_filter),
+                                 callback=callback)
+
+    def start_discovery_async(self, callback=None):
+        return self.__call_async(self.__adapter_interface.StartDiscovery,
+                                 on_success=lambda _: self.__cache_property('Discovering', True),
+                                 callback=callback)
+
+    def stop_discovery_async(self, callback=None):
+        return self.__call_async(self.__adapter_interface.StopDiscovery,
+                                 on_success=lambda _: self.__cache_property('Discovering', False),
+                                 callback=callback)
+
 
 class BluetoothScanner:
     SCAN_IN_PROGRESS = 9
     SCAN_STARTED = 8
 
-    def __init__(self):
+    def __init__(self, adapter_path=c.BluetoothConstants.ADAPTER_PATH):
         self.is_running = False
         self.done = None
 
         self._system_bus = None
 
-        self.__adapter = Adapter()
-        self._scanner_mainloop = None
+        self.__adapter = Adapter(adapter_path)
         self._timer_id = None
+        self._stopped = threading.Event()
+        self._subscription = None
 
         self._callback_mutex = threading.RLock()
 
@@ -149,8 +343,8 @@ class BluetoothScanner:
         self._new_device_discovered = None
         self._completed = None
 
-        self._scanner_thread = None
-        DBusGMainLoop(set_as_default=True)
+        self._scheduler = None
+        self.metrics = Metrics()
 
     @property
     def on_completed(self):
@@ -170,23 +364,36 @@ class BluetoothScanner:
         with self._callback_mutex:
             self._new_device_discovered = func
 
-    def start_discovery_blocking(self, scan_sec=15):
+    def start_discovery_blocking(self, scan_sec=15, discovery_filter=None):
+        """
+        Scan for scan_sec seconds, scan_sec None : scan in duty cycles (ScanScheduler) until scan_timeout().
+        discovery_filter : DiscoveryFilter or dict applied by BlueZ while scanning.
+        Signals are dispatched by the shared main loop thread (components.mainloop), this call only waits.
+        """
         if self.is_running:
             u.log_direct("[scanner] Already running.", c.LOG_TYPE)
             return False
 
-        DBusGMainLoop(set_as_default=True)
-        self._system_bus = dbus.SystemBus()
-        self._scanner_mainloop = GObject.MainLoop()
+        self._system_bus = u.bus_connection.bus
+        MainLoopThread.get()
+        self._stopped.clear()
 
-        self._system_bus.add_signal_receiver(self.new_device_discovered, dbus_interface=c.BluetoothConstants.DBUS_OM_IFACE,
-                                             signal_name="InterfacesAdded")
+        # devices of this adapter only (components.subscriptions).
+        self._subscription = SignalRouter.get().subscribe(c.BluetoothConstants.DBUS_OM_IFACE, "InterfacesAdded",
+                                                          self.new_device_found, path='/',
+                                                          arg0path=self.__adapter.path + '/')
 
-        self.__adapter.start_discovery()
-        self._timer_id = GObject.timeout_add(scan_sec * 1000, self.scan_timeout)
+        if discovery_filter is not None:
+            self.__adapter.set_discovery_filter(discovery_filter)
+        if scan_sec is None:
+            self._scheduler = ScanScheduler(self.__adapter.start_discovery, self.__adapter.stop_discovery)
+            self._scheduler.start()
+        else:
+            self.__adapter.start_discovery()
+            self._timer_id = GObject.timeout_add(scan_sec * 1000, self.scan_timeout)
 
         self.is_running = True
-        self._scanner_mainloop.run()
+        self._stopped.wait()
 
     def loop(self):
         while self.is_running:
@@ -199,16 +406,21 @@ class BluetoothScanner:
         if self._timer_id is not None:
             GObject.source_remove(self._timer_id)
 
-        if self._scanner_mainloop is not None:
-            self._scanner_mainloop.quit()
-
-        self.__adapter.stop_discovery()
+        if self._scheduler is not None:
+            self._scheduler.stop()
+            self._scheduler = None
+        else:
+            self.__adapter.stop_discovery()
+        if self.__adapter.discovery_filter is not None:
+            self.__adapter.set_discovery_filter(None)
 
-        self._system_bus.remove_signal_receiver(self.new_device_found, "InterfacesAdded")
+        if self._subscription is not None:
+            self._subscription.remove()
+            self._subscription = None
 
         self._timer_id = None
         self.is_running = False
-        self._scanner_thread = None
+        self._stopped.set()
 
         if self._completed is not None:
             self._completed()
@@ -216,7 +428,17 @@ class BluetoothScanner:
     def new_device_found(self, path, interfaces):
         if c.BluetoothConstants.DEVICE_INTERFACE not in interfaces:
             return
-        device_properties = u.get_device_properties_by_path(path)
+        if u.device_path_to_adapter_path(path) != self.__adapter.path:
+            return
+        self.metrics.incr('interfaces_added')
+        device_properties, fetched = u.get_device_properties_from_signal(path, interfaces)
+        if fetched:
+            self.metrics.incr('properties_fetched')
+        if self._scheduler is not None:
+            self._scheduler.device_found()
+        if c.BluetoothConstants.DECODE_ADVERTISEMENTS and \
+                ('ManufacturerData' in device_properties or 'ServiceData' in device_properties):
+            device_properties['Decoded'] = decode_advertisement(device_properties)
         if self._new_device_discovered is not None:
             self._new_device_discovered(device_properties)
 
@@ -226,6 +448,11 @@ class OperationModes:
     PAIR_TARGET = 'pair-target'
 
 
+class AdapterRoles:
+    SCAN = 'scan'          # adapter takes part in discovery.
+    CONNECT = 'connect'    # adapter is kept out of discovery, e.g. while it handles connections.
+
+
 class BluetoothController(object):
     SUCCESSFUL = 1000
     UNDEFINED_MODE = 999
@@ -238,23 +465,25 @@ class BluetoothController(object):
 
         self._callback_mutex = threading.RLock()
         self.on_new_device_found = None
+        self.on_device_properties_changed = None
 
         self._target_bd_addr = None
         self._target_device_path = None
         self._target_bd_addr_set = None
 
-        self._agent_mainloop = None
-        self._service_mainloop = None
-        self._scanner_mainloop = None
         self._timer_id = None
 
-        self._scanner_thread = None
-        self._agent_thread = None
-
         self._agent = None
         self._run_agent = False
 
-        self._adapter_interface = None
+        # adapters used for discovery, None : every org.bluez.Adapter1 found at start.
+        self.adapter_paths = None
+        self._adapter_roles = {}
+        # adapters scanning in the current run / adapters with discovery currently on.
+        self._scan_adapters = set()
+        self._adapter_interfaces = {}
+        # address -> {adapter path : last RSSI}, merges the same device seen by several adapters.
+        self._sightings = {}
 
         self._target_found = False
         self._connected_to_target = False
@@ -263,12 +492,75 @@ class BluetoothController(object):
         self._bt_is_discoverable = False
 
         self.__is_running = False
+        # set while no mode runs, see wait().
+        self._stopped = threading.Event()
+        self._stopped.set()
 
         self._devices = {}
         self.device_counter = 0
+
+        # discovery runs in duty cycles (components.scheduler.ScanScheduler) for scan_duration seconds,
+        # None : until stop().
+        self.scan_duration = c.BluetoothConstants.SCAN_DURATION_SEC
+        self._scheduler = None
+
+        # applied by BlueZ (SetDiscoveryFilter) on every scanning adapter, checked again here for
+        # adapters that ignore some of the fields. DiscoveryFilter, dict or None.
+        self.discovery_filter = c.BluetoothConstants.DISCOVERY_FILTER
+        self._discovery_filter = None
+        self._filtered_adapters = set()
+
+        # payloads get 'Decoded' : typed frames of ManufacturerData / ServiceData (components.advertisement).
+        self.decode_advertisements = c.BluetoothConstants.DECODE_ADVERTISEMENTS
+
+        # devices weaker than min_rssi are neither reported as found nor changed, a device found weaker
+        # is reported as found once it comes closer. None : every device.
+        self.min_rssi = c.BluetoothConstants.MIN_ACCEPTABLE_VALUE_RSSI
+
+        # False : always call GetAll for new devices (old behaviour, kept to compare signal rates).
+        self.use_signal_payload = True
+        self.metrics = Metrics()
+
+        # signal handlers queue events, callbacks & logs run on dispatcher workers.
+        self.overflow_policy = c.BluetoothConstants.DISPATCH_OVERFLOW_POLICY
+        self._dispatcher = None
+
+        # PropertiesChanged are merged per device and emitted at most once per interval, 0 disables.
+        self.coalesce_interval = c.BluetoothConstants.COALESCE_INTERVAL_SEC
+        self._coalescer = None
+        self._coalescer_timer_id = None
+
+        # devices seen in earlier runs, loaded lazily (conf DEVICE_STORE_FILE, None disables).
+        self.device_store = None
+        if c.BluetoothConstants.DEVICE_STORE_FILE:
+            self.device_store = DeviceStore(c.BluetoothConstants.DEVICE_STORE_FILE)
+        self._store_timer_id = None
         self._discovering = False
         self._agent_registered = False
 
+        # BlueZ signals of the scanning adapters, {adapter path : [components.subscriptions.Subscription]}.
+        # audit_signals : also count the signals the narrow match rules keep away (SignalRouter.audit).
+        self._subscriptions = {}
+        self.audit_signals = False
+
+        # RSSI smoothing, distance and enter/leave/near/far events per address in scan-all (components.proximity,
+        # needs numpy). on_proximity_event({'Address', 'Event', 'RSSI', 'Distance'}) runs on a dispatcher worker.
+        self.track_proximity = c.BluetoothConstants.PROXIMITY_ENABLED
+        self.proximity = None
+        self.on_proximity_event = None
+        self._proximity_timer_id = None
+
+        # removes stale devices from BlueZ while scan-all runs (components.eviction), opt-in : BlueZ forgets
+        # them for every application of the host (conf EVICT_STALE_DEVICES).
+        self.evict_stale_devices = c.BluetoothConstants.EVICT_STALE_DEVICES
+        self._evictor = None
+
+        # pair-target mode : running pipeline, last result, on_target_paired(PairingResult) callback.
+        self._pairing = None
+        self.pairing_result = None
+        self.on_target_paired = None
+        self._mode_started_at = None
+
         self._callback_switcher = {
             'scan-all': {
                 'on_start': self.start_scan_all,
@@ -276,9 +568,14 @@ class BluetoothController(object):
                 'device_removed': self.device_removed,
                 'device_properties_changed': self.device_properties_changed,
                 'timeout': self.scan_all_timeout
+            },
+            'pair-target': {
+                'on_start': self.start_pair_target,
+                'new_device_found': self.pair_target_device_found,
+                'device_properties_changed': self.pair_target_properties_changed,
+                'timeout': self.pair_target_timeout
             }
         }
-        DBusGMainLoop(set_as_default=True)
 
     @property
     def on_new_device_found(self):
@@ -288,13 +585,221 @@ class BluetoothController(object):
     def on_new_device_found(self, callback):
         self._on_new_device_found = callback
 
+    @property
+    def on_device_properties_changed(self):
+        return self._on_device_properties_changed
+
+    @on_device_properties_changed.setter
+    def on_device_properties_changed(self, callback):
+        self._on_device_properties_changed = callback
+
+    def set_target(self, bd_addr: str):
+        """
+        Set the device to pair with in pair-target mode.
+        Return : True-False (invalid address)
+        """
+        if not u.checkMAC(bd_addr):
+            BluetoothController.log(msg=f"Invalid target address : {bd_addr}", log_type=self.log_type)
+            return False
+        self._target_bd_addr = bd_addr.upper().replace('-', ':')
+        self._target_bd_addr_set = True
+        return True
+
+    def set_adapter_role(self, adapter_path, role):
+        """
+        Change the role of an adapter, e.g. AdapterRoles.CONNECT to let it handle connections
+        while the other adapters keep scanning. Applied immediately if discovery is running.
+        """
+        self._adapter_roles[adapter_path] = role
+        if not self._discovering:
+            return
+        if role == AdapterRoles.SCAN:
+            self._scan_adapters.add(adapter_path)
+            self._subscribe_adapter(adapter_path)
+            # pair-target discovers without a scheduler until the target shows up.
+            scanning = self._scheduler is None or self._scheduler.state == ScanStates.SCANNING
+            if scanning and adapter_path not in self._adapter_interfaces:
+                self._start_adapter_discovery(adapter_path)
+        else:
+            self._scan_adapters.discard(adapter_path)
+            self._stop_adapter_discovery(adapter_path)
+
+    def pause_scanning(self, reason):
+        """
+        Stop discovery on every adapter until resume_scanning(reason), e.g. while a connection
+        or pairing is in progress. No-op if no scan mode is running.
+        """
+        if self._scheduler is not None:
+            self._scheduler.pause(reason)
+
+    def resume_scanning(self, reason):
+        if self._scheduler is not None:
+            self._scheduler.resume(reason)
+
+    def scanning_paused(self, reason):
+        """
+        Context manager : with controller.scanning_paused('pairing'): ...
+        """
+        return _ScanPause(self, reason)
+
+    def get_devices(self):
+        """
+        Return : {address : device properties} merged over all scanning adapters,
+                 'SeenBy' maps adapter path -> last RSSI reported by that adapter.
+        """
+        devices = {}
+        for path, props in list(self._devices.items()):
+            address = u.path_to_device_address(path)
+            if address not in devices:
+                devices[address] = self._device_payload(path, props)
+        return devices
+
+    def get_known_device(self, address: str):
+        """
+        Return : stored record (Address, Name, Class, UUIDs, RSSI, FirstSeen, LastSeen) of a device seen
+                 in this or an earlier run, None if unknown or the device store is disabled.
+        """
+        if self.device_store is None:
+            return None
+        return self.device_store.get(address)
+
+    def _device_payload(self, path, device_properties):
+        payload = dict(device_properties)
+        payload['SeenBy'] = dict(self._sightings.get(u.path_to_device_address(path), {}))
+        self._decode(payload)
+        return payload
+
+    def _decode(self, payload):
+        if self.decode_advertisements and ('ManufacturerData' in payload or 'ServiceData' in payload):
+            payload['Decoded'] = decode_advertisement(payload)
+
+    def _start_discovery_window(self):
+        for adapter_path in sorted(self._scan_adapters):
+            self._start_adapter_discovery(adapter_path)
+
+    def _stop_discovery_window(self):
+        for adapter_path in list(self._adapter_interfaces):
+            self._stop_adapter_discovery(adapter_path)
+
+    def _subscribe_adapter(self, adapter_path):
+        """
+        Route the BlueZ signals of the devices of adapter_path to the handlers of the current mode.
+        Match rules : InterfacesAdded/Removed with arg0path under the adapter, PropertiesChanged of
+        org.bluez.Device1 under the adapter, all from org.bluez only.
+        """
+        if adapter_path in self._subscriptions:
+            return
+        router = SignalRouter.get()
+        mode_callbacks = self._callback_switcher.get(self.mode)
+        device_namespace = adapter_path + '/'
+        subscriptions = [
+            router.subscribe(c.BluetoothConstants.DBUS_OM_IFACE, "InterfacesAdded", mode_callbacks['new_device_found'],
+                             path='/', arg0path=device_namespace),
+            router.subscribe(c.BluetoothConstants.DBUS_PROPERTIES, "PropertiesChanged",
+                             mode_callbacks['device_properties_changed'], path_namespace=adapter_path,
+                             arg0=c.BluetoothConstants.DEVICE_INTERFACE, path_keyword='path'),
+        ]
+        if 'device_removed' in mode_callbacks:
+            subscriptions.append(router.subscribe(c.BluetoothConstants.DBUS_OM_IFACE, "InterfacesRemoved",
+                                                  mode_callbacks['device_removed'], path='/',
+                                                  arg0path=device_namespace))
+        self._subscriptions[adapter_path] = subscriptions
+
+    def _subscribe_adapters(self, adapter_paths):
+        router = SignalRouter.get()
+        if self.audit_signals:
+            router.metrics.reset()
+            router.audit(True)
+        for adapter_path in adapter_paths:
+            self._subscribe_adapter(adapter_path)
+
+    def _unsubscribe_adapters(self):
+        # the match rules stay installed for the next run (SignalRouter).
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                subscription.remove()
+        self._subscriptions = {}
+
+        router = SignalRouter.get()
+        if self.audit_signals:
+            router.audit(False)
+            BluetoothController.log(msg=f"Signals : {router.metrics.get('delivered')} delivered, "
+                                        f"{router.metrics.get('avoided')} of {router.metrics.get('audited')} "
+                                        f"kept away by match rules.", log_type=self.log_type)
+
+    # adapter calls are asynchronous (utils.call_async) : they run from GLib timers and signal handlers,
+    # and calls to several adapters are in flight together. D-Bus keeps their order per adapter.
+
+    def _log_call_error(self, action, adapter_path, error):
+        BluetoothController.log(msg=f"Error while {action} on {adapter_path} : {error}", log_type=self.log_type,
+                                level=LogLevels.WARNING)
+
+    def _set_adapter_filter(self, adapter_path, adapter_interface):
+        discovery_filter = self._discovery_filter
+        if discovery_filter is None or adapter_path in self._filtered_adapters:
+            return
+
+        def on_done(result, error):
+            if error is not None:
+                self._filtered_adapters.discard(adapter_path)
+                self._log_call_error("setting discovery filter", adapter_path, error)
+
+        self._filtered_adapters.add(adapter_path)
+        u.call_async(adapter_interface.SetDiscoveryFilter, discovery_filter.to_dbus(), callback=on_done)
+
+    def _clear_adapter_filters(self):
+        for adapter_path in self._filtered_adapters:
+            adapter_interface = u.bus_connection.get_interface(adapter_path, c.BluetoothConstants.ADAPTER_INTERFACE)
+            u.call_async(adapter_interface.SetDiscoveryFilter, dbus.Dictionary({}, signature='sv'))
+        self._filtered_adapters = set()
+
+    def _passes_filter(self, properties):
+        if self._discovery_filter is None or self._discovery_filter.matches(properties):
+            return True
+        self.metrics.incr('filter_rejected')
+        return False
+
+    def _start_adapter_discovery(self, adapter_path):
+        adapter_interface = u.bus_connection.get_interface(adapter_path, c.BluetoothConstants.ADAPTER_INTERFACE)
+        self._set_adapter_filter(adapter_path, adapter_interface)
+
+        def on_done(result, error):
+            if error is not None:
+                if self._adapter_interfaces.get(adapter_path) is adapter_interface:
+                    del self._adapter_interfaces[adapter_path]
+                self._log_call_error("starting discovery", adapter_path, error)
+            else:
+                BluetoothController.log(msg="Discovery started on %s.", args=(adapter_path,), log_type=self.log_type)
+
+        self._adapter_interfaces[adapter_path] = adapter_interface
+        u.call_async(adapter_interface.StartDiscovery, callback=on_done)
+
+    def _stop_adapter_discovery(self, adapter_path):
+        adapter_interface = self._adapter_interfaces.pop(adapter_path, None)
+        if adapter_interface is None:
+            return
+
+        def on_done(result, error):
+            if error is not None:
+                self._log_call_error("stopping discovery", adapter_path, error)
+
+        u.call_async(adapter_interface.StopDiscovery, callback=on_done)
+
     @staticmethod
-    def log(msg, log_type):
-        if 'c' in log_type:
-            print("[BLUETOOTH CONTROLLER] " + msg)
+    def log(msg, log_type, level=LogLevels.INFO, args=()):
+        """
+        msg % args is formatted on the logger thread and only if level is enabled, hot paths pass args
+        instead of an f-string.
+        """
+        if not u.logger.is_enabled_for(level):
+            return
+        if args:
+            u.logger.log(level, "[BLUETOOTH CONTROLLER] " + msg, *args, log_type=log_type)
+        else:
+            u.logger.log(level, "[BLUETOOTH CONTROLLER] %s", msg, log_type=log_type)
 
     @staticmethod
-    def get_device_properties_by_path(bus: dbus.SystemBus, path):
+    def get_device_properties_by_path(bus: 'dbus.SystemBus', path):
         obj = bus.get_object(c.BluetoothConstants.BLUEZ_SERVICE_NAME, path)
         props_iface = dbus.Interface(obj, c.BluetoothConstants.DBUS_PROPERTIES)
         device_properties = u.dbus_to_python(props_iface.GetAll(c.BluetoothConstants.DEVICE_INTERFACE))
@@ -326,6 +831,14 @@ class BluetoothController(object):
         else:
             BluetoothController.log(msg="Error while removing resources.", log_type=self.log_type)
 
+    def wait(self, timeout=None):
+        """
+        Block until the running mode stopped (scan_duration elapsed, target paired, stop() ...),
+        the modes run on the shared main loop thread, a daemon thread.
+        return : True if stopped, False if timeout elapsed first
+        """
+        return self._stopped.wait(timeout)
+
     def start_discovery(self, mode: str):
         if mode not in self._callback_switcher:
             BluetoothController.log(msg=f"Undefined mode : {mode}", log_type=self.log_type)
@@ -338,35 +851,57 @@ class BluetoothController(object):
 
     def start_scan_all(self):
         """
-        Scan nearby devices for 30 seconds.
+        Scan nearby devices in duty cycles on every adapter with AdapterRoles.SCAN,
+        for scan_duration seconds or until stop().
         return : True-False
         """
-        self._system_bus = dbus.SystemBus()
-        self._scanner_mainloop = GObject.MainLoop()
-        self._scanner_thread = threading.Thread(target=self._scanner_mainloop.run)
-
-        adapter_path = c.BluetoothConstants.BLUEZ_NAMESPACE + c.BluetoothConstants.ADAPTER_NAME
-        adapter_object = self._system_bus.get_object(c.BluetoothConstants.BLUEZ_SERVICE_NAME, adapter_path)
-        self._adapter_interface = dbus.Interface(adapter_object, c.BluetoothConstants.ADAPTER_INTERFACE)
+        self._system_bus = u.bus_connection.bus
+        # signal handlers and timers of the mode run on the shared main loop thread.
+        MainLoopThread.get()
+
+        adapter_paths = self.adapter_paths if self.adapter_paths is not None else u.find_adapters()
+        adapter_paths = [path for path in adapter_paths
+                         if self._adapter_roles.get(path, AdapterRoles.SCAN) == AdapterRoles.SCAN]
+        if not adapter_paths:
+            BluetoothController.log(msg="No adapter to scan with.", log_type=self.log_type)
+            return False
 
         mode_callbacks = self._callback_switcher.get(self.mode)
-
-        self._system_bus.add_signal_receiver(mode_callbacks['new_device_found'],
-                                             dbus_interface=c.BluetoothConstants.DBUS_OM_IFACE,
-                                             signal_name="InterfacesAdded")
-
-        self._system_bus.add_signal_receiver(mode_callbacks['device_removed'],
-                                             dbus_interface=c.BluetoothConstants.DBUS_OM_IFACE,
-                                             signal_name="InterfacesRemoved")
-        self._system_bus.add_signal_receiver(mode_callbacks['device_properties_changed'],
-                                             dbus_interface=c.BluetoothConstants.DBUS_PROPERTIES,
-                                             signal_name="PropertiesChanged", path_keyword="path")
-
-        self._timer_id = GObject.timeout_add(30 * 1000, mode_callbacks['timeout'])
-        self._adapter_interface.StartDiscovery()
+        self._subscribe_adapters(adapter_paths)
+
+        if self.scan_duration:
+            self._timer_id = GObject.timeout_add(int(self.scan_duration * 1000), mode_callbacks['timeout'])
+        self.metrics.reset()
+        self._dispatcher = EventDispatcher(self._dispatch_events, policy=self.overflow_policy)
+        self._dispatcher.start()
+        if self.coalesce_interval:
+            self._coalescer = ChangeCoalescer(self._emit_device_changes, interval=self.coalesce_interval,
+                                              min_rssi=self.min_rssi,
+                                              records=self._devices, record_factory=DeviceRecord)
+            self._coalescer_timer_id = GObject.timeout_add(int(self.coalesce_interval * 1000), self._coalescer.flush)
+
+        if self.device_store is not None:
+            self.device_store.preload()
+            self._store_timer_id = GObject.timeout_add(int(c.BluetoothConstants.DEVICE_STORE_FLUSH_SEC * 1000),
+                                                       self._flush_device_store)
+        if self.track_proximity:
+            self.proximity = ProximityEngine(self._on_proximity_event)
+            self._proximity_timer_id = GObject.timeout_add(int(c.BluetoothConstants.PROXIMITY_TICK_SEC * 1000),
+                                                           self.proximity.on_timer)
+
+        self._scan_adapters = set(adapter_paths)
+        self._discovery_filter = DiscoveryFilter.from_dict(self.discovery_filter)
+        if self.evict_stale_devices:
+            self._evictor = DeviceEvictor(adapter_paths=adapter_paths, log_type=self.log_type)
+            self._evictor.start()
+        self._scheduler = ScanScheduler(self._start_discovery_window, self._stop_discovery_window)
+        self._scheduler.start()
+        self._discovering = True
+        self.__is_running = True
+        self._stopped.clear()
 
         BluetoothController.log(msg="Discovery started.", log_type=self.log_type)
-        self._scanner_thread.start()
+        return True
 
     def new_device_found(self, path, interfaces):
         """
@@ -374,14 +909,49 @@ class BluetoothController(object):
         """
         if c.BluetoothConstants.DEVICE_INTERFACE not in interfaces:
             return
-        device_properties = BluetoothController.get_device_properties_by_path(self._system_bus, path)
+        if u.device_path_to_adapter_path(path) not in self._scan_adapters:
+            return
+        self.metrics.incr('interfaces_added')
 
-        self.device_counter += 1
+        if self.use_signal_payload:
+            device_properties, fetched = u.get_device_properties_from_signal(path, interfaces)
+        else:
+            device_properties, fetched = BluetoothController.get_device_properties_by_path(self._system_bus, path), True
+        if fetched:
+            self.metrics.incr('properties_fetched')
+        if not self._passes_filter(device_properties):
+            return
+
+        self._devices[path] = DeviceRecord(device_properties)
+        rssi = device_properties.get('RSSI')
+        if self.proximity is not None and rssi is not None:
+            self.proximity.update(u.path_to_device_address(path), rssi)
+        if not self._strong_enough(rssi):
+            # reported once it comes closer, see device_properties_changed.
+            return
+        self._report_found(path, device_properties)
+
+    def _report_found(self, path, device_properties):
+        address = u.path_to_device_address(path)
+        first_sighting = address not in self._sightings
+        self._sightings.setdefault(address, {})[u.device_path_to_adapter_path(path)] = device_properties.get('RSSI')
+        if not first_sighting:
+            # already reported through another adapter.
+            return
 
-        if self._on_new_device_found is not None:
-            self._on_new_device_found(device_properties)
+        self.device_counter += 1
+        if self._scheduler is not None:
+            self._scheduler.device_found()
+        self._dispatcher.put(DeviceEvents.FOUND, path, self._device_payload(path, device_properties))
 
-        # BluetoothController.log(msg="-" * 30, log_type=self.log_type)
+    def _strong_enough(self, rssi):
+        """
+        min_rssi check of the signal handlers, before anything is dispatched.
+        """
+        if rssi is None or self.min_rssi is None or rssi >= self.min_rssi:
+            return True
+        self.metrics.incr('rssi_filtered')
+        return False
 
     def device_removed(self, path, interfaces):
         """
@@ -391,14 +961,23 @@ class BluetoothController(object):
         if c.BluetoothConstants.DEVICE_INTERFACE not in interfaces:
             return
         if path in self._devices:
-            dev = self._devices[path]
-            if 'Address' in dev:
-                BluetoothController.log(msg=f"[DEL] BDADDR : {dev['Address']}", log_type=self.log_type)
+            if self._coalescer is not None:
+                dev = self._coalescer.remove(path)
             else:
-                BluetoothController.log(msg=f"[DEL] PATH : {path}", log_type=self.log_type)
-            BluetoothController.log(msg="-" * 30, log_type=self.log_type)
+                dev = self._devices.pop(path)
+
+            address = u.path_to_device_address(path)
+            if address not in self._sightings:
+                # never reported, it stayed weaker than min_rssi.
+                return
+            adapters = self._sightings[address]
+            adapters.pop(u.device_path_to_adapter_path(path), None)
+            if adapters:
+                # still seen by another adapter.
+                return
+            self._sightings.pop(address, None)
             self.device_counter -= 1
-            del self._devices[path]
+            self._dispatcher.put(DeviceEvents.REMOVED, path, dev)
 
     def device_properties_changed(self, interface, changed, invalidated, path):
         """
@@ -406,45 +985,123 @@ class BluetoothController(object):
         """
         if interface != c.BluetoothConstants.DEVICE_INTERFACE:
             return
+        adapter_path = u.device_path_to_adapter_path(path)
+        if adapter_path not in self._scan_adapters:
+            return
+        self.metrics.incr('properties_changed')
+        if not self._passes_filter(changed):
+            return
+        if 'RSSI' in changed:
+            address = u.path_to_device_address(path)
+            rssi = int(changed['RSSI'])
+            if self.proximity is not None:
+                self.proximity.update(address, rssi)
+            if address not in self._sightings and path in self._devices:
+                # found weaker than min_rssi, reported as found once it comes closer.
+                self._devices[path].update(u.dbus_to_python(changed))
+                if self._strong_enough(rssi):
+                    self._report_found(path, self._devices[path])
+                return
+            self._sightings.setdefault(address, {})[adapter_path] = rssi
+        if self._coalescer is not None:
+            # the coalescer applies min_rssi to the merged record.
+            self._coalescer.update(path, u.dbus_to_python(changed))
+            return
+
         if path in self._devices:
-            self._devices[path] = dict(self._devices[path].items())
-            self._devices[path].update(changed.items())
+            self._devices[path].update(u.dbus_to_python(changed))
         else:
-            self._devices[path] = changed
-            # self._new_devices_counter += 1
+            self._devices[path] = DeviceRecord(u.dbus_to_python(changed))
 
-        dev = self._devices[path]
-        BluetoothController.log(msg=f"[CHG] PATH : {path}", log_type=self.log_type)
+        if not self._strong_enough(self._devices[path].get('RSSI')):
+            return
+        self._dispatcher.put(DeviceEvents.CHANGED, path, self._device_payload(path, self._devices[path]))
 
-        if 'Address' in dev:
-            BluetoothController.log(msg=f"[CHG] BDADDR : {dev['Address']}", log_type=self.log_type)
-        if 'Name' in dev:
-            BluetoothController.log(msg=f"[CHG] NAME : {dev['Name']}", log_type=self.log_type)
-        if 'RSSI' in dev:
-            BluetoothController.log(msg=f"[CHG] RSSI : {dev['RSSI']}", log_type=self.log_type)
+    def _emit_device_changes(self, path, device_properties, changed_keys):
+        device_properties['SeenBy'] = dict(self._sightings.get(u.path_to_device_address(path), {}))
+        self._decode(device_properties)
+        self._dispatcher.put(DeviceEvents.CHANGED, path, device_properties)
 
-        device_address = u.path_to_device_address(path)
+    def _on_proximity_event(self, address, event, rssi, distance):
+        self._dispatcher.put(DeviceEvents.PROXIMITY, (address, event),
+                             {'Address': address, 'Event': event, 'RSSI': rssi, 'Distance': distance})
 
-        BluetoothController.log(msg="-" * 30, log_type=self.log_type)
+    def _dispatch_events(self, events):
+        """
+        Consumer of the event dispatcher, runs on a dispatcher worker thread.
+        """
+        log_events = u.logger.is_enabled_for(LogLevels.INFO)
+        for event in events:
+            dev = event.payload
+            if self.device_store is not None and event.kind in (DeviceEvents.FOUND, DeviceEvents.CHANGED) \
+                    and 'Address' in dev:
+                self.device_store.update(dev['Address'], dev)
+            if event.kind == DeviceEvents.FOUND:
+                if self._on_new_device_found is not None:
+                    self._on_new_device_found(dev)
+            elif event.kind == DeviceEvents.CHANGED:
+                if log_events:
+                    BluetoothController.log(msg="[CHG] PATH : %s", args=(event.key,), log_type=self.log_type)
+                    if 'Address' in dev:
+                        BluetoothController.log(msg="[CHG] BDADDR : %s", args=(dev['Address'],), log_type=self.log_type)
+                    if 'Name' in dev:
+                        BluetoothController.log(msg="[CHG] NAME : %s", args=(dev['Name'],), log_type=self.log_type)
+                    if 'RSSI' in dev:
+                        BluetoothController.log(msg="[CHG] RSSI : %s", args=(dev['RSSI'],), log_type=self.log_type)
+                    BluetoothController.log(msg="-" * 30, log_type=self.log_type)
+                if self._on_device_properties_changed is not None:
+                    self._on_device_properties_changed(dev)
+            elif event.kind == DeviceEvents.PROXIMITY:
+                if log_events:
+                    BluetoothController.log(msg="[%s] BDADDR : %s, RSSI : %.1f, distance : %.1fm",
+                                            args=(dev['Event'].upper(), dev['Address'], dev['RSSI'], dev['Distance']),
+                                            log_type=self.log_type)
+                if self.on_proximity_event is not None:
+                    self.on_proximity_event(dev)
+            elif not log_events:
+                continue
+            elif event.kind == DeviceEvents.REMOVED:
+                if 'Address' in dev:
+                    BluetoothController.log(msg="[DEL] BDADDR : %s", args=(dev['Address'],), log_type=self.log_type)
+                else:
+                    BluetoothController.log(msg="[DEL] PATH : %s", args=(event.key,), log_type=self.log_type)
+                BluetoothController.log(msg="-" * 30, log_type=self.log_type)
+
+    def _flush_device_store(self):
+        self.device_store.flush()
+        return True
 
     def scan_all_timeout(self):
         if self._timer_id is not None:
             GObject.source_remove(self._timer_id)
-        if self._scanner_mainloop is not None:
-            self._scanner_mainloop.quit()
 
-        if self._adapter_interface is not None:
-            try:
-                self._adapter_interface.StopDiscovery()
-            except Exception as e:
-                BluetoothController.log(msg=f"Error while stopping discovery : {e.args}", log_type=self.log_type)
-
-        self._system_bus.remove_signal_receiver(self.new_device_found, "InterfacesAdded")
-        self._system_bus.remove_signal_receiver(self.device_removed, "InterfacesRemoved")
-        self._system_bus.remove_signal_receiver(self.device_properties_changed, "PropertiesChanged")
+        if self._scheduler is not None:
+            self._scheduler.stop()
+        self._stop_discovery_window()
+        self._clear_adapter_filters()
+        self._scan_adapters = set()
+
+        self._unsubscribe_adapters()
+
+        if self._coalescer_timer_id is not None:
+            GObject.source_remove(self._coalescer_timer_id)
+            self._coalescer_timer_id = None
+        if self._coalescer is not None:
+            self._coalescer.flush()
+        if self._proximity_timer_id is not None:
+            GObject.source_remove(self._proximity_timer_id)
+            self._proximity_timer_id = None
+        if self._store_timer_id is not None:
+            GObject.source_remove(self._store_timer_id)
+            self._store_timer_id = None
+
+        if self._dispatcher is not None:
+            self._dispatcher.stop()
+        if self.device_store is not None:
+            self.device_store.flush()
 
         self._timer_id = None
-        self._adapter_interface = None
+        self._sightings = {}
 
         self._discovering = False
 
@@ -452,20 +1109,214 @@ class BluetoothController(object):
         BluetoothController.log(msg=f"Discovering : {self._discovering}", log_type=self.log_type)
 
         BluetoothController.log(msg=f"{self.device_counter} devices found.", log_type=self.log_type)
+        BluetoothController.log(msg=f"Memory per device : {memory_per_device(list(self._devices.values())):.0f} bytes",
+                                log_type=self.log_type)
+        BluetoothController.log(msg=f"InterfacesAdded handled : {self.metrics.rate('interfaces_added'):.1f}/s, "
+                                    f"GetAll calls : {self.metrics.get('properties_fetched')}",
+                                log_type=self.log_type)
+        if self._discovery_filter is not None:
+            BluetoothController.log(msg=f"Discovery filter : {self._discovery_filter}, signals rejected here : "
+                                        f"{self.metrics.get('filter_rejected')}", log_type=self.log_type)
+        if self._dispatcher is not None:
+            BluetoothController.log(msg=f"Dispatcher : {self._dispatcher.metrics.snapshot()}", log_type=self.log_type)
+        if self._evictor is not None:
+            self._evictor.stop()
+            BluetoothController.log(msg=f"Eviction : {self._evictor.metrics.snapshot()}", log_type=self.log_type)
+            self._evictor = None
+        if self._scheduler is not None:
+            BluetoothController.log(msg=f"Scheduler : {self._scheduler.metrics.snapshot()}", log_type=self.log_type)
+            self._scheduler = None
+        if self.proximity is not None:
+            BluetoothController.log(msg=f"Proximity : {self.proximity.metrics.snapshot()}", log_type=self.log_type)
+            self.proximity = None
+        if self._coalescer is not None:
+            BluetoothController.log(msg=f"Coalescer : {self._coalescer.metrics.snapshot()}", log_type=self.log_type)
+            self._coalescer = None
 
         self.device_counter = 0
         self.__is_running = False
         self._discovering = False
+        self._stopped.set()
 
         BluetoothController.log(msg=f"Stopped operation : {self.mode}", log_type=self.log_type)
         BluetoothController.log(msg="Summary : ", log_type=self.log_type)
         self.show_controller_info()
+        return True
+
+    def start_pair_target(self):
+        """
+        Discover the target (set_target) on every adapter with AdapterRoles.SCAN, stop discovery as soon
+        as it shows up, then pair, trust and connect it (components.pairing.PairingPipeline).
+        An Agent1 accepting the target only is registered for the mode.
+        return : True-False
+        """
+        if not self._target_bd_addr_set:
+            BluetoothController.log(msg="No target set.", log_type=self.log_type)
+            return False
+
+        adapter_paths = self.adapter_paths if self.adapter_paths is not None else u.find_adapters()
+        adapter_paths = [path for path in adapter_paths
+                         if self._adapter_roles.get(path, AdapterRoles.SCAN) == AdapterRoles.SCAN]
+        if not adapter_paths:
+            BluetoothController.log(msg="No adapter to scan with.", log_type=self.log_type)
+            return False
+
+        self._system_bus = u.bus_connection.bus
+        MainLoopThread.get()
+        self._mode_started_at = time.monotonic()
+
+        self._target_found = False
+        self._target_device_path = None
+        self._paired_with_target = None
+        self._trusted_device = False
+        self._connected_to_target = False
+        self.pairing_result = None
+
+        # dbus.service is only needed by this mode.
+        from components.agent import PairingAgent
+        self._agent = PairingAgent(self._system_bus, accept=self._is_target_path)
+        self._agent_registered = self._agent.register()
+
+        self._subscribe_adapters(adapter_paths)
+        self._timer_id = GObject.timeout_add(int(c.BluetoothConstants.PAIR_TARGET_TIMEOUT_SEC * 1000),
+                                             self._pair_target_expired)
+
+        # only the target needs to reach the process.
+        self._discovery_filter = DiscoveryFilter(pattern=self._target_bd_addr)
+        self._scan_adapters = set(adapter_paths)
+        self._start_discovery_window()
+        self._discovering = True
+        self.__is_running = True
+        self._stopped.clear()
+
+        BluetoothController.log(msg=f"Looking for {self._target_bd_addr}.", log_type=self.log_type)
+        return True
+
+    def _is_target_path(self, path):
+        return self._target_device_path is not None and path == self._target_device_path
+
+    def pair_target_device_found(self, path, interfaces):
+        """
+        Handler function for 'InterfacesAdded' signal in pair-target mode
+        """
+        if c.BluetoothConstants.DEVICE_INTERFACE not in interfaces:
+            return
+        if u.device_path_to_adapter_path(path) not in self._scan_adapters:
+            return
+        if u.path_to_device_address(path) != self._target_bd_addr:
+            return
+        self._on_target_found(path, u.dbus_to_python(interfaces[c.BluetoothConstants.DEVICE_INTERFACE]))
+
+    def pair_target_properties_changed(self, interface, changed, invalidated, path):
+        """
+        Handler function for 'PropertiesChanged' signal in pair-target mode, a target already known by
+        BlueZ shows up as an RSSI change instead of 'InterfacesAdded'.
+        """
+        if interface != c.BluetoothConstants.DEVICE_INTERFACE or 'RSSI' not in changed:
+            return
+        if u.device_path_to_adapter_path(path) not in self._scan_adapters:
+            return
+        if u.path_to_device_address(path) != self._target_bd_addr:
+            return
+        self._on_target_found(path, None)
+
+    def _on_target_found(self, path, properties):
+        if self._target_found:
+            return
+        self._target_found = True
+        self._target_device_path = path
+        # PAIR_TARGET_TIMEOUT_SEC bounds discovery, the pipeline's own timeouts bound pairing.
+        if self._timer_id is not None:
+            GObject.source_remove(self._timer_id)
+            self._timer_id = None
+        discover_sec = time.monotonic() - self._mode_started_at
+        BluetoothController.log(msg=f"Target found after {discover_sec:.3f}s : {path}", log_type=self.log_type)
+
+        # discovery competes with pairing for the radio.
+        self._stop_discovery_window()
+        self._discovering = False
+
+        # without properties every step is tried, AlreadyExists / AlreadyConnected count as done.
+        self._pairing = PairingPipeline(path, on_done=self._on_target_paired, properties=properties)
+        self._pairing.result.timings['discover'] = discover_sec
+        self._pairing.start()
+
+    def _on_target_paired(self, result: PairingResult):
+        self.pairing_result = result
+        self._paired_with_target = 'pair' in result.done
+        self._trusted_device = 'trust' in result.done
+        self._connected_to_target = 'connect' in result.done
+        self._pairing = None
+
+        if result.success:
+            BluetoothController.log(msg=f"Paired with {result.address}.", log_type=self.log_type)
+        else:
+            BluetoothController.log(msg=f"Pairing with {result.address} failed at {result.failed_step} : "
+                                        f"{result.error}", log_type=self.log_type, level=LogLevels.WARNING)
+        BluetoothController.log(msg="Timings : " + ", ".join(f"{phase} {sec:.3f}s"
+                                                             for phase, sec in result.timings.items()),
+                                log_type=self.log_type)
+
+        if self.on_target_paired is not None:
+            self.on_target_paired(result)
+        self.pair_target_timeout()
+
+    def _pair_target_expired(self):
+        self._timer_id = None
+        if self._pairing is not None:
+            # the pipeline has its own timeouts, cancel() delivers its result.
+            self._pairing.cancel()
+            return False
+
+        result = PairingResult(self._target_bd_addr, None)
+        result.error = 'not found'
+        result.timings['discover'] = result.timings['total'] = time.monotonic() - self._mode_started_at
+        self._on_target_paired(result)
+        return False
+
+    def pair_target_timeout(self):
+        if self._timer_id is not None:
+            GObject.source_remove(self._timer_id)
+            self._timer_id = None
+        if self._pairing is not None:
+            pairing, self._pairing = self._pairing, None
+            pairing.on_done = None
+            pairing.cancel()
+
+        self._stop_discovery_window()
+        self._clear_adapter_filters()
+        self._scan_adapters = set()
+        self._discovering = False
+
+        self._unsubscribe_adapters()
+
+        if self._agent is not None:
+            self._agent.unregister()
+            self._agent.remove_from_connection()
+            self._agent = None
+        self._agent_registered = False
+        self.__is_running = False
+        self._stopped.set()
 
-        self._scanner_mainloop = None
-        self._scanner_thread = None
+        BluetoothController.log(msg=f"Stopped operation : {self.mode}", log_type=self.log_type)
+        return True
 
     def show_controller_info(self):
         BluetoothController.log(msg="#" * 15, log_type=self.log_type)
         for prop in self.__dict__:
             BluetoothController.log(msg=f"{prop} : {self.__dict__[prop]}", log_type=self.log_type)
         BluetoothController.log(msg="#" * 15, log_type=self.log_type)
+
+
+class _ScanPause:
+    def __init__(self, controller, reason):
+        self._controller = controller
+        self._reason = reason
+
+    def __enter__(self):
+        self._controller.pause_scanning(self._reason)
+        return self._controller
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._controller.resume_scanning(self._reason)
+        return False
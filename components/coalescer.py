@@ -0,0 +1,85 @@
+import threading
+import time
+
+import components.conf as c
+from components.metrics import Metrics
+
+
+class ChangeCoalescer:
+    """
+    Merges PropertiesChanged of each device into one mutable record and emits at most one
+    aggregated update per device per interval : emit(path, properties, changed_keys).
+    Updates of devices weaker than min_rssi are not emitted (None : every device).
+    flush() must be called periodically (e.g. from a GObject timer) to emit trailing changes.
+
+    Metrics : changes, emitted, filtered
+    """
+
+    def __init__(self, emit, interval=c.BluetoothConstants.COALESCE_INTERVAL_SEC,
+                 min_rssi=c.BluetoothConstants.MIN_ACCEPTABLE_VALUE_RSSI,
+                 watch_rssi=c.BluetoothConstants.WATCH_RSSI, records=None, record_factory=dict):
+        self.emit = emit
+        self.interval = interval
+        self.min_rssi = min_rssi
+        self.watch_rssi = watch_rssi
+        self.record_factory = record_factory
+        self.metrics = Metrics()
+
+        self._lock = threading.RLock()
+        self._records = records if records is not None else {}
+        self._dirty = {}
+        self._last_emit = {}
+
+    def add(self, path, properties):
+        with self._lock:
+            self._records[path] = properties
+
+    def remove(self, path):
+        with self._lock:
+            self._dirty.pop(path, None)
+            self._last_emit.pop(path, None)
+            return self._records.pop(path, None)
+
+    def update(self, path, changed):
+        """
+        Merge changed properties into the record of path, emit right away if the device
+        has not been emitted within the last interval.
+        """
+        now = time.monotonic()
+        with self._lock:
+            record = self._records.get(path)
+            if record is None:
+                record = self._records[path] = self.record_factory()
+            record.update(changed)
+            self.metrics.incr('changes')
+
+            if not self.watch_rssi and all(key == 'RSSI' for key in changed):
+                return
+            self._dirty.setdefault(path, set()).update(changed)
+
+            if now - self._last_emit.get(path, 0) >= self.interval:
+                self._emit(path, now)
+
+    def flush(self):
+        """
+        Emit every pending device whose interval has elapsed.
+        Return : True, so it can be used as a GObject timeout callback.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for path in [path for path in self._dirty if now - self._last_emit.get(path, 0) >= self.interval]:
+                self._emit(path, now)
+        return True
+
+    def _emit(self, path, now):
+        changed_keys = self._dirty.pop(path)
+        record = self._records[path]
+
+        rssi = record.get('RSSI')
+        if rssi is not None and self.min_rssi is not None and rssi < self.min_rssi:
+            self.metrics.incr('filtered')
+            return
+
+        self._last_emit[path] = now
+        self.metrics.incr('emitted')
+        self.emit(path, dict(record), changed_keys)
@@ -11,8 +11,64 @@ class BluetoothConstants:
     OBEX_SESSION_INTERFACE = 'org.bluez.obex.Session1'
 
     AGENT_INTERFACE = 'org.bluez.Agent1'
+    AGENT_MANAGER_INTERFACE = 'org.bluez.AgentManager1'
+    AGENT_MANAGER_PATH = '/org/bluez'
+    AGENT_PATH = '/bt_controller/agent'
+    AGENT_CAPABILITY = 'NoInputNoOutput'
+    # pair-target mode : per-step D-Bus timeouts, retries of a failed step, time to wait for the target
+    # (discovery only, the per-step timeouts bound pairing once it is found)
+    PAIR_TIMEOUT_SEC = 30
+    TRUST_TIMEOUT_SEC = 5
+    CONNECT_TIMEOUT_SEC = 15
+    PAIR_RETRIES = 2
+    PAIR_RETRY_DELAY_SEC = 1.0
+    PAIR_TARGET_TIMEOUT_SEC = 60
+    # components.provisioning.BulkProvisioner : pipelines in total / per adapter, retries of a failed target
+    # after PROVISION_BACKOFF_SEC doubling per attempt, time limit of a batch
+    PROVISION_CONCURRENCY = 4
+    PROVISION_PER_ADAPTER = 2
+    PROVISION_RETRIES = 3
+    PROVISION_BACKOFF_SEC = 2.0
+    PROVISION_TIMEOUT_SEC = 600
     WATCH_RSSI = True
     MIN_ACCEPTABLE_VALUE_RSSI = -70
+    # components.proximity.ProximityEngine (needs numpy) in scan-all : RSSI smoothed every PROXIMITY_TICK_SEC
+    # ('ema' or 'kalman'), distance from TX power at 1m and path loss exponent. A device enters from
+    # PROXIMITY_ENTER_RSSI and leaves under PROXIMITY_LEAVE_RSSI or when unseen for PROXIMITY_LEAVE_AFTER_SEC,
+    # it's near under PROXIMITY_NEAR_M and far again over PROXIMITY_FAR_M.
+    PROXIMITY_ENABLED = False
+    PROXIMITY_TICK_SEC = 0.5
+    PROXIMITY_CAPACITY = 1024
+    PROXIMITY_HISTORY = 32
+    PROXIMITY_SMOOTHING = 'ema'
+    PROXIMITY_EMA_ALPHA = 0.3
+    PROXIMITY_KALMAN_PROCESS_NOISE = 0.5
+    PROXIMITY_KALMAN_MEASUREMENT_NOISE = 16.0
+    PROXIMITY_TX_POWER = -59
+    PROXIMITY_PATH_LOSS_EXPONENT = 2.0
+    PROXIMITY_ENTER_RSSI = MIN_ACCEPTABLE_VALUE_RSSI
+    PROXIMITY_LEAVE_RSSI = -80
+    PROXIMITY_LEAVE_AFTER_SEC = 10
+    PROXIMITY_NEAR_M = 1.0
+    PROXIMITY_FAR_M = 2.0
+    # components.scheduler.ScanScheduler duty cycle : scan window, idle window growing by SCAN_BACKOFF
+    # while nothing new is found, back-to-back windows from SCAN_BURST_DEVICES new devices per window.
+    SCAN_WINDOW_SEC = 10
+    SCAN_IDLE_SEC = 5
+    SCAN_MAX_IDLE_SEC = 60
+    SCAN_BACKOFF = 2.0
+    SCAN_BURST_DEVICES = 5
+    # scan-all mode stops after this many seconds, None : runs until stop()
+    SCAN_DURATION_SEC = None
+    # discovery filter of the scan modes, e.g. {'Transport': 'le', 'RSSI': MIN_ACCEPTABLE_VALUE_RSSI}
+    # (components.discovery.DiscoveryFilter), None : every device is reported
+    DISCOVERY_FILTER = None
+    # ManufacturerData / ServiceData decoded into typed frames (components.advertisement), payloads cached per
+    # decoder, the same beacon re-advertises the same bytes.
+    DECODE_ADVERTISEMENTS = True
+    ADVERTISEMENT_CACHE_SIZE = 4096
+    # PropertiesChanged of a device are merged and emitted at most once per interval (0 : no coalescing)
+    COALESCE_INTERVAL_SEC = 1.0
 
     BLUEZ_NAMESPACE = "/org/bluez/"
     BLUEZ_SERVICE_NAME = "org.bluez"
@@ -21,6 +77,37 @@ class BluetoothConstants:
     ADAPTER_INTERFACE = BLUEZ_SERVICE_NAME + ".Adapter1"
     DEVICE_INTERFACE = BLUEZ_SERVICE_NAME + ".Device1"
 
+    # InterfacesAdded payload is used as is when these are present, otherwise GetAll is called.
+    DEVICE_REQUIRED_PROPERTIES = ('Address', 'Alias')
+
+    # components.dispatcher.EventDispatcher defaults (policy : drop-oldest, coalesce, backpressure)
+    DISPATCH_QUEUE_SIZE = 4096
+    DISPATCH_BATCH_SIZE = 64
+    DISPATCH_WORKERS = 1
+    DISPATCH_OVERFLOW_POLICY = 'drop-oldest'
+
+    # components.store.DeviceStore file of the controller, None disables the on-disk device cache
+    DEVICE_STORE_FILE = None
+    # devices updated by scan-all are written to the store at least every DEVICE_STORE_FLUSH_SEC
+    DEVICE_STORE_FLUSH_SEC = 30
+
+    # components.eviction.DeviceEvictor, run by scan-all if EVICT_STALE_DEVICES : devices that are not paired,
+    # trusted or connected and not seen for EVICT_AFTER_SEC are removed from BlueZ every EVICT_INTERVAL_SEC,
+    # least recently seen ones also while more than EVICT_MAX_DEVICES remain.
+    # Off by default : RemoveDevice deletes the devices for every application of the host, not only this one.
+    EVICT_STALE_DEVICES = False
+    EVICT_AFTER_SEC = 600
+    EVICT_INTERVAL_SEC = 60
+    EVICT_MAX_DEVICES = 2000
+    EVICT_BATCH_SIZE = 64
+
+    # match rules of components.subscriptions.SignalRouter are removed this long after their last subscriber,
+    # a mode restarting in between reuses them (None : kept until release())
+    SIGNAL_RULE_GRACE_SEC = 30
+
+    # max. number of proxy objects / interfaces kept by components.connection.BusConnection
+    PROXY_CACHE_SIZE = 256
+
     DBUS_PROPERTIES = "org.freedesktop.DBus.Properties"
     DBUS_OM_IFACE = "org.freedesktop.DBus.ObjectManager"
     DBUS_PROP_IFACE = "org.freedesktop.DBus.Properties"
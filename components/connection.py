@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+
+import components.conf as c
+from components.lazyimport import lazy_import
+from components.mainloop import setup_dbus_mainloop
+
+dbus = lazy_import('dbus')
+
+
+class BusConnection:
+    """
+    Shared system bus connection with an LRU cache of proxy objects and interfaces.
+    Entries are keyed by (object path, interface) and evicted when 'InterfacesRemoved'
+    is received for their object path.
+    """
+
+    def __init__(self, max_size=c.BluetoothConstants.PROXY_CACHE_SIZE):
+        self.max_size = max_size
+
+        self._lock = threading.RLock()
+        self._bus = None
+        self._removed_match = None
+        self._cache = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def bus(self):
+        with self._lock:
+            if self._bus is None:
+                setup_dbus_mainloop()
+                self._bus = dbus.SystemBus()
+                self._removed_match = self._bus.add_signal_receiver(self._on_interfaces_removed,
+                                                                    bus_name=c.BluetoothConstants.BLUEZ_SERVICE_NAME,
+                                                                    dbus_interface=c.BluetoothConstants.DBUS_OM_IFACE,
+                                                                    signal_name="InterfacesRemoved")
+            return self._bus
+
+    def get_object(self, path):
+        """
+        Return : cached proxy object of org.bluez at path.
+        """
+        return self.get_interface(path, None)
+
+    def get_interface(self, path, interface):
+        """
+        Return : cached dbus.Interface of org.bluez object at path, proxy object if interface is None.
+        """
+        key = (str(path), interface)
+        with self._lock:
+            item = self._cache.get(key)
+            if item is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return item
+            self.misses += 1
+
+        if interface is None:
+            item = self.bus.get_object(c.BluetoothConstants.BLUEZ_SERVICE_NAME, path)
+        else:
+            item = dbus.Interface(self.get_object(path), interface)
+
+        with self._lock:
+            self._cache[key] = item
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return item
+
+    def evict(self, path):
+        """
+        Drop cached proxies and interfaces of path and of the objects below it.
+        """
+        path = str(path)
+        prefix = path + '/'
+        with self._lock:
+            for key in [key for key in self._cache if key[0] == path or key[0].startswith(prefix)]:
+                del self._cache[key]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _on_interfaces_removed(self, path, interfaces):
+        self.evict(path)
@@ -0,0 +1,185 @@
+import sys
+from collections.abc import MutableMapping
+
+
+def address_to_int(address: str):
+    # e.g. convert 12:34:44:00:66:D5 to 0x12344400 66D5
+    return int(address.replace(':', '').replace('-', ''), 16)
+
+
+def int_to_address(value: int):
+    # e.g. convert 0x1234440066D5 to 12:34:44:00:66:D5
+    digits = '%012X' % value
+    return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+# Device1 property -> slot, strings of the interned slots repeat across devices.
+_FIELDS = {
+    'AddressType': 'address_type',
+    'Name': 'name',
+    'Alias': 'alias',
+    'Class': 'device_class',
+    'Appearance': 'appearance',
+    'Icon': 'icon',
+    'RSSI': 'rssi',
+    'TxPower': 'tx_power',
+    'Adapter': 'adapter',
+    'ManufacturerData': 'manufacturer_data',
+    'ServiceData': 'service_data',
+}
+_INTERNED = ('address_type', 'icon', 'adapter')
+
+# boolean Device1 properties, kept as bits of DeviceRecord._flags
+_FLAGS = {name: 1 << bit for bit, name in enumerate(
+    ('Paired', 'Bonded', 'Trusted', 'Blocked', 'Connected', 'LegacyPairing', 'ServicesResolved', 'WakeAllowed'))}
+
+
+class DeviceRecord(MutableMapping):
+    """
+    Compact record of one remote device.
+    Address is kept as a 48-bit int, booleans as bits, UUIDs as a tuple of interned strings;
+    properties without a slot go to the 'extra' dict.
+    Behaves like the Device1 properties dict (record['RSSI'], dict(record), record.update(changed)).
+    """
+    __slots__ = ('address', 'uuids', '_flags', '_flags_set', 'extra') + tuple(_FIELDS.values())
+
+    def __init__(self, properties=None):
+        self.address = None
+        self.uuids = None
+        self._flags = 0
+        self._flags_set = 0
+        self.extra = None
+        for slot in _FIELDS.values():
+            setattr(self, slot, None)
+
+        if properties:
+            self.update(properties)
+
+    @classmethod
+    def from_properties(cls, properties):
+        if isinstance(properties, DeviceRecord):
+            return properties
+        return cls(properties)
+
+    def __getitem__(self, key):
+        if key == 'Address':
+            if self.address is None:
+                raise KeyError(key)
+            return int_to_address(self.address)
+        if key == 'UUIDs':
+            if self.uuids is None:
+                raise KeyError(key)
+            return list(self.uuids)
+
+        bit = _FLAGS.get(key)
+        if bit is not None:
+            if not self._flags_set & bit:
+                raise KeyError(key)
+            return bool(self._flags & bit)
+
+        slot = _FIELDS.get(key)
+        if slot is not None:
+            value = getattr(self, slot)
+            if value is None:
+                raise KeyError(key)
+            return value
+
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key == 'Address':
+            self.address = address_to_int(value)
+            return
+        if key == 'UUIDs':
+            self.uuids = tuple(sys.intern(str(uuid)) for uuid in value)
+            return
+
+        bit = _FLAGS.get(key)
+        if bit is not None:
+            self._flags_set |= bit
+            if value:
+                self._flags |= bit
+            else:
+                self._flags &= ~bit
+            return
+
+        slot = _FIELDS.get(key)
+        if slot is not None:
+            if slot in _INTERNED and isinstance(value, str):
+                value = sys.intern(str(value))
+            setattr(self, slot, value)
+            return
+
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key == 'Address':
+            self.address = None
+        elif key == 'UUIDs':
+            self.uuids = None
+        elif key in _FLAGS:
+            self._flags_set &= ~_FLAGS[key]
+            self._flags &= ~_FLAGS[key]
+        elif key in _FIELDS:
+            setattr(self, _FIELDS[key], None)
+        else:
+            del self.extra[key]
+            if not self.extra:
+                self.extra = None
+
+    def __iter__(self):
+        if self.address is not None:
+            yield 'Address'
+        for key, slot in _FIELDS.items():
+            if getattr(self, slot) is not None:
+                yield key
+        for key, bit in _FLAGS.items():
+            if self._flags_set & bit:
+                yield key
+        if self.uuids is not None:
+            yield 'UUIDs'
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __repr__(self):
+        return f"DeviceRecord({dict(self)!r})"
+
+    def memory_usage(self):
+        """
+        Return : approx. bytes held by this record (interned strings are not counted).
+        """
+        size = sys.getsizeof(self)
+        for slot in ('name', 'alias', 'manufacturer_data', 'service_data', 'uuids', 'extra'):
+            value = getattr(self, slot)
+            if value is not None:
+                size += sys.getsizeof(value)
+        for data in (self.manufacturer_data, self.service_data):
+            if data:
+                size += sum(sys.getsizeof(value) for value in data.values())
+        return size
+
+
+def memory_per_device(records):
+    """
+    Return : average approx. bytes per DeviceRecord, 0 if there is none.
+    """
+    records = list(records)
+    if not records:
+        return 0
+    return sum(record.memory_usage() for record in records) / len(records)
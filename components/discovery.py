@@ -0,0 +1,102 @@
+from components.lazyimport import lazy_import
+
+dbus = lazy_import('dbus')
+
+
+class Transports:
+    AUTO = 'auto'
+    BREDR = 'bredr'
+    LE = 'le'
+
+
+class DiscoveryFilter:
+    """
+    Filter applied by BlueZ with org.bluez.Adapter1.SetDiscoveryFilter, so devices that don't match
+    never reach the process.
+        uuids : service UUIDs, a device matches if it advertises any of them
+        rssi : min. RSSI (dBm), pathloss : max. TxPower - RSSI (dB), only one of both
+        transport : Transports.AUTO / BREDR / LE
+        duplicate_data : False to stop PropertiesChanged when advertising data didn't change
+        discoverable : only report devices in discoverable mode
+        pattern : address or name prefix
+    Unset (None) fields are left to BlueZ defaults.
+    """
+
+    def __init__(self, uuids=None, rssi=None, pathloss=None, transport=None, duplicate_data=None,
+                 discoverable=None, pattern=None):
+        if rssi is not None and pathloss is not None:
+            raise ValueError("rssi and pathloss can't be used together")
+        self.uuids = [uuid.lower() for uuid in uuids] if uuids else None
+        self.rssi = rssi
+        self.pathloss = pathloss
+        self.transport = transport
+        self.duplicate_data = duplicate_data
+        self.discoverable = discoverable
+        self.pattern = pattern
+
+    @classmethod
+    def from_dict(cls, filter_dict):
+        """
+        filter_dict : SetDiscoveryFilter names (UUIDs, RSSI, ...) or keyword names (uuids, rssi, ...).
+        """
+        if filter_dict is None or isinstance(filter_dict, DiscoveryFilter):
+            return filter_dict
+        names = {'UUIDs': 'uuids', 'RSSI': 'rssi', 'Pathloss': 'pathloss', 'Transport': 'transport',
+                 'DuplicateData': 'duplicate_data', 'Discoverable': 'discoverable', 'Pattern': 'pattern'}
+        return cls(**{names.get(key, key): value for key, value in filter_dict.items()})
+
+    def to_dbus(self):
+        """
+        Return : SetDiscoveryFilter argument (a{sv}).
+        """
+        arguments = {}
+        if self.uuids is not None:
+            arguments['UUIDs'] = dbus.Array(self.uuids, signature='s')
+        if self.rssi is not None:
+            arguments['RSSI'] = dbus.Int16(self.rssi)
+        if self.pathloss is not None:
+            arguments['Pathloss'] = dbus.UInt16(self.pathloss)
+        if self.transport is not None:
+            arguments['Transport'] = dbus.String(self.transport)
+        if self.duplicate_data is not None:
+            arguments['DuplicateData'] = dbus.Boolean(self.duplicate_data)
+        if self.discoverable is not None:
+            arguments['Discoverable'] = dbus.Boolean(self.discoverable)
+        if self.pattern is not None:
+            arguments['Pattern'] = dbus.String(self.pattern)
+        return dbus.Dictionary(arguments, signature='sv')
+
+    def matches(self, properties):
+        """
+        Check Device1 properties (full or changed) against the filter the way BlueZ does,
+        properties that are not present are not checked.
+        Return : True if the device passes the filter.
+        """
+        rssi = properties.get('RSSI')
+        if rssi is not None:
+            if self.rssi is not None and rssi < self.rssi:
+                return False
+            tx_power = properties.get('TxPower')
+            if self.pathloss is not None and tx_power is not None and tx_power - rssi > self.pathloss:
+                return False
+
+        if self.uuids is not None:
+            uuids = properties.get('UUIDs')
+            service_data = properties.get('ServiceData')
+            if uuids is not None or service_data is not None:
+                advertised = {str(uuid).lower() for uuid in (uuids or ())}
+                advertised.update(str(uuid).lower() for uuid in (service_data or ()))
+                if advertised.isdisjoint(self.uuids):
+                    return False
+
+        if self.pattern:
+            address = properties.get('Address')
+            name = properties.get('Name')
+            if (address is not None or name is not None) and \
+                    not (str(address or '').startswith(self.pattern) or str(name or '').startswith(self.pattern)):
+                return False
+        return True
+
+    def __repr__(self):
+        fields = {key: value for key, value in self.__dict__.items() if value is not None}
+        return f"DiscoveryFilter({fields!r})"
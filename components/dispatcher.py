@@ -0,0 +1,156 @@
+import collections
+import threading
+import time
+
+import components.conf as c
+import components.utils as u
+from components.metrics import Metrics
+
+
+class DeviceEvents:
+    FOUND = 'found'
+    CHANGED = 'changed'
+    REMOVED = 'removed'
+    PROXIMITY = 'proximity'
+
+
+class OverflowPolicies:
+    DROP_OLDEST = 'drop-oldest'    # full queue : oldest event is dropped.
+    COALESCE = 'coalesce'          # queued events of the same kind & device are merged, then drop-oldest.
+    BACKPRESSURE = 'backpressure'  # full queue : producer waits up to block_timeout, then the event is dropped.
+
+
+class Event:
+    __slots__ = ('kind', 'key', 'payload', 'enqueued_at')
+
+    def __init__(self, kind, key, payload, enqueued_at):
+        self.kind = kind
+        self.key = key
+        self.payload = payload
+        self.enqueued_at = enqueued_at
+
+
+class EventDispatcher:
+    """
+    Bounded queue between D-Bus signal handlers and user callbacks.
+    Signal handlers only put() events; worker threads call consumer(list of Event) in batches,
+    so a slow consumer doesn't stall signal processing on the GLib thread.
+    With more than one worker, events of the same device may be delivered out of order.
+
+    Metrics : queue_depth, enqueued, dropped, coalesced, delivered, batches,
+              latency_max_ms, latency_total_ms (signal -> callback)
+    """
+
+    def __init__(self, consumer, max_size=c.BluetoothConstants.DISPATCH_QUEUE_SIZE,
+                 batch_size=c.BluetoothConstants.DISPATCH_BATCH_SIZE,
+                 workers=c.BluetoothConstants.DISPATCH_WORKERS,
+                 policy=c.BluetoothConstants.DISPATCH_OVERFLOW_POLICY,
+                 block_timeout=1.0):
+        if policy not in (OverflowPolicies.DROP_OLDEST, OverflowPolicies.COALESCE, OverflowPolicies.BACKPRESSURE):
+            raise ValueError(f"Undefined overflow policy : {policy}")
+
+        self.consumer = consumer
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.metrics = Metrics()
+
+        self._cond = threading.Condition()
+        self._queue = collections.OrderedDict()
+        self._seq = 0
+        self._running = False
+        self._workers = [threading.Thread(target=self._work, name=f"dispatcher-{i}", daemon=True)
+                         for i in range(workers)]
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self, drain=True):
+        """
+        Stop workers. Events left in the queue are delivered first if drain is True.
+        """
+        with self._cond:
+            if not drain:
+                self._queue.clear()
+            self._running = False
+            self._cond.notify_all()
+        for worker in self._workers:
+            if worker.is_alive() and worker is not threading.current_thread():
+                worker.join()
+
+    def put(self, kind, key, payload=None):
+        """
+        Queue an event.
+        Return : True if queued or merged, False if dropped.
+        """
+        with self._cond:
+            if self.policy == OverflowPolicies.COALESCE:
+                item_key = (kind, key)
+                event = self._queue.get(item_key)
+                if event is not None:
+                    if isinstance(event.payload, dict) and isinstance(payload, dict):
+                        event.payload.update(payload)
+                    else:
+                        event.payload = payload
+                    self.metrics.incr('coalesced')
+                    return True
+            else:
+                item_key = self._seq
+                self._seq += 1
+
+            while len(self._queue) >= self.max_size:
+                if self.policy == OverflowPolicies.BACKPRESSURE and self._running:
+                    if self._cond.wait_for(lambda: len(self._queue) < self.max_size or not self._running,
+                                           self.block_timeout):
+                        continue
+                    self.metrics.incr('dropped')
+                    return False
+                self._queue.popitem(last=False)
+                self.metrics.incr('dropped')
+
+            if isinstance(payload, dict) and self.policy == OverflowPolicies.COALESCE:
+                payload = dict(payload)
+            self._queue[item_key] = Event(kind, key, payload, time.monotonic())
+            self.metrics.incr('enqueued')
+            self.metrics.set('queue_depth', len(self._queue))
+            self._cond.notify()
+        return True
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def _next_batch(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._queue or not self._running)
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popitem(last=False)[1])
+            self.metrics.set('queue_depth', len(self._queue))
+            self._cond.notify_all()
+            return batch
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+
+            try:
+                self.consumer(batch)
+            except Exception as e:
+                u.log_direct(f"Error at EventDispatcher consumer : {str(e.args)}", c.LOG_TYPE)
+
+            now = time.monotonic()
+            latency_max = max(now - event.enqueued_at for event in batch) * 1000
+            self.metrics.incr('delivered', len(batch))
+            self.metrics.incr('batches')
+            self.metrics.incr('latency_total_ms', sum(now - event.enqueued_at for event in batch) * 1000)
+            if latency_max > self.metrics.get('latency_max_ms'):
+                self.metrics.set('latency_max_ms', latency_max)
@@ -0,0 +1,199 @@
+import collections
+import threading
+import time
+from concurrent import futures
+
+import components.conf as c
+import components.utils as u
+from common.logger import LogLevels
+from components.lazyimport import lazy_import
+from components.mainloop import MainLoopThread
+from components.metrics import Metrics
+from components.subscriptions import SignalRouter
+
+GObject = lazy_import('gi.repository.GObject')
+
+_DOES_NOT_EXIST = 'org.bluez.Error.DoesNotExist'
+
+
+class DeviceEvictor:
+    """
+    Removes stale device objects from BlueZ so the object tree (and every GetManagedObjects) stops growing.
+
+    Every interval seconds, devices that are not paired, trusted or connected and were not seen (InterfacesAdded
+    or RSSI change) for max_age seconds are removed. If more than max_devices remain, the least recently seen
+    evictable devices are removed too. RemoveDevice calls are pipelined, up to batch_size in flight.
+    Devices present before the evictor started count as seen at the first sweep.
+    Signals come through components.subscriptions.SignalRouter, restricted to the devices of adapter_paths.
+    Runs on the shared GLib main loop thread (components.mainloop).
+
+    Metrics : sweeps, evicted, failed, tree_size (gauge, devices left after the last sweep), sweep_ms (gauge)
+    """
+
+    def __init__(self, max_age=c.BluetoothConstants.EVICT_AFTER_SEC, interval=c.BluetoothConstants.EVICT_INTERVAL_SEC,
+                 max_devices=c.BluetoothConstants.EVICT_MAX_DEVICES, batch_size=c.BluetoothConstants.EVICT_BATCH_SIZE,
+                 adapter_paths=None, log_type=c.LOG_TYPE):
+        self.max_age = max_age
+        self.interval = interval
+        self.max_devices = max_devices
+        self.batch_size = batch_size
+        self.adapter_paths = set(adapter_paths) if adapter_paths is not None else None
+        self.log_type = log_type
+        self.metrics = Metrics()
+
+        self._last_seen = {}
+        self._subscriptions = []
+        self._timer_id = None
+
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._sweeping = False
+        self._queue = collections.deque()
+        self._in_flight = 0
+        self._sweep_started_at = None
+        self._sweep_devices = 0
+        self._sweep_evicted = 0
+
+    def start(self):
+        MainLoopThread.get().call(self._start)
+
+    def stop(self):
+        MainLoopThread.get().call(self._stop)
+
+    def sweep(self):
+        """
+        Run a sweep now (joins the running one).
+        Return : concurrent.futures.Future of the number of devices evicted by the sweep.
+        """
+        future = futures.Future()
+        with self._lock:
+            self._waiters.append(future)
+        MainLoopThread.get().call(self._sweep)
+        return future
+
+    # main loop thread.
+
+    def _start(self):
+        if self._subscriptions:
+            return
+        router = SignalRouter.get()
+        namespaces = sorted(self.adapter_paths) if self.adapter_paths is not None else \
+            [c.BluetoothConstants.BLUEZ_NAMESPACE.rstrip('/')]
+        for namespace in namespaces:
+            self._subscriptions += [
+                router.subscribe(c.BluetoothConstants.DBUS_OM_IFACE, "InterfacesAdded", self._on_interfaces_added,
+                                 path='/', arg0path=namespace + '/'),
+                router.subscribe(c.BluetoothConstants.DBUS_OM_IFACE, "InterfacesRemoved", self._on_interfaces_removed,
+                                 path='/', arg0path=namespace + '/'),
+                router.subscribe(c.BluetoothConstants.DBUS_PROPERTIES, "PropertiesChanged", self._on_properties_changed,
+                                 path_namespace=namespace, arg0=c.BluetoothConstants.DEVICE_INTERFACE,
+                                 path_keyword='path'),
+            ]
+        self._timer_id = GObject.timeout_add(int(self.interval * 1000), self._on_timer)
+        self._sweep()
+
+    def _stop(self):
+        for subscription in self._subscriptions:
+            subscription.remove()
+        self._subscriptions = []
+        if self._timer_id is not None:
+            GObject.source_remove(self._timer_id)
+            self._timer_id = None
+
+    def _on_timer(self):
+        self._sweep()
+        return True
+
+    def _on_interfaces_added(self, path, interfaces):
+        if c.BluetoothConstants.DEVICE_INTERFACE in interfaces:
+            self._last_seen[str(path)] = time.monotonic()
+
+    def _on_interfaces_removed(self, path, interfaces):
+        if c.BluetoothConstants.DEVICE_INTERFACE in interfaces:
+            self._last_seen.pop(str(path), None)
+
+    def _on_properties_changed(self, interface, changed, invalidated, path):
+        if 'RSSI' in changed:
+            self._last_seen[str(path)] = time.monotonic()
+
+    def _sweep(self):
+        if self._sweeping:
+            return
+        self._sweeping = True
+        self._sweep_started_at = time.monotonic()
+        manager = u.bus_connection.get_interface('/', c.BluetoothConstants.DBUS_OM_IFACE)
+        u.call_async(manager.GetManagedObjects, callback=self._on_objects)
+
+    def _on_objects(self, objects, error):
+        if error is not None:
+            self._log(f"GetManagedObjects failed : {error}", LogLevels.WARNING)
+            self._finish_sweep()
+            return
+
+        now = time.monotonic()
+        devices = set()
+        candidates = []
+        for path, interfaces in objects.items():
+            device = interfaces.get(c.BluetoothConstants.DEVICE_INTERFACE)
+            if device is None:
+                continue
+            if self.adapter_paths is not None and u.device_path_to_adapter_path(path) not in self.adapter_paths:
+                continue
+            devices.add(path)
+            last_seen = self._last_seen.setdefault(path, now)
+            if device.get('Paired') or device.get('Trusted') or device.get('Connected'):
+                continue
+            candidates.append((last_seen, path))
+
+        for path in set(self._last_seen) - devices:
+            del self._last_seen[path]
+
+        candidates.sort()
+        stale = [path for last_seen, path in candidates if now - last_seen >= self.max_age]
+        over = len(devices) - len(stale) - self.max_devices
+        if over > 0:
+            stale.extend([path for last_seen, path in candidates if now - last_seen < self.max_age][:over])
+
+        self._sweep_devices = len(devices)
+        self._sweep_evicted = 0
+        self._queue.extend(stale)
+        self._remove_next()
+
+    def _remove_next(self):
+        while self._queue and self._in_flight < self.batch_size:
+            path = self._queue.popleft()
+            adapter_interface = u.bus_connection.get_interface(u.device_path_to_adapter_path(path),
+                                                               c.BluetoothConstants.ADAPTER_INTERFACE)
+            self._in_flight += 1
+            u.call_async(adapter_interface.RemoveDevice, path,
+                         callback=lambda result, error, path=path: self._on_removed(path, error))
+        if not self._queue and not self._in_flight:
+            self._finish_sweep()
+
+    def _on_removed(self, path, error):
+        self._in_flight -= 1
+        if error is None or error.get_dbus_name() == _DOES_NOT_EXIST:
+            self._last_seen.pop(path, None)
+            self._sweep_evicted += 1
+            self.metrics.incr('evicted')
+        else:
+            self.metrics.incr('failed')
+            self._log(f"RemoveDevice({path}) failed : {error}", LogLevels.WARNING)
+        self._remove_next()
+
+    def _finish_sweep(self):
+        self._sweeping = False
+        self.metrics.incr('sweeps')
+        self.metrics.set('tree_size', self._sweep_devices - self._sweep_evicted)
+        self.metrics.set('sweep_ms', (time.monotonic() - self._sweep_started_at) * 1000)
+        if self._sweep_evicted:
+            self._log(f"Evicted {self._sweep_evicted} of {self._sweep_devices} devices in "
+                      f"{self.metrics.get('sweep_ms'):.0f}ms.")
+
+        with self._lock:
+            waiters, self._waiters = self._waiters, []
+        for future in waiters:
+            future.set_result(self._sweep_evicted)
+
+    def _log(self, msg, level=LogLevels.INFO):
+        u.logger.log(level, "[EVICTION] %s", msg, log_type=self.log_type)
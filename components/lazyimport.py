@@ -0,0 +1,46 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access, e.g. dbus = lazy_import('dbus').
+    Keeps dbus-python and gi out of the import time of modules that only need them once they use the bus.
+    Attributes are cached on the stand-in after the first access.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_LazyModule__name'] = name
+        self.__dict__['_LazyModule__module'] = None
+        self.__dict__['_LazyModule__lock'] = threading.Lock()
+
+    def _load(self):
+        module = self.__module
+        if module is None:
+            with self.__lock:
+                if self.__module is None:
+                    self.__dict__['_LazyModule__module'] = importlib.import_module(self.__name)
+                module = self.__module
+        return module
+
+    @property
+    def loaded(self):
+        return self.__module is not None
+
+    def __getattr__(self, attribute):
+        value = getattr(self._load(), attribute)
+        self.__dict__[attribute] = value
+        return value
+
+    def __setattr__(self, attribute, value):
+        raise AttributeError(f"Can't set {attribute} on lazily imported module {self.__name}")
+
+    def __repr__(self):
+        return f"<lazy module '{self.__name}'{' (loaded)' if self.loaded else ''}>"
+
+
+def lazy_import(name):
+    """
+    Return : LazyModule of name, the module is imported on first attribute access.
+    """
+    return LazyModule(name)
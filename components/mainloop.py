@@ -0,0 +1,60 @@
+import importlib
+import threading
+
+from components.lazyimport import lazy_import
+
+GObject = lazy_import('gi.repository.GObject')
+
+_dbus_mainloop_lock = threading.Lock()
+_dbus_mainloop_set = False
+
+
+def setup_dbus_mainloop():
+    """
+    Make GLib the default main loop of dbus-python, once per process (before the first bus connection).
+    """
+    global _dbus_mainloop_set
+    with _dbus_mainloop_lock:
+        if not _dbus_mainloop_set:
+            importlib.import_module('dbus.mainloop.glib').DBusGMainLoop(set_as_default=True)
+            _dbus_mainloop_set = True
+
+
+class MainLoopThread:
+    """
+    A single GLib main loop running on a daemon thread.
+    D-Bus signal handlers and async reply handlers of every user are dispatched from it,
+    so callers don't need one loop thread per scan.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        setup_dbus_mainloop()
+        self._mainloop = GObject.MainLoop()
+        self._thread = threading.Thread(target=self._mainloop.run, name="glib-mainloop", daemon=True)
+
+    @classmethod
+    def get(cls):
+        """
+        Return : the shared, running MainLoopThread.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = MainLoopThread()
+                cls._instance._thread.start()
+            return cls._instance
+
+    @property
+    def is_running(self):
+        return self._mainloop.is_running()
+
+    def call(self, func, *args):
+        """
+        Run func(*args) on the main loop thread.
+        """
+        def run_once():
+            func(*args)
+            return False
+
+        GObject.idle_add(run_once)
@@ -0,0 +1,47 @@
+import threading
+import time
+
+
+class Metrics:
+    """
+    Thread safe named counters and gauges.
+    rate(name) returns events per second since creation or last reset().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._started_at = time.monotonic()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self._values[name] = value
+
+    def get(self, name, default=0):
+        with self._lock:
+            return self._values.get(name, default)
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self._started_at
+
+    def rate(self, name):
+        elapsed = self.elapsed
+        if elapsed <= 0:
+            return 0.0
+        return self.get(name) / elapsed
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+            self._started_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            values = dict(self._values)
+        values['elapsed_sec'] = self.elapsed
+        return values
@@ -0,0 +1,190 @@
+import time
+
+import components.conf as c
+import components.utils as u
+from components.lazyimport import lazy_import
+from components.scheduler import pause_scanning, resume_scanning
+
+dbus = lazy_import('dbus')
+GObject = lazy_import('gi.repository.GObject')
+
+
+class PairingSteps:
+    PAIR = 'pair'
+    TRUST = 'trust'
+    CONNECT = 'connect'
+
+    ALL = (PAIR, TRUST, CONNECT)
+
+
+# errors meaning the step was already done.
+_ALREADY_DONE = {
+    PairingSteps.PAIR: 'org.bluez.Error.AlreadyExists',
+    PairingSteps.CONNECT: 'org.bluez.Error.AlreadyConnected',
+}
+_NO_REPLY = 'org.freedesktop.DBus.Error.NoReply'
+
+
+class PairingResult:
+    """
+    Outcome of a PairingPipeline.
+        done : steps completed (already paired/trusted/connected devices count as done)
+        failed_step, error : first step that failed after all retries and its D-Bus error name/message
+        attempts : {step : calls made}, timings : {phase : seconds}, phases are the steps,
+                   'discover' when the pipeline was started by a scan mode, and 'total'
+    """
+
+    def __init__(self, address, path):
+        self.address = address
+        self.path = path
+        self.done = []
+        self.failed_step = None
+        self.error = None
+        self.attempts = {}
+        self.timings = {}
+
+    @property
+    def success(self):
+        return self.failed_step is None and self.error is None
+
+    def to_dict(self):
+        return {'address': self.address, 'path': self.path, 'success': self.success, 'done': list(self.done),
+                'failed_step': self.failed_step, 'error': self.error, 'attempts': dict(self.attempts),
+                'timings': dict(self.timings)}
+
+    def __repr__(self):
+        return f"PairingResult({self.to_dict()!r})"
+
+
+class PairingPipeline:
+    """
+    Pair, trust and connect one device with asynchronous D-Bus calls (reply_handler / error_handler),
+    so the GLib main loop thread is never blocked. A main loop must be running.
+
+    Every step has its own D-Bus timeout and is retried up to retries times, retry_delay seconds apart;
+    a timed out Pair is cancelled with CancelPairing before the retry.
+    Steps already done according to properties (Paired, Trusted, Connected) are skipped.
+    Scan schedulers of the process are paused while the pipeline runs (components.scheduler.pause_scanning),
+    discovery competes with pairing and connection for the radio.
+    on_done(result) is called on the main loop thread once the pipeline finished or failed.
+    """
+
+    def __init__(self, device_path, on_done=None, properties=None, steps=PairingSteps.ALL, timeouts=None,
+                 retries=c.BluetoothConstants.PAIR_RETRIES, retry_delay=c.BluetoothConstants.PAIR_RETRY_DELAY_SEC):
+        self.device_path = device_path
+        self.on_done = on_done
+        self.steps = tuple(steps)
+        self.timeouts = {PairingSteps.PAIR: c.BluetoothConstants.PAIR_TIMEOUT_SEC,
+                         PairingSteps.TRUST: c.BluetoothConstants.TRUST_TIMEOUT_SEC,
+                         PairingSteps.CONNECT: c.BluetoothConstants.CONNECT_TIMEOUT_SEC}
+        self.timeouts.update(timeouts or {})
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+        self.result = PairingResult(u.path_to_device_address(device_path), device_path)
+        self.running = False
+        self._pause_reason = f"pairing {device_path}"
+
+        self._properties = properties or {}
+        self._index = 0
+        self._started_at = None
+        self._step_started_at = None
+        self._retry_timer_id = None
+
+    def start(self):
+        self.running = True
+        self._started_at = time.monotonic()
+        pause_scanning(self._pause_reason)
+        self._run_step(0)
+
+    def cancel(self):
+        """
+        Stop the pipeline, the result is delivered with error 'cancelled'.
+        """
+        if not self.running:
+            return
+        if self._retry_timer_id is not None:
+            GObject.source_remove(self._retry_timer_id)
+            self._retry_timer_id = None
+        if self.steps[self._index] == PairingSteps.PAIR:
+            self._cancel_pairing()
+        self._finish(self.steps[self._index], 'cancelled')
+
+    def _run_step(self, index):
+        if not self.running:
+            return
+        self._index = index
+        if index == len(self.steps):
+            self._finish()
+            return
+
+        step = self.steps[index]
+        if self._is_done(step):
+            self.result.done.append(step)
+            self._run_step(index + 1)
+            return
+
+        if step not in self.result.attempts:
+            self._step_started_at = time.monotonic()
+        self.result.attempts[step] = self.result.attempts.get(step, 0) + 1
+
+        handlers = {'reply_handler': lambda *_: self._on_step_done(step),
+                    'error_handler': lambda error: self._on_step_error(step, error),
+                    'timeout': self.timeouts[step]}
+        if step == PairingSteps.PAIR:
+            u.get_device_iface_by_path(self.device_path).Pair(**handlers)
+        elif step == PairingSteps.TRUST:
+            properties_interface = u.bus_connection.get_interface(self.device_path,
+                                                                  c.BluetoothConstants.DBUS_PROPERTIES)
+            properties_interface.Set(c.BluetoothConstants.DEVICE_INTERFACE, 'Trusted', dbus.Boolean(True), **handlers)
+        else:
+            u.get_device_iface_by_path(self.device_path).Connect(**handlers)
+
+    def _is_done(self, step):
+        if step == PairingSteps.PAIR:
+            return bool(self._properties.get('Paired'))
+        if step == PairingSteps.TRUST:
+            return bool(self._properties.get('Trusted'))
+        return bool(self._properties.get('Connected'))
+
+    def _on_step_done(self, step):
+        if not self.running or self.steps[self._index] != step:
+            return
+        self.result.timings[step] = time.monotonic() - self._step_started_at
+        self.result.done.append(step)
+        self._run_step(self._index + 1)
+
+    def _on_step_error(self, step, error):
+        if not self.running or self.steps[self._index] != step:
+            return
+        name = error.get_dbus_name() if isinstance(error, dbus.exceptions.DBusException) else None
+        if name is not None and name == _ALREADY_DONE.get(step):
+            self._on_step_done(step)
+            return
+        if step == PairingSteps.PAIR and name == _NO_REPLY:
+            self._cancel_pairing()
+
+        if self.result.attempts[step] > self.retries:
+            self._finish(step, name or str(error))
+            return
+        self._retry_timer_id = GObject.timeout_add(int(self.retry_delay * 1000), self._retry)
+
+    def _retry(self):
+        self._retry_timer_id = None
+        self._run_step(self._index)
+        return False
+
+    def _cancel_pairing(self):
+        u.get_device_iface_by_path(self.device_path).CancelPairing(reply_handler=lambda: None,
+                                                                   error_handler=lambda error: None)
+
+    def _finish(self, failed_step=None, error=None):
+        self.running = False
+        resume_scanning(self._pause_reason)
+        self.result.failed_step = failed_step
+        self.result.error = error
+        if failed_step is not None and failed_step in self.result.attempts:
+            self.result.timings[failed_step] = time.monotonic() - self._step_started_at
+        self.result.timings['total'] = time.monotonic() - self._started_at
+        if self.on_done is not None:
+            self.on_done(self.result)
@@ -0,0 +1,416 @@
+import csv
+import threading
+import time
+
+import components.conf as c
+import components.utils as u
+from common.logger import LogLevels
+from components.lazyimport import lazy_import
+from components.mainloop import MainLoopThread
+from components.metrics import Metrics
+from components.pairing import PairingPipeline, PairingResult
+from components.subscriptions import SignalRouter
+
+dbus = lazy_import('dbus')
+GObject = lazy_import('gi.repository.GObject')
+
+REPORT_FIELDS = ('address', 'alias', 'success', 'adapter', 'attempts', 'failed_step', 'error',
+                 'discover_sec', 'pair_sec', 'trust_sec', 'connect_sec', 'total_sec')
+
+
+class TargetStates:
+    WAITING = 'waiting'     # not seen yet
+    READY = 'ready'         # seen, waiting for a free slot
+    RUNNING = 'running'
+    BACKOFF = 'backoff'     # failed, retried later
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+def log(msg, log_type, level=LogLevels.INFO):
+    u.logger.log(level, "[PROVISIONING] %s", msg, log_type=log_type)
+
+
+def load_targets(file_name):
+    """
+    Read targets from a CSV file, with an 'address' column and an optional 'alias' column,
+    or without header, one address per line.
+    Return : list of {'address' : ..., 'alias' : ...}
+    """
+    with open(file_name, newline='') as f:
+        rows = [row for row in csv.reader(f) if row and row[0].strip() and not row[0].startswith('#')]
+    if not rows:
+        return []
+
+    header = [column.strip().lower() for column in rows[0]]
+    if 'address' in header:
+        address_column = header.index('address')
+        alias_column = header.index('alias') if 'alias' in header else None
+        rows = rows[1:]
+    else:
+        address_column, alias_column = 0, 1
+
+    targets = []
+    for row in rows:
+        alias = row[alias_column].strip() if alias_column is not None and alias_column < len(row) else None
+        targets.append({'address': row[address_column].strip(), 'alias': alias or None})
+    return targets
+
+
+class _Target:
+    __slots__ = ('address', 'alias', 'path', 'state', 'attempts', 'result', 'found_at')
+
+    def __init__(self, address, alias=None):
+        self.address = address
+        self.alias = alias
+        self.path = None
+        self.state = TargetStates.WAITING
+        self.attempts = 0
+        self.result = None
+        self.found_at = None
+
+
+class BulkProvisioner:
+    """
+    Pair, trust, connect and configure (Alias) many targets at once, on every adapter.
+
+    Everything runs on the shared GLib main loop thread (components.mainloop) with asynchronous
+    D-Bus calls, so pairings on different adapters overlap; signals of the adapters' devices only
+    (components.subscriptions.SignalRouter) :
+        * adapters discover until they hold a target, an adapter pairing a target stops discovering
+        * at most per_adapter pipelines per adapter and concurrency in total
+        * a failed target is retried up to retries times, after backoff, 2 * backoff, 4 * backoff ... seconds
+        * targets not done within timeout seconds fail
+    Targets already known by BlueZ are tried right away.
+
+        provisioner = BulkProvisioner(load_targets('line-3.csv'))
+        results = provisioner.run()
+        provisioner.write_report('line-3-report.csv')
+
+    Metrics : started, succeeded, failed, retried, in_progress (gauge)
+    """
+
+    def __init__(self, targets, adapter_paths=None, concurrency=c.BluetoothConstants.PROVISION_CONCURRENCY,
+                 per_adapter=c.BluetoothConstants.PROVISION_PER_ADAPTER,
+                 retries=c.BluetoothConstants.PROVISION_RETRIES, backoff=c.BluetoothConstants.PROVISION_BACKOFF_SEC,
+                 timeout=c.BluetoothConstants.PROVISION_TIMEOUT_SEC, on_result=None, log_type=c.LOG_TYPE):
+        self.adapter_paths = adapter_paths
+        self.concurrency = concurrency
+        self.per_adapter = per_adapter
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.on_result = on_result
+        self.log_type = log_type
+        self.metrics = Metrics()
+
+        self._targets = {}
+        self._invalid = []
+        for target in targets:
+            if isinstance(target, str):
+                target = {'address': target}
+            address = target['address']
+            if not u.checkMAC(address):
+                self._invalid.append(target)
+                continue
+            address = address.upper().replace('-', ':')
+            self._targets[address] = _Target(address, target.get('alias'))
+
+        self._bus = None
+        self._agent = None
+        self._subscriptions = []
+        self._adapters = []
+        self._discovering = set()
+        self._active = {}
+        self._pipelines = {}
+        self._timers = set()
+        self._started_at = None
+        self._finishing = False
+        self._done = threading.Event()
+
+    # public.
+
+    def start(self):
+        """
+        Start on the main loop thread, returns right away.
+        """
+        self._done.clear()
+        MainLoopThread.get().call(self._start)
+
+    def wait(self, timeout=None):
+        """
+        Return : list of per-target results (dicts, see REPORT_FIELDS), None if not finished within timeout.
+        """
+        if not self._done.wait(timeout):
+            return None
+        return self.results()
+
+    def run(self):
+        self.start()
+        return self.wait()
+
+    def cancel(self):
+        MainLoopThread.get().call(self._finish, 'cancelled')
+
+    def results(self):
+        results = [self._report_row(target) for target in self._targets.values()]
+        for target in self._invalid:
+            results.append({'address': target['address'], 'alias': target.get('alias'), 'success': False,
+                            'error': 'invalid address'})
+        return results
+
+    def write_report(self, file_name):
+        with open(file_name, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            for row in self.results():
+                writer.writerow(row)
+
+    # main loop thread.
+
+    def _start(self):
+        self._started_at = time.monotonic()
+        self._finishing = False
+        self._bus = u.bus_connection.bus
+        manager = u.bus_connection.get_interface('/', c.BluetoothConstants.DBUS_OM_IFACE)
+        u.call_async(manager.GetManagedObjects, callback=self._on_objects)
+
+    def _on_objects(self, objects, error):
+        if self._finishing:
+            return
+        if error is not None:
+            log(f"GetManagedObjects failed : {error}", self.log_type, LogLevels.WARNING)
+            self._finish('bus error')
+            return
+
+        adapters = self.adapter_paths if self.adapter_paths is not None else u.find_adapters(objects)
+        self._adapters = sorted(str(path) for path in adapters)
+        self._active = {adapter_path: 0 for adapter_path in self._adapters}
+        if not self._adapters:
+            self._finish('no adapter')
+            return
+
+        from components.agent import PairingAgent
+        self._agent = PairingAgent(self._bus, accept=self._is_target_path)
+        # BlueZ handles the calls of a connection in order, the agent is registered before the first Pair.
+        self._agent.register_async()
+        router = SignalRouter.get()
+        for adapter_path in self._adapters:
+            self._subscriptions += [
+                router.subscribe(c.BluetoothConstants.DBUS_OM_IFACE, "InterfacesAdded", self._interfaces_added,
+                                 path='/', arg0path=adapter_path + '/'),
+                router.subscribe(c.BluetoothConstants.DBUS_PROPERTIES, "PropertiesChanged", self._properties_changed,
+                                 path_namespace=adapter_path, arg0=c.BluetoothConstants.DEVICE_INTERFACE,
+                                 path_keyword='path'),
+            ]
+        if self.timeout:
+            self._add_timer(self.timeout, self._finish, 'timeout')
+
+        # fast path : devices BlueZ already knows.
+        for path, interfaces in objects.items():
+            device = interfaces.get(c.BluetoothConstants.DEVICE_INTERFACE)
+            if device is not None:
+                self._found(str(path), str(device.get('Address', '')))
+
+        log(f"Provisioning {len(self._targets)} targets on {len(self._adapters)} adapters.", self.log_type)
+        self._schedule()
+        self._check_finished()
+
+    def _is_target_path(self, path):
+        target = self._targets.get(u.path_to_device_address(path))
+        return target is not None and target.path == path
+
+    def _interfaces_added(self, path, interfaces):
+        device = interfaces.get(c.BluetoothConstants.DEVICE_INTERFACE)
+        if device is None:
+            return
+        if self._found(str(path), str(device.get('Address', ''))):
+            self._schedule()
+
+    def _properties_changed(self, interface, changed, invalidated, path):
+        if interface != c.BluetoothConstants.DEVICE_INTERFACE or 'RSSI' not in changed:
+            return
+        if self._found(path, u.path_to_device_address(path)):
+            self._schedule()
+
+    def _found(self, path, address):
+        target = self._targets.get(address)
+        if target is None or target.state != TargetStates.WAITING:
+            return False
+        if u.device_path_to_adapter_path(path) not in self._active:
+            return False
+        target.path = path
+        target.state = TargetStates.READY
+        target.found_at = time.monotonic()
+        return True
+
+    def _schedule(self):
+        if self._finishing:
+            return
+        running = sum(self._active.values())
+        for target in self._targets.values():
+            if running >= self.concurrency:
+                break
+            if target.state != TargetStates.READY:
+                continue
+            adapter_path = u.device_path_to_adapter_path(target.path)
+            if self._active[adapter_path] >= self.per_adapter:
+                continue
+            self._start_pipeline(target, adapter_path)
+            running += 1
+
+        waiting = any(target.state == TargetStates.WAITING for target in self._targets.values())
+        for adapter_path in self._adapters:
+            if waiting and not self._active[adapter_path]:
+                self._set_discovery(adapter_path, True)
+            else:
+                # pairing and discovery on the same adapter compete for the radio.
+                self._set_discovery(adapter_path, False)
+
+    def _start_pipeline(self, target, adapter_path):
+        target.state = TargetStates.RUNNING
+        target.attempts += 1
+        self._active[adapter_path] += 1
+        self.metrics.incr('started')
+        self.metrics.set('in_progress', sum(self._active.values()))
+
+        pipeline = PairingPipeline(target.path, on_done=lambda result: self._on_pipeline_done(target, result))
+        self._pipelines[target.address] = pipeline
+        pipeline.start()
+
+    def _on_pipeline_done(self, target, result: PairingResult):
+        self._pipelines.pop(target.address, None)
+        self._active[u.device_path_to_adapter_path(target.path)] -= 1
+        self.metrics.set('in_progress', sum(self._active.values()))
+        result.timings['discover'] = target.found_at - self._started_at
+        target.result = result
+
+        if result.success and target.alias:
+            self._configure(target)
+            return
+        self._on_target_done(target)
+
+    def _configure(self, target):
+        def cancelled():
+            # _finish() already counted the target as failed.
+            return self._finishing or target.state != TargetStates.RUNNING
+
+        def on_reply():
+            if not cancelled():
+                self._on_target_done(target)
+
+        def on_error(error):
+            if cancelled():
+                return
+            target.result.failed_step = 'configure'
+            target.result.error = error.get_dbus_name() if isinstance(error, dbus.exceptions.DBusException) \
+                else str(error)
+            self._on_target_done(target)
+
+        properties_interface = u.bus_connection.get_interface(target.path, c.BluetoothConstants.DBUS_PROPERTIES)
+        properties_interface.Set(c.BluetoothConstants.DEVICE_INTERFACE, 'Alias', dbus.String(target.alias),
+                                 reply_handler=on_reply, error_handler=on_error)
+
+    def _on_target_done(self, target):
+        result = target.result
+        if result.success:
+            target.state = TargetStates.DONE
+            self.metrics.incr('succeeded')
+        elif target.attempts <= self.retries and not self._finishing:
+            target.state = TargetStates.BACKOFF
+            self.metrics.incr('retried')
+            delay = self.backoff * 2 ** (target.attempts - 1)
+            log(f"{target.address} failed at {result.failed_step} ({result.error}), retry in {delay:.1f}s.",
+                self.log_type)
+            self._add_timer(delay, self._retry, target)
+        else:
+            target.state = TargetStates.FAILED
+            self.metrics.incr('failed')
+
+        if target.state in (TargetStates.DONE, TargetStates.FAILED) and self.on_result is not None:
+            self.on_result(self._report_row(target))
+        self._schedule()
+        self._check_finished()
+
+    def _retry(self, target):
+        if target.state == TargetStates.BACKOFF:
+            target.state = TargetStates.READY
+            self._schedule()
+
+    def _check_finished(self):
+        if all(target.state in (TargetStates.DONE, TargetStates.FAILED) for target in self._targets.values()):
+            self._finish()
+
+    def _finish(self, reason=None):
+        if self._finishing:
+            return
+        self._finishing = True
+        for timer_id in self._timers:
+            GObject.source_remove(timer_id)
+        self._timers = set()
+
+        for pipeline in list(self._pipelines.values()):
+            pipeline.cancel()
+        for target in self._targets.values():
+            if target.state not in (TargetStates.DONE, TargetStates.FAILED):
+                target.state = TargetStates.FAILED
+                if target.result is None or target.result.success:
+                    target.result = PairingResult(target.address, target.path)
+                    target.result.error = reason or 'not found'
+                self.metrics.incr('failed')
+                if self.on_result is not None:
+                    self.on_result(self._report_row(target))
+
+        for adapter_path in self._adapters:
+            self._set_discovery(adapter_path, False)
+        for subscription in self._subscriptions:
+            subscription.remove()
+        self._subscriptions = []
+        if self._agent is not None:
+            self._agent.unregister()
+            self._agent.remove_from_connection()
+            self._agent = None
+
+        log(f"Provisioning finished in {time.monotonic() - self._started_at:.1f}s : "
+            f"{self.metrics.get('succeeded')} succeeded, {self.metrics.get('failed')} failed, "
+            f"{self.metrics.get('retried')} retries.", self.log_type)
+        self._done.set()
+
+    # helpers.
+
+    def _set_discovery(self, adapter_path, on):
+        if on == (adapter_path in self._discovering):
+            return
+        adapter_interface = u.bus_connection.get_interface(adapter_path, c.BluetoothConstants.ADAPTER_INTERFACE)
+
+        def on_error(error):
+            log(f"Discovery {'start' if on else 'stop'} failed on {adapter_path} : {error}", self.log_type,
+                LogLevels.WARNING)
+
+        if on:
+            self._discovering.add(adapter_path)
+            adapter_interface.StartDiscovery(reply_handler=lambda: None, error_handler=on_error)
+        else:
+            self._discovering.discard(adapter_path)
+            adapter_interface.StopDiscovery(reply_handler=lambda: None, error_handler=on_error)
+
+    def _add_timer(self, seconds, func, *args):
+        def fire():
+            self._timers.discard(timer_id)
+            func(*args)
+            return False
+
+        timer_id = GObject.timeout_add(int(seconds * 1000), fire)
+        self._timers.add(timer_id)
+
+    def _report_row(self, target):
+        result = target.result
+        row = {'address': target.address, 'alias': target.alias, 'success': target.state == TargetStates.DONE,
+               'adapter': u.device_path_to_adapter_path(target.path) if target.path else None,
+               'attempts': target.attempts}
+        if result is not None:
+            row['failed_step'] = result.failed_step
+            row['error'] = result.error
+            for phase, seconds in result.timings.items():
+                row[f'{phase}_sec'] = round(seconds, 3)
+        return row
@@ -0,0 +1,285 @@
+import importlib.util
+import threading
+import time
+
+import components.conf as c
+from components.lazyimport import lazy_import
+from components.metrics import Metrics
+
+# numpy is optional and imported on first use.
+np = lazy_import('numpy') if importlib.util.find_spec('numpy') is not None else None
+
+
+class ProximityEvents:
+    ENTER = 'enter'
+    LEAVE = 'leave'
+    NEAR = 'near'
+    FAR = 'far'
+
+
+class SmoothingMethods:
+    EMA = 'ema'
+    KALMAN = 'kalman'
+
+
+class ProximityEngine:
+    """
+    Presence and distance of many devices from their RSSI.
+
+    update(key, rssi) only queues the sample; tick() (e.g. from a GObject timer) stores the samples in
+    per-device ring buffers, smooths the RSSI (EMA or 1D Kalman), estimates the distance with the
+    log-distance path loss model and detects transitions, all in one vectorized pass over every device.
+    on_event(key, event, rssi, distance) is called from tick() for each ProximityEvents transition :
+        enter : RSSI >= enter_rssi, leave : RSSI < leave_rssi or no sample for leave_after seconds
+        near : distance <= near, far : distance >= far again (present devices only)
+    Devices that left because they weren't seen are forgotten. Arrays are preallocated for capacity devices
+    and doubled when full. Needs numpy.
+
+    Metrics : updates, ticks, events, devices (gauge), tick_ms (gauge)
+    """
+
+    def __init__(self, on_event=None, capacity=c.BluetoothConstants.PROXIMITY_CAPACITY,
+                 history=c.BluetoothConstants.PROXIMITY_HISTORY, smoothing=c.BluetoothConstants.PROXIMITY_SMOOTHING,
+                 alpha=c.BluetoothConstants.PROXIMITY_EMA_ALPHA,
+                 process_noise=c.BluetoothConstants.PROXIMITY_KALMAN_PROCESS_NOISE,
+                 measurement_noise=c.BluetoothConstants.PROXIMITY_KALMAN_MEASUREMENT_NOISE,
+                 tx_power=c.BluetoothConstants.PROXIMITY_TX_POWER,
+                 path_loss_exponent=c.BluetoothConstants.PROXIMITY_PATH_LOSS_EXPONENT,
+                 enter_rssi=c.BluetoothConstants.PROXIMITY_ENTER_RSSI,
+                 leave_rssi=c.BluetoothConstants.PROXIMITY_LEAVE_RSSI,
+                 leave_after=c.BluetoothConstants.PROXIMITY_LEAVE_AFTER_SEC,
+                 near=c.BluetoothConstants.PROXIMITY_NEAR_M, far=c.BluetoothConstants.PROXIMITY_FAR_M):
+        if np is None:
+            raise ImportError("ProximityEngine needs numpy")
+        if smoothing not in (SmoothingMethods.EMA, SmoothingMethods.KALMAN):
+            raise ValueError(f"Undefined smoothing method : {smoothing}")
+        if leave_rssi > enter_rssi or near > far:
+            raise ValueError("Hysteresis needs leave_rssi <= enter_rssi and near <= far")
+
+        self.on_event = on_event
+        self.history = history
+        self.smoothing = smoothing
+        self.alpha = alpha
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.tx_power = tx_power
+        self.path_loss_exponent = path_loss_exponent
+        self.enter_rssi = enter_rssi
+        self.leave_rssi = leave_rssi
+        self.leave_after = leave_after
+        self.near = near
+        self.far = far
+        self.metrics = Metrics()
+
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._keys = []
+        self._free = []
+        self._pending_slots = []
+        self._pending_rssi = []
+
+        self._samples = np.zeros((0, history), dtype=np.float32)
+        self._head = np.zeros(0, dtype=np.intp)
+        self._count = np.zeros(0, dtype=np.int64)
+        self._rssi = np.zeros(0)
+        self._variance = np.zeros(0)
+        self._distance = np.zeros(0)
+        self._last_seen = np.zeros(0)
+        self._used = np.zeros(0, dtype=bool)
+        self._present = np.zeros(0, dtype=bool)
+        self._near = np.zeros(0, dtype=bool)
+        self._grow(max(1, capacity))
+
+    def __len__(self):
+        return len(self._slots)
+
+    @property
+    def capacity(self):
+        return len(self._used)
+
+    def update(self, key, rssi):
+        """
+        Queue an RSSI sample of key (e.g. the device address), applied at the next tick().
+        """
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._add(key)
+            self._pending_slots.append(slot)
+            self._pending_rssi.append(rssi)
+
+    def remove(self, key):
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                return
+            if slot in self._pending_slots:
+                pending = [(s, rssi) for s, rssi in zip(self._pending_slots, self._pending_rssi) if s != slot]
+                self._pending_slots = [s for s, _ in pending]
+                self._pending_rssi = [rssi for _, rssi in pending]
+            self._release(slot)
+
+    def get(self, key):
+        """
+        Return : {'RSSI', 'Distance', 'Present', 'Near'} of key as of the last tick, None if unknown.
+        """
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                return None
+            rssi = self._rssi[slot]
+            return {'RSSI': None if np.isnan(rssi) else float(rssi),
+                    'Distance': None if np.isnan(rssi) else float(self._distance[slot]),
+                    'Present': bool(self._present[slot]), 'Near': bool(self._near[slot])}
+
+    def get_history(self, key):
+        """
+        Return : raw RSSI samples of key, oldest first (at most history), None if unknown.
+        """
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                return None
+            count = min(int(self._count[slot]), self.history)
+            positions = (self._head[slot] - count + np.arange(count)) % self.history
+            return self._samples[slot, positions].copy()
+
+    def tick(self, now=None):
+        """
+        Apply the queued samples and emit transitions.
+        Return : list of (key, event, rssi, distance).
+        """
+        started_at = time.monotonic()
+        now = started_at if now is None else now
+        with self._lock:
+            slots = np.asarray(self._pending_slots, dtype=np.intp)
+            values = np.asarray(self._pending_rssi, dtype=np.float64)
+            self._pending_slots = []
+            self._pending_rssi = []
+            events = self._tick(slots, values, now)
+
+        self.metrics.incr('ticks')
+        self.metrics.incr('updates', len(slots))
+        self.metrics.incr('events', len(events))
+        self.metrics.set('devices', len(self._slots))
+        self.metrics.set('tick_ms', (time.monotonic() - started_at) * 1000)
+        if self.on_event is not None:
+            for event in events:
+                self.on_event(*event)
+        return events
+
+    def on_timer(self):
+        """
+        tick() as a GObject timeout callback.
+        """
+        self.tick()
+        return True
+
+    # called with the lock held.
+
+    def _grow(self, capacity):
+        def grown(array, fill):
+            new = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            new[:len(array)] = array
+            return new
+
+        self._samples = grown(self._samples, np.nan)
+        self._head = grown(self._head, 0)
+        self._count = grown(self._count, 0)
+        self._rssi = grown(self._rssi, np.nan)
+        self._variance = grown(self._variance, 0.0)
+        self._distance = grown(self._distance, np.nan)
+        self._last_seen = grown(self._last_seen, np.nan)
+        self._used = grown(self._used, False)
+        self._present = grown(self._present, False)
+        self._near = grown(self._near, False)
+
+    def _add(self, key):
+        if self._free:
+            slot = self._free.pop()
+            self._keys[slot] = key
+        else:
+            slot = len(self._keys)
+            if slot == self.capacity:
+                self._grow(self.capacity * 2)
+            self._keys.append(key)
+        self._slots[key] = slot
+        self._used[slot] = True
+        return slot
+
+    def _release(self, slot):
+        del self._slots[self._keys[slot]]
+        self._keys[slot] = None
+        self._free.append(slot)
+        self._samples[slot] = np.nan
+        self._head[slot] = 0
+        self._count[slot] = 0
+        self._rssi[slot] = np.nan
+        self._variance[slot] = 0.0
+        self._distance[slot] = np.nan
+        self._last_seen[slot] = np.nan
+        self._used[slot] = False
+        self._present[slot] = False
+        self._near[slot] = False
+
+    def _tick(self, slots, values, now):
+        n = len(self._keys)
+        if len(slots):
+            counts = np.bincount(slots, minlength=n)
+            self._record(slots, values, counts, n)
+            seen = counts > 0
+            self._last_seen[:n][seen] = now
+            self._smooth(seen, np.bincount(slots, weights=values, minlength=n)[seen] / counts[seen], counts[seen], n)
+
+        used = self._used[:n]
+        present = self._present[:n]
+        near = self._near[:n]
+        rssi = self._rssi[:n]
+        distance = self._distance[:n]
+        with np.errstate(invalid='ignore'):
+            distance[:] = 10 ** ((self.tx_power - rssi) / (10 * self.path_loss_exponent))
+            stale = now - self._last_seen[:n] > self.leave_after
+            enter = used & ~present & ~stale & (rssi >= self.enter_rssi)
+            leave = present & (stale | (rssi < self.leave_rssi))
+            present |= enter
+            present &= ~leave
+            near &= ~leave
+            to_near = present & ~near & (distance <= self.near)
+            to_far = present & near & (distance >= self.far)
+        near |= to_near
+        near &= ~to_far
+
+        events = []
+        for event, mask in ((ProximityEvents.ENTER, enter), (ProximityEvents.NEAR, to_near),
+                            (ProximityEvents.FAR, to_far), (ProximityEvents.LEAVE, leave)):
+            for slot in np.flatnonzero(mask):
+                events.append((self._keys[slot], event, float(rssi[slot]), float(distance[slot])))
+
+        for slot in np.flatnonzero(used & stale & ~present):
+            self._release(slot)
+        return events
+
+    def _record(self, slots, values, counts, n):
+        # rank of each sample among the samples of its slot, in arrival order.
+        order = np.argsort(slots, kind='stable')
+        slots = slots[order]
+        rank = np.arange(len(slots)) - np.searchsorted(slots, slots)
+        self._samples[slots, (self._head[slots] + rank) % self.history] = values[order]
+        self._head[:n] = (self._head[:n] + counts) % self.history
+        self._count[:n] += counts
+
+    def _smooth(self, seen, measured, counts, n):
+        rssi = self._rssi[:n]
+        current = rssi[seen]
+        first = np.isnan(current)
+        if self.smoothing == SmoothingMethods.EMA:
+            # k samples in one tick weigh as k successive EMA steps.
+            gain = 1 - (1 - self.alpha) ** counts
+        else:
+            variance = self._variance[:n]
+            variance += self.process_noise
+            prior = variance[seen]
+            noise = self.measurement_noise / counts
+            gain = prior / (prior + noise)
+            variance[seen] = np.where(first, noise, (1 - gain) * prior)
+        rssi[seen] = np.where(first, measured, current + gain * (measured - current))
@@ -0,0 +1,254 @@
+import bisect
+import threading
+
+import components.conf as c
+import components.utils as u
+from components.device import DeviceRecord, memory_per_device
+from components.subscriptions import SignalRouter
+
+
+class DeviceRegistry:
+    """
+    In-memory copy of the BlueZ object tree (adapters & devices).
+    Loaded once with GetManagedObjects, then kept current from
+    InterfacesAdded, InterfacesRemoved and PropertiesChanged signals.
+
+    Indexes :
+        * device path -> properties
+        * address -> device paths (one per adapter)
+        * adapter path -> device paths
+        * lower case name -> device paths (sorted, for prefix search)
+        * advertised UUID -> device paths
+    """
+
+    _INDEXED_PROPERTIES = ('Address', 'Name', 'UUIDs')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+        self._adapters = {}
+        self._devices = {}
+        self._by_address = {}
+        self._by_adapter = {}
+        self._by_uuid = {}
+        self._names = []
+
+        self._subscriptions = []
+        self.loaded = False
+
+    def load(self, objects=None):
+        """
+        (Re)build all indexes.
+            :param objects : result of GetManagedObjects, fetched if None.
+        """
+        if objects is None:
+            objects = u.get_managed_objects()
+
+        with self._lock:
+            self._adapters.clear()
+            self._devices.clear()
+            self._by_address.clear()
+            self._by_adapter.clear()
+            self._by_uuid.clear()
+            self._names = []
+
+            for path, interfaces in objects.items():
+                self._add(str(path), interfaces)
+            self.loaded = True
+
+    def attach(self):
+        """
+        Load the object tree if needed and follow BlueZ signals to keep it current.
+        Signals come through components.subscriptions.SignalRouter, restricted to the org.bluez tree.
+        """
+        if self._subscriptions:
+            return
+        if not self.loaded:
+            self.load()
+
+        router = SignalRouter.get()
+        namespace = c.BluetoothConstants.BLUEZ_NAMESPACE.rstrip('/')
+        self._subscriptions = [
+            router.subscribe(c.BluetoothConstants.DBUS_OM_IFACE, "InterfacesAdded", self._on_interfaces_added,
+                             path='/', arg0path=namespace + '/'),
+            router.subscribe(c.BluetoothConstants.DBUS_OM_IFACE, "InterfacesRemoved", self._on_interfaces_removed,
+                             path='/', arg0path=namespace + '/'),
+        ] + [
+            router.subscribe(c.BluetoothConstants.DBUS_PROPERTIES, "PropertiesChanged", self._on_properties_changed,
+                             path_namespace=namespace, arg0=interface, path_keyword='path')
+            for interface in (c.BluetoothConstants.DEVICE_INTERFACE, c.BluetoothConstants.ADAPTER_INTERFACE)
+        ]
+
+    def detach(self):
+        for subscription in self._subscriptions:
+            subscription.remove()
+        self._subscriptions = []
+
+    # lookups.
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, path):
+        return path in self._devices
+
+    def get_device(self, path):
+        """
+        Return : Device1 properties (dict) of path, None if unknown.
+        """
+        with self._lock:
+            props = self._devices.get(path)
+            return dict(props) if props is not None else None
+
+    def find_by_address(self, address: str, adapter_path=None):
+        """
+        Return : device path of address (on adapter_path if given), None if unknown.
+        """
+        with self._lock:
+            paths = self._by_address.get(address.upper())
+            if not paths:
+                return None
+            if adapter_path is None:
+                return next(iter(paths))
+            for path in paths:
+                if self._adapter_of(path) == adapter_path:
+                    return path
+        return None
+
+    def find_by_name_prefix(self, prefix: str):
+        """
+        Return : list of device paths whose Name starts with prefix (case insensitive).
+        """
+        prefix = prefix.lower()
+        paths = []
+        with self._lock:
+            i = bisect.bisect_left(self._names, (prefix, ''))
+            while i < len(self._names) and self._names[i][0].startswith(prefix):
+                paths.append(self._names[i][1])
+                i += 1
+        return paths
+
+    def find_by_uuid(self, uuid: str):
+        """
+        Return : list of device paths advertising service uuid.
+        """
+        with self._lock:
+            return list(self._by_uuid.get(uuid.lower(), ()))
+
+    def devices(self, adapter_path=None, as_records=False):
+        """
+        Return : {device path : properties}, only devices of adapter_path if given.
+            as_records : return the DeviceRecord objects themselves instead of dict copies.
+        """
+        convert = (lambda record: record) if as_records else dict
+        with self._lock:
+            if adapter_path is None:
+                return {path: convert(props) for path, props in self._devices.items()}
+            return {path: convert(self._devices[path]) for path in self._by_adapter.get(adapter_path, ())}
+
+    def memory_per_device(self):
+        with self._lock:
+            return memory_per_device(list(self._devices.values()))
+
+    def adapters(self):
+        """
+        Return : {adapter path : Adapter1 properties}
+        """
+        with self._lock:
+            return {path: dict(props) for path, props in self._adapters.items()}
+
+    def find_adapter(self, pattern=None):
+        """
+        Return : path of the first adapter matching pattern (address or path suffix), None if not found.
+        """
+        with self._lock:
+            for path, props in self._adapters.items():
+                if not pattern or pattern == props.get('Address') or path.endswith(pattern):
+                    return path
+        return None
+
+    # index maintenance.
+
+    @staticmethod
+    def _adapter_of(path):
+        return path.rsplit('/', 1)[0]
+
+    def _add(self, path, interfaces):
+        adapter = interfaces.get(c.BluetoothConstants.ADAPTER_INTERFACE)
+        if adapter is not None:
+            self._adapters[path] = u.dbus_to_python(adapter)
+
+        device = interfaces.get(c.BluetoothConstants.DEVICE_INTERFACE)
+        if device is not None:
+            self._remove_device(path)
+            props = DeviceRecord(u.dbus_to_python(device))
+            self._devices[path] = props
+            self._by_adapter.setdefault(self._adapter_of(path), set()).add(path)
+            self._index(path, props)
+
+    def _index(self, path, props):
+        if 'Address' in props:
+            self._by_address.setdefault(props['Address'].upper(), set()).add(path)
+        for uuid in props.get('UUIDs', ()):
+            self._by_uuid.setdefault(uuid.lower(), set()).add(path)
+        if props.get('Name'):
+            bisect.insort(self._names, (props['Name'].lower(), path))
+
+    def _unindex(self, path, props):
+        if 'Address' in props:
+            self._discard(self._by_address, props['Address'].upper(), path)
+        for uuid in props.get('UUIDs', ()):
+            self._discard(self._by_uuid, uuid.lower(), path)
+        if props.get('Name'):
+            entry = (props['Name'].lower(), path)
+            i = bisect.bisect_left(self._names, entry)
+            if i < len(self._names) and self._names[i] == entry:
+                del self._names[i]
+
+    @staticmethod
+    def _discard(index, key, path):
+        paths = index.get(key)
+        if paths is None:
+            return
+        paths.discard(path)
+        if not paths:
+            del index[key]
+
+    def _remove_device(self, path):
+        props = self._devices.pop(path, None)
+        if props is None:
+            return
+        self._unindex(path, props)
+        self._discard(self._by_adapter, self._adapter_of(path), path)
+
+    # signal handlers.
+
+    def _on_interfaces_added(self, path, interfaces):
+        with self._lock:
+            self._add(str(path), interfaces)
+
+    def _on_interfaces_removed(self, path, interfaces):
+        path = str(path)
+        with self._lock:
+            if c.BluetoothConstants.DEVICE_INTERFACE in interfaces:
+                self._remove_device(path)
+            if c.BluetoothConstants.ADAPTER_INTERFACE in interfaces:
+                self._adapters.pop(path, None)
+
+    def _on_properties_changed(self, interface, changed, invalidated, path):
+        path = str(path)
+        with self._lock:
+            if interface == c.BluetoothConstants.DEVICE_INTERFACE:
+                props = self._devices.get(path)
+                if props is None:
+                    return
+                reindex = invalidated or any(key in changed for key in self._INDEXED_PROPERTIES)
+                if reindex:
+                    self._unindex(path, props)
+                props.update(u.dbus_to_python(changed))
+                for name in invalidated:
+                    props.pop(str(name), None)
+                if reindex:
+                    self._index(path, props)
+            elif interface == c.BluetoothConstants.ADAPTER_INTERFACE and path in self._adapters:
+                self._adapters[path].update(u.dbus_to_python(changed))
@@ -0,0 +1,211 @@
+import threading
+import time
+import weakref
+
+import components.conf as c
+from components.lazyimport import lazy_import
+from components.metrics import Metrics
+
+GObject = lazy_import('gi.repository.GObject')
+
+# started schedulers and the reasons every scheduler of the process is paused for (pause_scanning).
+_lock = threading.Lock()
+_running = weakref.WeakSet()
+_shared_pause_reasons = set()
+
+
+class ScanStates:
+    STOPPED = 'stopped'
+    SCANNING = 'scanning'
+    IDLE = 'idle'
+    PAUSED = 'paused'
+
+
+class ScanScheduler:
+    """
+    Runs discovery continuously in duty cycles : start_scan() for scan_sec, stop_scan() for an idle window.
+
+    The idle window adapts to activity :
+        * no new device in a scan window : idle grows by backoff, up to max_idle_sec.
+        * burst_devices or more new devices : next window starts right away (burst), idle goes back to idle_sec.
+        * otherwise : idle_sec.
+    pause(reason) stops scanning until every reason is resume()d, e.g. while a connection or
+    pairing is in progress, pause_scanning(reason) does it for every scheduler of the process.
+    device_found() must be called for each new device.
+
+    Metrics : windows, bursts, backoffs, pauses, scan_sec, idle_sec (gauge, current idle window)
+    """
+
+    def __init__(self, start_scan, stop_scan, scan_sec=c.BluetoothConstants.SCAN_WINDOW_SEC,
+                 idle_sec=c.BluetoothConstants.SCAN_IDLE_SEC, max_idle_sec=c.BluetoothConstants.SCAN_MAX_IDLE_SEC,
+                 backoff=c.BluetoothConstants.SCAN_BACKOFF, burst_devices=c.BluetoothConstants.SCAN_BURST_DEVICES,
+                 timeout_add=None, source_remove=None):
+        self.start_scan = start_scan
+        self.stop_scan = stop_scan
+        self.scan_sec = scan_sec
+        self.idle_sec = idle_sec
+        self.max_idle_sec = max_idle_sec
+        self.backoff = backoff
+        self.burst_devices = burst_devices
+        self.metrics = Metrics()
+
+        # GObject timers unless given (tests).
+        self._timeout_add = timeout_add or GObject.timeout_add
+        self._source_remove = source_remove or GObject.source_remove
+
+        self._lock = threading.RLock()
+        self.state = ScanStates.STOPPED
+        self._timer_id = None
+        self._pause_reasons = set()
+        self._shared_pause_reasons = set()
+        self._found_in_window = 0
+        self._window_started_at = None
+        self._current_idle_sec = idle_sec
+
+    def start(self):
+        with self._lock:
+            if self.state != ScanStates.STOPPED:
+                return
+            with _lock:
+                _running.add(self)
+                # process-wide pauses resumed while this scheduler was stopped are dropped.
+                self._pause_reasons -= self._shared_pause_reasons
+                self._shared_pause_reasons = set(_shared_pause_reasons)
+                self._pause_reasons |= self._shared_pause_reasons
+            self._current_idle_sec = self.idle_sec
+            self.metrics.set('idle_sec', self._current_idle_sec)
+            if self._pause_reasons:
+                self.state = ScanStates.PAUSED
+            else:
+                self._begin_scan()
+
+    def stop(self):
+        with self._lock:
+            with _lock:
+                _running.discard(self)
+            self._cancel_timer()
+            if self.state == ScanStates.SCANNING:
+                self._end_scan()
+            self.state = ScanStates.STOPPED
+
+    def device_found(self):
+        with self._lock:
+            self._found_in_window += 1
+
+    def pause(self, reason):
+        """
+        Stop scanning until resume(reason), pauses with different reasons nest.
+        """
+        with self._lock:
+            self._pause_reasons.add(reason)
+            if self.state in (ScanStates.STOPPED, ScanStates.PAUSED):
+                return
+            self.metrics.incr('pauses')
+            self._cancel_timer()
+            if self.state == ScanStates.SCANNING:
+                self._end_scan()
+            self.state = ScanStates.PAUSED
+
+    def resume(self, reason):
+        with self._lock:
+            self._pause_reasons.discard(reason)
+            if self.state == ScanStates.PAUSED and not self._pause_reasons:
+                self._begin_scan()
+
+    @property
+    def paused(self):
+        return bool(self._pause_reasons)
+
+    def pausing(self, reason):
+        """
+        Context manager : with scheduler.pausing('pairing'): ...
+        """
+        return _Pause(self, reason)
+
+    def _begin_scan(self):
+        self.state = ScanStates.SCANNING
+        self._found_in_window = 0
+        self._window_started_at = time.monotonic()
+        self.metrics.incr('windows')
+        self.start_scan()
+        self._timer_id = self._timeout_add(int(self.scan_sec * 1000), self._on_scan_window_end)
+
+    def _end_scan(self):
+        self.stop_scan()
+        self.metrics.incr('scan_sec', time.monotonic() - self._window_started_at)
+
+    def _on_scan_window_end(self):
+        with self._lock:
+            self._timer_id = None
+            if self.state != ScanStates.SCANNING:
+                return False
+
+            if self._found_in_window >= self.burst_devices:
+                # activity is rising, keep the radio on.
+                self.metrics.incr('bursts')
+                self._current_idle_sec = self.idle_sec
+                self.metrics.set('idle_sec', self._current_idle_sec)
+                self.metrics.incr('scan_sec', time.monotonic() - self._window_started_at)
+                self.metrics.incr('windows')
+                self._found_in_window = 0
+                self._window_started_at = time.monotonic()
+                self._timer_id = self._timeout_add(int(self.scan_sec * 1000), self._on_scan_window_end)
+                return False
+
+            if self._found_in_window == 0:
+                self.metrics.incr('backoffs')
+                self._current_idle_sec = min(self._current_idle_sec * self.backoff, self.max_idle_sec)
+            else:
+                self._current_idle_sec = self.idle_sec
+            self.metrics.set('idle_sec', self._current_idle_sec)
+
+            self._end_scan()
+            self.state = ScanStates.IDLE
+            self._timer_id = self._timeout_add(int(self._current_idle_sec * 1000), self._on_idle_window_end)
+        return False
+
+    def _on_idle_window_end(self):
+        with self._lock:
+            self._timer_id = None
+            if self.state == ScanStates.IDLE:
+                self._begin_scan()
+        return False
+
+    def _cancel_timer(self):
+        if self._timer_id is not None:
+            self._source_remove(self._timer_id)
+            self._timer_id = None
+
+
+def pause_scanning(reason):
+    """
+    Pause every started ScanScheduler, and the ones started later, until resume_scanning(reason),
+    e.g. while a pairing or connection is in progress (components.pairing.PairingPipeline).
+    """
+    with _lock:
+        _shared_pause_reasons.add(reason)
+        schedulers = list(_running)
+    for scheduler in schedulers:
+        scheduler.pause(reason)
+
+
+def resume_scanning(reason):
+    with _lock:
+        _shared_pause_reasons.discard(reason)
+        schedulers = list(_running)
+    for scheduler in schedulers:
+        scheduler.resume(reason)
+
+
+class _Pause:
+    def __init__(self, scheduler, reason):
+        self._scheduler = scheduler
+        self._reason = reason
+
+    def __enter__(self):
+        self._scheduler.pause(self._reason)
+        return self._scheduler
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._scheduler.resume(self._reason)
+        return False
@@ -0,0 +1,190 @@
+import json
+import mmap
+import os
+import threading
+import time
+
+
+ADDRESS_LENGTH = 17
+STORED_PROPERTIES = ('Name', 'Class', 'UUIDs', 'RSSI')
+
+_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+class DeviceStore:
+    """
+    Append-only on-disk store of seen devices : Address, Name, Class, UUIDs, RSSI (last), FirstSeen, LastSeen.
+
+    Each line is "<address>\\t<json>"; the latest line of an address wins.
+    Nothing is read at construction. The first query builds an address -> offset index by
+    scanning the memory-mapped file (records are parsed only when asked for), so startup
+    doesn't depend on the store size. compact() rewrites the file with one line per address,
+    flush() calls it when the file holds more than compact_ratio lines per device.
+    """
+
+    def __init__(self, file_name, compact_ratio=2.0, compact_min_lines=10000):
+        self.file_name = file_name
+        self.compact_ratio = compact_ratio
+        self.compact_min_lines = compact_min_lines
+
+        self._lock = threading.RLock()
+        self._index = None
+        self._lines = 0
+        self._size = 0
+        self._pending = {}
+        self._writer = None
+
+    # index.
+
+    def _load(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        self._lines = 0
+        self._size = 0
+        if not os.path.exists(self.file_name) or os.path.getsize(self.file_name) == 0:
+            return
+
+        with open(self.file_name, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = 0
+            end = len(data)
+            while start < end:
+                newline = data.find(b'\n', start)
+                if newline == -1:
+                    # torn last line of an interrupted write, overwritten by the next append.
+                    break
+                if newline - start > ADDRESS_LENGTH:
+                    self._index[data[start:start + ADDRESS_LENGTH].decode()] = (start, newline - start)
+                    self._lines += 1
+                start = newline + 1
+            self._size = start
+
+    def preload(self):
+        """
+        Build the index on a background thread.
+        """
+        thread = threading.Thread(target=self._locked_load, name="device-store-load", daemon=True)
+        thread.start()
+        return thread
+
+    def _locked_load(self):
+        with self._lock:
+            self._load()
+
+    # queries.
+
+    def get(self, address: str):
+        """
+        Return : stored record (dict) of address, None if unknown.
+        """
+        address = address.upper()
+        with self._lock:
+            self._load()
+            record = self._pending.get(address)
+            if record is not None:
+                return dict(record)
+            location = self._index.get(address)
+            if location is None:
+                return None
+            offset, length = location
+            with open(self.file_name, 'rb') as f:
+                f.seek(offset)
+                line = f.read(length)
+        return json.loads(line[ADDRESS_LENGTH + 1:])
+
+    def __contains__(self, address):
+        address = address.upper()
+        with self._lock:
+            self._load()
+            return address in self._pending or address in self._index
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._index) + sum(1 for address in self._pending if address not in self._index)
+
+    def addresses(self):
+        with self._lock:
+            self._load()
+            return set(self._index) | set(self._pending)
+
+    # updates.
+
+    def update(self, address: str, properties, seen_at=None):
+        """
+        Merge properties (Device1 names) into the record of address and mark it seen at seen_at.
+        Written to disk by flush().
+        """
+        address = address.upper()
+        seen_at = time.time() if seen_at is None else seen_at
+        with self._lock:
+            record = self._pending.get(address)
+            if record is None:
+                record = self.get(address) or {'Address': address, 'FirstSeen': seen_at}
+                self._pending[address] = record
+            for name in STORED_PROPERTIES:
+                if name in properties:
+                    value = properties[name]
+                    record[name] = list(value) if name == 'UUIDs' else value
+            record['LastSeen'] = seen_at
+
+    def flush(self):
+        with self._lock:
+            self._load()
+            self._write_pending()
+            if self._lines > self.compact_min_lines and self._lines > self.compact_ratio * len(self._index):
+                self.compact()
+
+    def _write_pending(self):
+        if not self._pending:
+            return
+        if self._writer is None:
+            self._writer = open(self.file_name, 'ab')
+            self._writer.truncate(self._size)
+        for address, record in self._pending.items():
+            line = (address + '\t' + _encoder.encode(record) + '\n').encode()
+            self._writer.write(line)
+            self._index[address] = (self._size, len(line) - 1)
+            self._size += len(line)
+            self._lines += 1
+        self._writer.flush()
+        self._pending = {}
+
+    def compact(self):
+        """
+        Rewrite the file with the latest line of every address only.
+        """
+        with self._lock:
+            self._load()
+            self._write_pending()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            if not os.path.exists(self.file_name):
+                return
+
+            temp_name = self.file_name + ".tmp"
+            index = {}
+            size = 0
+            with open(self.file_name, 'rb') as source, open(temp_name, 'wb') as target:
+                for address, (offset, length) in self._index.items():
+                    source.seek(offset)
+                    line = source.read(length + 1)
+                    target.write(line)
+                    index[address] = (size, length)
+                    size += len(line)
+                target.flush()
+                os.fsync(target.fileno())
+            os.replace(temp_name, self.file_name)
+
+            self._index = index
+            self._size = size
+            self._lines = len(index)
+
+    def close(self):
+        with self._lock:
+            if self._index is not None:
+                self.flush()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
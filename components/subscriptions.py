@@ -0,0 +1,216 @@
+import threading
+import time
+
+import components.conf as c
+import components.utils as u
+from components.lazyimport import lazy_import
+from components.metrics import Metrics
+
+dbus_lowlevel = lazy_import('dbus.lowlevel')
+GObject = lazy_import('gi.repository.GObject')
+
+
+class _Rule:
+    __slots__ = ('interface', 'member', 'path', 'path_namespace', 'arg0', 'arg0path')
+
+    def __init__(self, interface, member, path=None, path_namespace=None, arg0=None, arg0path=None):
+        self.interface = interface
+        self.member = member
+        self.path = path
+        self.path_namespace = path_namespace
+        self.arg0 = arg0
+        self.arg0path = arg0path
+
+    @property
+    def key(self):
+        return (self.interface, self.member, self.path, self.path_namespace, self.arg0, self.arg0path)
+
+    def to_match_string(self):
+        rule = f"type='signal',sender='{c.BluetoothConstants.BLUEZ_SERVICE_NAME}'," \
+               f"interface='{self.interface}',member='{self.member}'"
+        for name in ('path', 'path_namespace', 'arg0', 'arg0path'):
+            value = getattr(self, name)
+            if value is not None:
+                rule += f",{name}='{value}'"
+        return rule
+
+    def matches(self, path, args):
+        if self.path is not None and path != self.path:
+            return False
+        if self.path_namespace is not None and path != self.path_namespace and \
+                not path.startswith(self.path_namespace + '/'):
+            return False
+        if self.arg0 is not None and (not args or args[0] != self.arg0):
+            return False
+        if self.arg0path is not None and (not args or not str(args[0]).startswith(self.arg0path)):
+            return False
+        return True
+
+
+class Subscription:
+    def __init__(self, router, rule, handler, path_keyword):
+        self._router = router
+        self.rule = rule
+        self.handler = handler
+        self.path_keyword = path_keyword
+
+    def remove(self):
+        self._router._remove(self)
+
+
+class SignalRouter:
+    """
+    BlueZ signal subscriptions with narrow match rules : sender org.bluez plus path, path_namespace,
+    arg0 and arg0path where given, so the bus daemon only wakes the process for relevant signals
+    (dbus-python's add_signal_receiver can't express path_namespace / arg0path).
+
+    Rules are installed once (AddMatch) and kept grace_sec after their last subscriber goes, so modes
+    that restart don't pay AddMatch / RemoveMatch round-trips again; idle rules are removed afterwards
+    (the bus daemon would keep routing their signals to the process), release() removes them all.
+    Messages are dispatched from a single message filter on the GLib main loop thread.
+
+    audit(True) adds a broad rule (every PropertiesChanged / InterfacesAdded / InterfacesRemoved of
+    any sender) to measure : metrics 'audited' counts these signals, 'avoided' the ones no narrow
+    rule matches, i.e. wakeups the narrow rules save. For measurements only.
+
+    Metrics : delivered, rules (gauge), rules_dropped, audited, avoided
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    AUDITED_SIGNALS = ((c.BluetoothConstants.DBUS_PROPERTIES, 'PropertiesChanged'),
+                       (c.BluetoothConstants.DBUS_OM_IFACE, 'InterfacesAdded'),
+                       (c.BluetoothConstants.DBUS_OM_IFACE, 'InterfacesRemoved'))
+
+    def __init__(self, bus, grace_sec=c.BluetoothConstants.SIGNAL_RULE_GRACE_SEC):
+        self.bus = bus
+        self.grace_sec = grace_sec
+        self.metrics = Metrics()
+
+        self._lock = threading.RLock()
+        self._rules = {}
+        self._subscriptions = {}
+        # rule key -> time its last subscriber went.
+        self._idle_since = {}
+        self._drop_timer_id = None
+        self._auditing = False
+        self.bus.add_message_filter(self._filter)
+
+    @classmethod
+    def get(cls):
+        """
+        Return : the router of the system bus connection (utils.bus_connection).
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = SignalRouter(u.bus_connection.bus)
+            return cls._instance
+
+    def subscribe(self, interface, member, handler, path=None, path_namespace=None, arg0=None, arg0path=None,
+                  path_keyword=None):
+        """
+        handler(*args) is called for each matching signal, with path=<object path> if path_keyword is given.
+        Return : Subscription, call remove() to unsubscribe.
+        """
+        rule = _Rule(interface, member, path, path_namespace, arg0, arg0path)
+        subscription = Subscription(self, rule, handler, path_keyword)
+        with self._lock:
+            if rule.key not in self._rules:
+                self.bus.add_match_string(rule.to_match_string())
+                self._rules[rule.key] = rule
+                self.metrics.set('rules', len(self._rules))
+            self._idle_since.pop(rule.key, None)
+            self._subscriptions.setdefault(rule.key, []).append(subscription)
+        return subscription
+
+    def _remove(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.rule.key)
+            if not subscriptions or subscription not in subscriptions:
+                return
+            subscriptions.remove(subscription)
+            if subscriptions:
+                return
+            del self._subscriptions[subscription.rule.key]
+            if self.grace_sec is None:
+                return
+            self._idle_since[subscription.rule.key] = time.monotonic()
+            if self._drop_timer_id is None:
+                self._drop_timer_id = GObject.timeout_add(int(self.grace_sec * 1000), self._drop_idle_rules)
+
+    def _drop_idle_rules(self):
+        with self._lock:
+            now = time.monotonic()
+            for key, idle_since in list(self._idle_since.items()):
+                if now - idle_since >= self.grace_sec:
+                    # on the main loop thread, don't wait for the reply.
+                    self.bus.remove_match_string_non_blocking(self._rules.pop(key).to_match_string())
+                    del self._idle_since[key]
+                    self.metrics.incr('rules_dropped')
+            self.metrics.set('rules', len(self._rules))
+            if self._idle_since:
+                return True
+            self._drop_timer_id = None
+            return False
+
+    def release(self):
+        """
+        Remove every match rule of the router, subscriptions stop receiving signals.
+        """
+        with self._lock:
+            self.audit(False)
+            for rule in self._rules.values():
+                self.bus.remove_match_string(rule.to_match_string())
+            self._rules = {}
+            self._subscriptions = {}
+            self._idle_since = {}
+            if self._drop_timer_id is not None:
+                GObject.source_remove(self._drop_timer_id)
+                self._drop_timer_id = None
+            self.metrics.set('rules', 0)
+
+    def audit(self, enabled: bool):
+        with self._lock:
+            if enabled == self._auditing:
+                return
+            for interface, member in self.AUDITED_SIGNALS:
+                rule = f"type='signal',interface='{interface}',member='{member}'"
+                if enabled:
+                    self.bus.add_match_string(rule)
+                else:
+                    self.bus.remove_match_string(rule)
+            self._auditing = enabled
+
+    def _filter(self, bus, message):
+        if message.get_type() != dbus_lowlevel.MESSAGE_TYPE_SIGNAL:
+            return dbus_lowlevel.HANDLER_RESULT_NOT_YET_HANDLED
+
+        interface = message.get_interface()
+        member = message.get_member()
+        path = message.get_path()
+        args = None
+        calls = []
+        with self._lock:
+            for key, subscriptions in self._subscriptions.items():
+                if key[0] != interface or key[1] != member:
+                    continue
+                if args is None:
+                    args = message.get_args_list()
+                if self._rules[key].matches(path, args):
+                    calls.extend(subscriptions)
+
+        if self._auditing and (interface, member) in self.AUDITED_SIGNALS:
+            self.metrics.incr('audited')
+            if not calls:
+                self.metrics.incr('avoided')
+
+        for subscription in calls:
+            self.metrics.incr('delivered')
+            try:
+                if subscription.path_keyword:
+                    subscription.handler(*args, **{subscription.path_keyword: path})
+                else:
+                    subscription.handler(*args)
+            except Exception as e:
+                u.log_direct(f"Error at SignalRouter handler {subscription.handler} : {e}", c.LOG_TYPE)
+        return dbus_lowlevel.HANDLER_RESULT_NOT_YET_HANDLED
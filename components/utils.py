@@ -1,53 +1,138 @@
 import components.conf as c
-import dbus
 import re
+import sys
+from collections.abc import Mapping
+from concurrent import futures
 from common.logger import Logger
+from components import assigned_numbers
+from components.connection import BusConnection
+from components.device import DeviceRecord
+from components.lazyimport import lazy_import
+from components.mainloop import MainLoopThread
 import threading
 
+dbus = lazy_import('dbus')
+
 lock = threading.Lock()
 logger = Logger(app_name="btcontroller", lock=lock)
 log_direct = logger.log_direct
 
+bus_connection = BusConnection()
+
 class BluezUtilError(Exception):
     pass
 
 
 def byteArrayToHexString(bytes: bytes):
-    hex_string = ""
-    for byte in bytes:
-        hex_byte = '%02X' % byte
-        hex_string = hex_string + hex_byte
-
-    return hex_string
-
-
-def dbus_to_python(data):
-    if isinstance(data, dbus.String):
-        data = str(data)
-    if isinstance(data, dbus.ObjectPath):
-        data = str(data)
-    elif isinstance(data, dbus.Boolean):
-        data = bool(data)
-    elif isinstance(data, dbus.Int64):
-        data = int(data)
-    elif isinstance(data, dbus.Int32):
-        data = int(data)
-    elif isinstance(data, dbus.Int16):
-        data = int(data)
-    elif isinstance(data, dbus.UInt16):
-        data = int(data)
-    elif isinstance(data, dbus.Byte):
-        data = int(data)
-    elif isinstance(data, dbus.Double):
-        data = float(data)
-    elif isinstance(data, dbus.Array):
-        data = [dbus_to_python(value) for value in data]
-    elif isinstance(data, dbus.Dictionary):
-        new_data = dict()
-        for key in data.keys():
-            new_data[key] = dbus_to_python(data[key])
-        data = new_data
-    return data
+    return bytearray(bytes).hex().upper()
+
+
+class LazyDict(Mapping):
+    """
+    Read-only dict view of a dbus.Dictionary, values are converted on first access.
+    """
+    __slots__ = ('_raw', '_converted')
+
+    def __init__(self, raw):
+        self._raw = {_convert_key(key): value for key, value in raw.items()}
+        self._converted = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._converted[key]
+        except KeyError:
+            value = self._converted[key] = dbus_to_python(self._raw[key], lazy=True)
+            return value
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __repr__(self):
+        return f"LazyDict({dict(self.items())!r})"
+
+
+def _convert_key(key):
+    converter = _CONVERTERS.get(type(key))
+    return key if converter is None else converter(key)
+
+
+def _convert_array(data):
+    if data.signature == 'y':
+        return bytes(data)
+    return [dbus_to_python(value) for value in data]
+
+
+def _convert_dictionary(data):
+    return {_convert_key(key): dbus_to_python(value) for key, value in data.items()}
+
+
+def _convert_struct(data):
+    return tuple(dbus_to_python(value) for value in data)
+
+
+# exact type -> converter, looked up once per value instead of a chain of isinstance checks.
+# Filled on the first conversion after dbus-python is imported (_load_converters).
+_CONVERTERS = {}
+
+
+def _load_converters():
+    _CONVERTERS.update({
+        dbus.String: str,
+        dbus.ObjectPath: str,
+        dbus.Signature: str,
+        dbus.Boolean: bool,
+        dbus.Byte: int,
+        dbus.Int16: int,
+        dbus.UInt16: int,
+        dbus.Int32: int,
+        dbus.UInt32: int,
+        dbus.Int64: int,
+        dbus.UInt64: int,
+        dbus.Double: float,
+        dbus.ByteArray: bytes,
+        dbus.Array: _convert_array,
+        dbus.Dictionary: _convert_dictionary,
+        dbus.Struct: _convert_struct,
+    })
+
+
+def _find_converter(data_type):
+    if not _CONVERTERS:
+        if 'dbus' not in sys.modules:
+            # no D-Bus value can exist yet.
+            return None
+        _load_converters()
+    # subclasses of dbus types, plain python values are returned as they are (None).
+    for base in data_type.__mro__:
+        if base in _CONVERTERS:
+            converter = _CONVERTERS[base]
+            break
+    else:
+        converter = None
+    _CONVERTERS[data_type] = converter
+    return converter
+
+
+def dbus_to_python(data, lazy=False):
+    """
+        Convert D-Bus typed values to python values.
+        Byte arrays (ManufacturerData, ServiceData...) are converted to bytes.
+        lazy : return dictionaries as LazyDict, nested values are converted when accessed.
+    """
+    data_type = type(data)
+    try:
+        converter = _CONVERTERS[data_type]
+    except KeyError:
+        converter = _find_converter(data_type)
+
+    if converter is None:
+        return data
+    if lazy and converter is _convert_dictionary:
+        return LazyDict(data)
+    return converter(data)
 
 
 def device_address_to_path(bdaddr: str, adapter_path: str):
@@ -64,10 +149,7 @@ def path_to_device_address(path: str):
 
 
 def get_name_from_uuid(uuid):
-    if uuid in c.BluetoothConstants.UUID_NAMES:
-        return c.BluetoothConstants.UUID_NAMES[uuid]
-    else:
-        return "Unknown"
+    return assigned_numbers.uuid_name(uuid)
 
 
 def text_to_ascii_array(text):
@@ -83,20 +165,75 @@ def print_properties(props):
         print(key + "=" + str(props[key]))
 
 
+def call_async(method, *args, callback=None, timeout=None):
+    """
+        Call a D-Bus method without blocking, e.g. call_async(adapter_interface.StartDiscovery).
+        Replies are handled on the shared GLib main loop thread (components.mainloop), so calls
+        issued back to back are in flight together.
+        param callback : callback(result, error) called on the main loop thread before the future is resolved.
+        param timeout : D-Bus call timeout (seconds), None : dbus-python default.
+        return : concurrent.futures.Future of the converted reply (dbus_to_python), None for empty replies.
+                 Don't wait for it on the main loop thread, the reply could never be dispatched.
+    """
+    MainLoopThread.get()
+    future = futures.Future()
+
+    def resolve(result, error):
+        if callback is not None:
+            try:
+                callback(result, error)
+            except Exception as e:
+                log_direct(f"Error at call_async() callback : {e}", c.LOG_TYPE)
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def on_reply(*reply):
+        value = reply[0] if len(reply) == 1 else (reply or None)
+        resolve(dbus_to_python(value) if value is not None else None, None)
+
+    def on_error(error):
+        resolve(None, error)
+
+    kwargs = {'reply_handler': on_reply, 'error_handler': on_error}
+    if timeout is not None:
+        kwargs['timeout'] = timeout
+    method(*args, **kwargs)
+    return future
+
+
+def wait_all(pending, timeout=None):
+    """
+        Wait for futures of call_async.
+        return : list of results in the order of pending, exceptions in place of failed calls.
+        raise : concurrent.futures.TimeoutError if not all are done within timeout.
+    """
+    pending = list(pending)
+    done, not_done = futures.wait(pending, timeout)
+    if not_done:
+        raise futures.TimeoutError(f"{len(not_done)} of {len(pending)} calls not done")
+    return [future.exception() or future.result() for future in pending]
+
+
 def get_managed_objects():
-    bus = dbus.SystemBus()
-    obj = bus.get_object(c.BluetoothConstants.BLUEZ_SERVICE_NAME, '/')
-    manager = dbus.Interface(obj, c.BluetoothConstants.DBUS_OM_IFACE)
+    manager = bus_connection.get_interface('/', c.BluetoothConstants.DBUS_OM_IFACE)
     return manager.GetManagedObjects()
 
 
-def find_adapter(pattern=None):
+def find_adapter(pattern=None, registry=None):
+    """
+        registry : components.registry.DeviceRegistry, used instead of GetManagedObjects if given.
+    """
+    if registry is not None:
+        path = registry.find_adapter(pattern)
+        if path is None:
+            raise BluezUtilError("Bluetooth adapter not found.")
+        return bus_connection.get_interface(path, c.BluetoothConstants.ADAPTER_INTERFACE)
     return find_adapter_in_objects(get_managed_objects(), pattern)
 
 
 def find_adapter_in_objects(objects, pattern=None):
-    bus = dbus.SystemBus()
-
     for path, ifaces in objects.items():
         adapter = ifaces.get(c.BluetoothConstants.ADAPTER_INTERFACE)
 
@@ -104,18 +241,45 @@ def find_adapter_in_objects(objects, pattern=None):
             continue
 
         if not pattern or pattern == adapter["Address"] or path.endswith(pattern):
-            obj = bus.get_object(c.BluetoothConstants.BLUEZ_SERVICE_NAME, path)
-            return dbus.Interface(obj, c.BluetoothConstants.ADAPTER_INTERFACE)
+            return bus_connection.get_interface(path, c.BluetoothConstants.ADAPTER_INTERFACE)
 
     raise BluezUtilError("Bluetooth adapter not found.")
 
 
-def find_device(device_address, adapter_pattern=None):
+def find_adapters(objects=None, registry=None):
+    """
+        return : sorted list of object paths of every org.bluez.Adapter1 (e.g. ['/org/bluez/hci0', '/org/bluez/hci1'])
+    """
+    if registry is not None:
+        return sorted(registry.adapters())
+    if objects is None:
+        objects = get_managed_objects()
+    return sorted(str(path) for path, ifaces in objects.items() if c.BluetoothConstants.ADAPTER_INTERFACE in ifaces)
+
+
+def device_path_to_adapter_path(path: str):
+    # e.g. convert /org/bluez/hci0/dev_12_34_44_00_66_D5 to /org/bluez/hci0
+    return path.rsplit('/', 1)[0]
+
+
+def find_device(device_address, adapter_pattern=None, registry=None):
+    """
+        registry : components.registry.DeviceRegistry, used instead of GetManagedObjects if given.
+    """
+    if registry is not None:
+        adapter_path = None
+        if adapter_pattern:
+            adapter_path = registry.find_adapter(adapter_pattern)
+            if adapter_path is None:
+                raise BluezUtilError("Bluetooth adapter not found.")
+        path = registry.find_by_address(device_address, adapter_path)
+        if path is None:
+            return None
+        return bus_connection.get_interface(path, c.BluetoothConstants.DEVICE_INTERFACE)
     return find_device_in_objects(get_managed_objects(), device_address, adapter_pattern)
 
 
 def find_device_in_objects(objects, device_address, adapter_pattern=None):
-    bus = dbus.SystemBus()
     path_prefix = ""
 
     if adapter_pattern:
@@ -130,25 +294,40 @@ def find_device_in_objects(objects, device_address, adapter_pattern=None):
             continue
 
         if device["Address"] == device_address and path.startswith(path_prefix):
-            obj = bus.get_object(c.BluetoothConstants.BLUEZ_SERVICE_NAME, path)
-            return dbus.Interface(obj, c.BluetoothConstants.DEVICE_INTERFACE)
+            return bus_connection.get_interface(path, c.BluetoothConstants.DEVICE_INTERFACE)
 
     # raise BluezUtilError("Bluetooth device not found.")
     return None
 
 
-def get_found_devices():
+def get_found_devices(registry=None, adapter_path=c.BluetoothConstants.ADAPTER_PATH, as_records=False):
+    """
+        registry : components.registry.DeviceRegistry, used instead of GetManagedObjects if given.
+        as_records : return components.device.DeviceRecord values instead of dicts.
+        return : {address : device properties} of devices on adapter_path
+    """
+    if registry is not None:
+        devices = {}
+        for props in registry.devices(adapter_path).values():
+            props.pop('Adapter', None)
+            props.pop('Modalias', None)
+            devices[props['Address']] = DeviceRecord(props) if as_records else props
+        return devices
+
     managed_objects = get_managed_objects()
     devices = {}
+    device_prefix = adapter_path + '/dev_'
     for device_path in managed_objects:
-        if '/org/bluez/hci0/dev_' in device_path:
-            address_w_underscore = device_path.split('/org/bluez/hci0/dev_')[1]
+        if device_prefix in device_path:
+            address_w_underscore = device_path.split(device_prefix)[1]
             if len(address_w_underscore) > 17:
                 continue
             device_address = path_to_device_address(device_path)
             devices[device_address] = managed_objects[device_path][c.BluetoothConstants.DEVICE_INTERFACE]
             devices[device_address].pop('Adapter', None)
             devices[device_address].pop('Modalias', None)
+            if as_records:
+                devices[device_address] = DeviceRecord(dbus_to_python(devices[device_address]))
 
     return devices
 
@@ -168,19 +347,34 @@ def checkMAC(value):
         return True
 
 
-def remove_device(bd_addr: str):
-    res = False
+def remove_device(bd_addr: str, adapter_path=c.BluetoothConstants.ADAPTER_PATH):
+    """
+        return : True(removed), False(D-Bus error, e.g. unknown device; logged)
+    """
     try:
-        bus = dbus.SystemBus()
-        obj = bus.get_object(c.BluetoothConstants.BLUEZ_SERVICE_NAME, c.BluetoothConstants.ADAPTER_PATH)
-        adapter_interface = dbus.Interface(obj, c.BluetoothConstants.ADAPTER_INTERFACE)
-        device_path = device_address_to_path(bd_addr, c.BluetoothConstants.ADAPTER_PATH)
-        adapter_interface.RemoveDevice(device_path)
-        res = True
-    except:
-        res = False
+        adapter_interface = bus_connection.get_interface(adapter_path, c.BluetoothConstants.ADAPTER_INTERFACE)
+        adapter_interface.RemoveDevice(device_address_to_path(bd_addr, adapter_path))
+    except dbus.exceptions.DBusException as e:
+        log_direct(f"Error at remove_device({bd_addr}) : {e.get_dbus_name()} {e.get_dbus_message()}", c.LOG_TYPE)
+        return False
+
+    return True
 
-    return res
+
+def remove_device_async(bd_addr: str, adapter_path=c.BluetoothConstants.ADAPTER_PATH, callback=None):
+    """
+        Non-blocking remove_device, return : concurrent.futures.Future (see call_async).
+    """
+    adapter_interface = bus_connection.get_interface(adapter_path, c.BluetoothConstants.ADAPTER_INTERFACE)
+    return call_async(adapter_interface.RemoveDevice, device_address_to_path(bd_addr, adapter_path), callback=callback)
+
+
+def remove_devices_async(bd_addrs, adapter_path=c.BluetoothConstants.ADAPTER_PATH):
+    """
+        Issue RemoveDevice for every address without waiting for replies in between.
+        return : list of concurrent.futures.Future, see wait_all.
+    """
+    return [remove_device_async(bd_addr, adapter_path) for bd_addr in bd_addrs]
 
 
 def get_device_iface_by_path(device_path: str):
@@ -195,16 +389,11 @@ def get_device_iface_by_path(device_path: str):
             * DisconnectProfile
             * Pair
     """
-    bus = dbus.SystemBus()
-    obj = bus.get_object(c.BluetoothConstants.BLUEZ_SERVICE_NAME, device_path)
-    device = dbus.Interface(obj, c.BluetoothConstants.DEVICE_INTERFACE)
-    return device
+    return bus_connection.get_interface(device_path, c.BluetoothConstants.DEVICE_INTERFACE)
 
 
-def get_adapter_props_iface():
-    bus = dbus.SystemBus()
-    adapter_object = bus.get_object(c.BluetoothConstants.BLUEZ_SERVICE_NAME, c.BluetoothConstants.ADAPTER_PATH)
-    return dbus.Interface(adapter_object, c.BluetoothConstants.DBUS_PROPERTIES)
+def get_adapter_props_iface(adapter_path=c.BluetoothConstants.ADAPTER_PATH):
+    return bus_connection.get_interface(adapter_path, c.BluetoothConstants.DBUS_PROPERTIES)
 
 
 def get_bt_adapter():
@@ -216,17 +405,28 @@ def get_bt_adapter():
 
 
 def get_device_properties_by_path(path):
-    bus = dbus.SystemBus()
-    obj = bus.get_object(c.BluetoothConstants.BLUEZ_SERVICE_NAME, path)
-    props_iface = dbus.Interface(obj, c.BluetoothConstants.DBUS_PROPERTIES)
+    props_iface = bus_connection.get_interface(path, c.BluetoothConstants.DBUS_PROPERTIES)
     device_properties = dbus_to_python(props_iface.GetAll(c.BluetoothConstants.DEVICE_INTERFACE))
     return device_properties
 
 
+def get_device_properties_from_signal(path, interfaces):
+    """
+        Build device properties from the payload of an 'InterfacesAdded' signal.
+        GetAll is called only if a property in DEVICE_REQUIRED_PROPERTIES is missing.
+        return : (device_properties, fetched) ; fetched is True if a D-Bus round-trip was made.
+    """
+    device_properties = dbus_to_python(interfaces.get(c.BluetoothConstants.DEVICE_INTERFACE, {}))
+    for prop in c.BluetoothConstants.DEVICE_REQUIRED_PROPERTIES:
+        if prop not in device_properties:
+            break
+    else:
+        return device_properties, False
+
+    device_properties.update(get_device_properties_by_path(path))
+    return device_properties, True
+
+
 def get_device_properties_by_addr(bd_addr: str):
-    bus = dbus.SystemBus()
     dev_path = device_address_to_path(bdaddr=bd_addr, adapter_path=c.BluetoothConstants.ADAPTER_PATH)
-    obj = bus.get_object(c.BluetoothConstants.BLUEZ_SERVICE_NAME, dev_path)
-    props_iface = dbus.Interface(obj, c.BluetoothConstants.DBUS_PROPERTIES)
-    device_properties = dbus_to_python(props_iface.GetAll(c.BluetoothConstants.DEVICE_INTERFACE))
-    return device_properties
+    return get_device_properties_by_path(dev_path)
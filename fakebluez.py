@@ -0,0 +1,462 @@
+"""
+Stand-in BlueZ service for hermetic tests and load generation.
+
+Runs a private dbus-daemon and serves org.bluez on it with ObjectManager, Adapter1, Device1,
+AgentManager1 and Properties. While an adapter is discovering, synthetic devices are added,
+changed and removed at configurable rates (signals per second).
+Discovery filters are applied like BlueZ does, signals they drop are counted (GetStats).
+
+Standalone :
+    python fakebluez.py --devices 1000 --added-rate 200 --changed-rate 2000 --removed-rate 50
+    export DBUS_SYSTEM_BUS_ADDRESS=<printed address>
+
+From tests :
+    with FakeBluezProcess(devices=100):
+        adapter = Adapter()
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import dbus
+import dbus.bus
+import dbus.service
+from gi.repository import GLib
+
+import components.conf as c
+import components.utils as u
+from components.discovery import DiscoveryFilter
+
+AGENT_MANAGER_INTERFACE = c.BluetoothConstants.AGENT_MANAGER_INTERFACE
+FAKE_CONTROL_INTERFACE = c.BluetoothConstants.BLUEZ_SERVICE_NAME + ".fake.Control"
+
+DAEMON_CONFIG = """<!DOCTYPE busconfig PUBLIC "-//freedesktop//DTD D-Bus Bus Configuration 1.0//EN"
+ "http://www.freedesktop.org/standards/dbus/1.0/busconfig.dtd">
+<busconfig>
+  <type>session</type>
+  <listen>unix:dir={dir}</listen>
+  <policy context="default">
+    <allow send_destination="*" eavesdrop="true"/>
+    <allow eavesdrop="true"/>
+    <allow own="*"/>
+  </policy>
+</busconfig>
+"""
+
+TICK_MS = 10
+
+
+def device_address(index: int):
+    return "02:%02X:%02X:%02X:%02X:%02X" % tuple((index >> shift) & 0xFF for shift in (32, 24, 16, 8, 0))
+
+
+class PropertiesObject(dbus.service.Object):
+    """
+    Object exporting org.freedesktop.DBus.Properties over self.properties = {interface : {name : value}}.
+    """
+
+    def __init__(self, bus, path, properties):
+        super().__init__(bus, path)
+        self.path = path
+        self.properties = properties
+
+    def set_properties(self, interface, changed):
+        self.properties[interface].update(changed)
+        self.PropertiesChanged(interface, dbus.Dictionary(changed, signature='sv'), dbus.Array([], signature='s'))
+
+    @dbus.service.method(c.BluetoothConstants.DBUS_PROPERTIES, in_signature='ss', out_signature='v')
+    def Get(self, interface, name):
+        try:
+            return self.properties[interface][name]
+        except KeyError:
+            raise dbus.exceptions.DBusException(f"No such property {name}",
+                                                name='org.freedesktop.DBus.Error.InvalidArgs')
+
+    @dbus.service.method(c.BluetoothConstants.DBUS_PROPERTIES, in_signature='s', out_signature='a{sv}')
+    def GetAll(self, interface):
+        return self.properties.get(interface, {})
+
+    @dbus.service.method(c.BluetoothConstants.DBUS_PROPERTIES, in_signature='ssv')
+    def Set(self, interface, name, value):
+        if name not in self.properties.get(interface, {}):
+            raise dbus.exceptions.DBusException(f"No such property {name}",
+                                                name='org.freedesktop.DBus.Error.InvalidArgs')
+        self.set_properties(interface, {name: value})
+
+    @dbus.service.signal(c.BluetoothConstants.DBUS_PROPERTIES, signature='sa{sv}as')
+    def PropertiesChanged(self, interface, changed, invalidated):
+        pass
+
+
+def device_properties(index: int, adapter_path: str, rng=random):
+    """
+    Return : Device1 properties of synthetic device index, with D-Bus types as BlueZ sends them.
+    """
+    address = device_address(index)
+    return {
+        'Address': dbus.String(address),
+        'AddressType': dbus.String('random' if index % 2 else 'public'),
+        'Name': dbus.String(f"fake-{index}"),
+        'Alias': dbus.String(f"fake-{index}"),
+        'Class': dbus.UInt32(0x240404),
+        'Paired': dbus.Boolean(False),
+        'Trusted': dbus.Boolean(False),
+        'Blocked': dbus.Boolean(False),
+        'Connected': dbus.Boolean(False),
+        'LegacyPairing': dbus.Boolean(False),
+        'RSSI': dbus.Int16(rng.randint(-95, -30)),
+        'TxPower': dbus.Int16(4),
+        'Adapter': dbus.ObjectPath(adapter_path),
+        'ServicesResolved': dbus.Boolean(False),
+        'UUIDs': dbus.Array(['0000180f-0000-1000-8000-00805f9b34fb'], signature='s'),
+        'ManufacturerData': dbus.Dictionary({
+            dbus.UInt16(0x004C): dbus.Array([dbus.Byte(b) for b in bytes([0x02, 0x15]) + bytes(range(16)) +
+                                             index.to_bytes(4, 'big') + bytes([0xC5])], signature='y')
+        }, signature='qv'),
+    }
+
+
+class FakeDevice(PropertiesObject):
+    def __init__(self, bus, adapter, index, rng):
+        address = device_address(index)
+        path = u.device_address_to_path(address, adapter.path)
+        properties = {c.BluetoothConstants.DEVICE_INTERFACE: device_properties(index, adapter.path, rng)}
+        super().__init__(bus, path, properties)
+        self.adapter = adapter
+        self.pair_delay_ms = adapter.service.pair_delay_ms
+
+    def _set_later(self, changed, reply_handler):
+        def apply():
+            self.set_properties(c.BluetoothConstants.DEVICE_INTERFACE, changed)
+            reply_handler()
+            return False
+
+        GLib.timeout_add(self.pair_delay_ms, apply)
+
+    @dbus.service.method(c.BluetoothConstants.DEVICE_INTERFACE, async_callbacks=('reply_handler', 'error_handler'))
+    def Pair(self, reply_handler, error_handler):
+        self._set_later({'Paired': dbus.Boolean(True)}, reply_handler)
+
+    @dbus.service.method(c.BluetoothConstants.DEVICE_INTERFACE)
+    def CancelPairing(self):
+        pass
+
+    @dbus.service.method(c.BluetoothConstants.DEVICE_INTERFACE, async_callbacks=('reply_handler', 'error_handler'))
+    def Connect(self, reply_handler, error_handler):
+        self._set_later({'Connected': dbus.Boolean(True), 'ServicesResolved': dbus.Boolean(True)}, reply_handler)
+
+    @dbus.service.method(c.BluetoothConstants.DEVICE_INTERFACE)
+    def Disconnect(self):
+        self.set_properties(c.BluetoothConstants.DEVICE_INTERFACE,
+                            {'Connected': dbus.Boolean(False), 'ServicesResolved': dbus.Boolean(False)})
+
+
+class FakeAdapter(PropertiesObject):
+    def __init__(self, bus, service, index):
+        path = c.BluetoothConstants.BLUEZ_NAMESPACE + f"hci{index}"
+        properties = {c.BluetoothConstants.ADAPTER_INTERFACE: {
+            'Address': dbus.String("00:1A:7D:DA:71:%02X" % index),
+            'AddressType': dbus.String('public'),
+            'Name': dbus.String(f"fake-hci{index}"),
+            'Alias': dbus.String(f"fake-hci{index}"),
+            'Class': dbus.UInt32(0x6c010c),
+            'Powered': dbus.Boolean(True),
+            'Discoverable': dbus.Boolean(False),
+            'DiscoverableTimeout': dbus.UInt32(180),
+            'Pairable': dbus.Boolean(True),
+            'PairableTimeout': dbus.UInt32(0),
+            'Discovering': dbus.Boolean(False),
+            'UUIDs': dbus.Array(['00001800-0000-1000-8000-00805f9b34fb'], signature='s'),
+            'Modalias': dbus.String('usb:v1D6Bp0246d0537'),
+        }}
+        super().__init__(bus, path, properties)
+        self.service = service
+        self.discovery_filter = None
+
+    @dbus.service.method(c.BluetoothConstants.ADAPTER_INTERFACE)
+    def StartDiscovery(self):
+        self.set_properties(c.BluetoothConstants.ADAPTER_INTERFACE, {'Discovering': dbus.Boolean(True)})
+
+    @dbus.service.method(c.BluetoothConstants.ADAPTER_INTERFACE)
+    def StopDiscovery(self):
+        if not self.properties[c.BluetoothConstants.ADAPTER_INTERFACE]['Discovering']:
+            raise dbus.exceptions.DBusException("No discovery started", name='org.bluez.Error.Failed')
+        self.set_properties(c.BluetoothConstants.ADAPTER_INTERFACE, {'Discovering': dbus.Boolean(False)})
+
+    @dbus.service.method(c.BluetoothConstants.ADAPTER_INTERFACE, in_signature='a{sv}')
+    def SetDiscoveryFilter(self, discovery_filter):
+        self.discovery_filter = DiscoveryFilter.from_dict(u.dbus_to_python(discovery_filter)) or None
+
+    @dbus.service.method(c.BluetoothConstants.ADAPTER_INTERFACE, out_signature='as')
+    def GetDiscoveryFilters(self):
+        return ['UUIDs', 'RSSI', 'Pathloss', 'Transport', 'DuplicateData', 'Discoverable', 'Pattern']
+
+    @dbus.service.method(c.BluetoothConstants.ADAPTER_INTERFACE, in_signature='o')
+    def RemoveDevice(self, device_path):
+        if not self.service.remove_device(str(device_path)):
+            raise dbus.exceptions.DBusException("Does Not Exist", name='org.bluez.Error.DoesNotExist')
+
+    @property
+    def discovering(self):
+        return bool(self.properties[c.BluetoothConstants.ADAPTER_INTERFACE]['Discovering'])
+
+    def passes_filter(self, properties):
+        return self.discovery_filter is None or self.discovery_filter.matches(u.dbus_to_python(properties))
+
+
+class FakeAgentManager(dbus.service.Object):
+    def __init__(self, bus):
+        super().__init__(bus, '/org/bluez')
+        self.agents = {}
+        self.default_agent = None
+
+    @dbus.service.method(AGENT_MANAGER_INTERFACE, in_signature='os', sender_keyword='sender')
+    def RegisterAgent(self, agent_path, capability, sender=None):
+        self.agents[str(agent_path)] = (sender, str(capability))
+
+    @dbus.service.method(AGENT_MANAGER_INTERFACE, in_signature='o')
+    def UnregisterAgent(self, agent_path):
+        self.agents.pop(str(agent_path), None)
+
+    @dbus.service.method(AGENT_MANAGER_INTERFACE, in_signature='o')
+    def RequestDefaultAgent(self, agent_path):
+        self.default_agent = str(agent_path)
+
+
+class FakeBluez(dbus.service.Object):
+    """
+    org.bluez object tree, ObjectManager at '/'.
+    Rates are signals per second, generated only while an adapter is discovering.
+    """
+
+    def __init__(self, bus, adapters=1, devices=0, added_rate=0, changed_rate=0, removed_rate=0,
+                 pair_delay_ms=10, seed=0):
+        super().__init__(bus, '/')
+        self.bus = bus
+        self.rng = random.Random(seed)
+        self.pair_delay_ms = pair_delay_ms
+        self.rates = {'added': added_rate, 'changed': changed_rate, 'removed': removed_rate}
+        self._credit = {'added': 0.0, 'changed': 0.0, 'removed': 0.0}
+        self.stats = {'emitted': 0, 'suppressed': 0}
+
+        self.agent_manager = FakeAgentManager(bus)
+        self.adapters = [FakeAdapter(bus, self, i) for i in range(adapters)]
+        self.devices = {}
+        self._device_paths = []
+        self._next_index = 0
+
+        for _ in range(devices):
+            self.add_device(emit=False)
+
+        GLib.timeout_add(TICK_MS, self._tick)
+
+    def add_device(self, adapter=None, emit=True):
+        adapter = adapter or self.adapters[self._next_index % len(self.adapters)]
+        device = FakeDevice(self.bus, adapter, self._next_index, self.rng)
+        self._next_index += 1
+        if emit and not adapter.passes_filter(device.properties[c.BluetoothConstants.DEVICE_INTERFACE]):
+            # BlueZ doesn't create objects for filtered out devices.
+            device.remove_from_connection()
+            self.stats['suppressed'] += 1
+            return None
+        self.devices[device.path] = device
+        self._device_paths.append(device.path)
+        if emit:
+            self.stats['emitted'] += 1
+            self.InterfacesAdded(device.path, device.properties)
+        return device
+
+    def remove_device(self, path):
+        device = self.devices.pop(path, None)
+        if device is None:
+            return False
+        self._device_paths.remove(path)
+        device.remove_from_connection()
+        self.InterfacesRemoved(path, dbus.Array(list(device.properties), signature='s'))
+        return True
+
+    def _tick(self):
+        if not any(adapter.discovering for adapter in self.adapters):
+            return True
+
+        for kind, rate in self.rates.items():
+            self._credit[kind] += rate * TICK_MS / 1000.0
+            count = int(self._credit[kind])
+            self._credit[kind] -= count
+            for _ in range(count):
+                if kind == 'added':
+                    self.add_device(self.rng.choice([a for a in self.adapters if a.discovering]))
+                elif not self._device_paths:
+                    break
+                elif kind == 'changed':
+                    device = self.devices[self.rng.choice(self._device_paths)]
+                    changed = {'RSSI': dbus.Int16(self.rng.randint(-95, -30))}
+                    if not device.adapter.passes_filter(changed):
+                        self.stats['suppressed'] += 1
+                        continue
+                    self.stats['emitted'] += 1
+                    device.set_properties(c.BluetoothConstants.DEVICE_INTERFACE, changed)
+                else:
+                    self.remove_device(self.rng.choice(self._device_paths))
+        return True
+
+    @dbus.service.method(FAKE_CONTROL_INTERFACE, in_signature='u')
+    def AddDevices(self, count):
+        """
+        Grow the object tree by count devices without emitting signals (load tests).
+        """
+        for _ in range(count):
+            self.add_device(emit=False)
+
+    @dbus.service.method(FAKE_CONTROL_INTERFACE, in_signature='as')
+    def RestoreDevices(self, addresses):
+        """
+        Re-create removed synthetic devices by address, on their original adapter and without signals
+        (cleanup of tests that remove devices).
+        """
+        for address in addresses:
+            index = int(str(address).replace(':', ''), 16) & 0xFFFFFFFFFF
+            adapter = self.adapters[index % len(self.adapters)]
+            if u.device_address_to_path(str(address), adapter.path) in self.devices:
+                continue
+            device = FakeDevice(self.bus, adapter, index, self.rng)
+            self.devices[device.path] = device
+            self._device_paths.append(device.path)
+
+    @dbus.service.method(FAKE_CONTROL_INTERFACE, out_signature='a{su}')
+    def GetStats(self):
+        """
+        Return : device signals emitted and suppressed by discovery filters since start.
+        """
+        return self.stats
+
+    @dbus.service.method(c.BluetoothConstants.DBUS_OM_IFACE, out_signature='a{oa{sa{sv}}}')
+    def GetManagedObjects(self):
+        objects = {self.agent_manager._object_path: {AGENT_MANAGER_INTERFACE: {}}}
+        for adapter in self.adapters:
+            objects[adapter.path] = adapter.properties
+        for path, device in self.devices.items():
+            objects[path] = device.properties
+        return objects
+
+    @dbus.service.signal(c.BluetoothConstants.DBUS_OM_IFACE, signature='oa{sa{sv}}')
+    def InterfacesAdded(self, path, interfaces):
+        pass
+
+    @dbus.service.signal(c.BluetoothConstants.DBUS_OM_IFACE, signature='oas')
+    def InterfacesRemoved(self, path, interfaces):
+        pass
+
+
+class FakeBusDaemon:
+    """
+    Private dbus-daemon, its address is exported as DBUS_SYSTEM_BUS_ADDRESS.
+    """
+
+    def __init__(self):
+        self.address = None
+        self._dir = None
+        self._process = None
+
+    def start(self):
+        self._dir = tempfile.mkdtemp(prefix="fakebluez-")
+        config_path = os.path.join(self._dir, "bus.conf")
+        with open(config_path, 'w') as config:
+            config.write(DAEMON_CONFIG.format(dir=self._dir))
+
+        self._process = subprocess.Popen(["dbus-daemon", "--config-file", config_path, "--nofork", "--print-address"],
+                                         stdout=subprocess.PIPE, universal_newlines=True)
+        self.address = self._process.stdout.readline().strip()
+        os.environ['DBUS_SYSTEM_BUS_ADDRESS'] = self.address
+        return self.address
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+
+
+class FakeBluezProcess:
+    """
+    Private bus + FakeBluez in a child process. Must be started before the code under test
+    connects to the system bus.
+    """
+
+    def __init__(self, adapters=1, devices=0, added_rate=0, changed_rate=0, removed_rate=0, seed=0):
+        self.devices = devices
+        self.args = ["--adapters", str(adapters), "--devices", str(devices), "--added-rate", str(added_rate),
+                     "--changed-rate", str(changed_rate), "--removed-rate", str(removed_rate), "--seed", str(seed)]
+        self.daemon = FakeBusDaemon()
+        self._process = None
+
+    def start(self):
+        address = self.daemon.start()
+        self._process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--address", address] + self.args,
+                                         stdout=subprocess.PIPE, universal_newlines=True,
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        if self._process.stdout.readline().strip() != "ready":
+            self.stop()
+            raise RuntimeError("fake bluez did not start")
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+        self.daemon.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--address", help="bus address, a private dbus-daemon is started if not given")
+    parser.add_argument("--adapters", type=int, default=1)
+    parser.add_argument("--devices", type=int, default=0, help="devices present at start")
+    parser.add_argument("--added-rate", type=float, default=0)
+    parser.add_argument("--changed-rate", type=float, default=0)
+    parser.add_argument("--removed-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from dbus.mainloop.glib import DBusGMainLoop
+    DBusGMainLoop(set_as_default=True)
+
+    daemon = None
+    address = args.address
+    if address is None:
+        daemon = FakeBusDaemon()
+        address = daemon.start()
+        print(f"DBUS_SYSTEM_BUS_ADDRESS={address}", file=sys.stderr)
+
+    bus = dbus.bus.BusConnection(address)
+    bus_name = dbus.service.BusName(c.BluetoothConstants.BLUEZ_SERVICE_NAME, bus)
+    FakeBluez(bus, adapters=args.adapters, devices=args.devices, added_rate=args.added_rate,
+              changed_rate=args.changed_rate, removed_rate=args.removed_rate, seed=args.seed)
+
+    print("ready", flush=True)
+    try:
+        GLib.MainLoop().run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        del bus_name
+        if daemon is not None:
+            daemon.stop()
+
+
+if __name__ == '__main__':
+    main()
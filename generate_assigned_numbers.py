@@ -0,0 +1,161 @@
+"""
+Regenerate the tables of components/assigned_numbers.py from the Bluetooth SIG assigned numbers YAML files.
+
+    git clone https://bitbucket.org/bluetooth-SIG/public.git bluetooth-sig
+    python generate_assigned_numbers.py bluetooth-sig
+
+_UUIDS is rebuilt from assigned_numbers/uuids/*.yaml (UUID_FILES, the first file listing a UUID wins)
+and _COMPANIES from assigned_numbers/company_identifiers/company_identifiers.yaml; _VENDOR_UUIDS is not
+part of the SIG files and is kept as is. Only the flat "- uuid/value: ..., name: ..." layout of these
+files is read, PyYAML isn't needed.
+
+Without a SIG checkout, the tables can be completed from the bluetooth-numbers package (MIT, built from
+the same SIG files and Nordic's UUID database) :
+
+    pip install bluetooth-numbers
+    python generate_assigned_numbers.py --bluetooth-numbers
+
+_COMPANIES is replaced, its GATT services, characteristics, descriptors and member UUIDs are added to
+_UUIDS and its 128-bit UUIDs to _VENDOR_UUIDS; names already in the tables are kept.
+"""
+import argparse
+import ast
+import os
+import re
+import sys
+
+ASSIGNED_NUMBERS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'components', 'assigned_numbers.py')
+
+# assigned_numbers/uuids/<name>.yaml, in lookup priority order.
+UUID_FILES = ('protocol_identifiers', 'browse_group_identifiers', 'service_class', 'service_uuids', 'declarations',
+              'descriptors', 'characteristic_uuids', 'member_uuids', 'sdo_uuids')
+COMPANY_FILE = os.path.join('company_identifiers', 'company_identifiers.yaml')
+
+_FIELD = re.compile(r"^\s*(?:-\s+)?(uuid|value|name):\s*(.*?)\s*$")
+
+
+def _unquote(text):
+    if text[:1] == "'":
+        return text[1:-1].replace("''", "'")
+    if text[:1] == '"':
+        return ast.literal_eval(text)
+    return text
+
+
+def read_entries(file_name):
+    """
+    Return : list of (number, name) of a SIG YAML file, e.g. [(0x1800, 'GAP'), ...]
+    """
+    entries = []
+    number = None
+    with open(file_name, encoding='utf-8') as f:
+        for line in f:
+            match = _FIELD.match(line)
+            if match is None:
+                continue
+            key, value = match.groups()
+            if key == 'name':
+                if number is not None:
+                    entries.append((number, ' '.join(_unquote(value).split())))
+                    number = None
+            else:
+                number = int(_unquote(value), 16)
+    return entries
+
+
+def _table(entries):
+    return ''.join(('%04X %s\n' if isinstance(entry[0], int) else '%s %s\n') % entry for entry in sorted(entries))
+
+
+def _table_pattern(variable):
+    return re.compile(rf'^{variable} = """\n(.*?)"""$', re.MULTILINE | re.DOTALL)
+
+
+def read_table(source, variable, key=lambda number: int(number, 16)):
+    """
+    Return : {number : name} of a table of assigned_numbers.py source.
+    """
+    match = _table_pattern(variable).search(source)
+    if match is None:
+        raise ValueError(f"{variable} table not found")
+    return {key(number): name for number, name in (line.split(' ', 1) for line in match.group(1).splitlines() if line)}
+
+
+def write_tables(output, tables):
+    """
+    Replace the tables of output, tables : {variable : {number : name}}
+    """
+    with open(output, encoding='utf-8') as f:
+        source = f.read()
+    for variable, entries in tables.items():
+        source, count = _table_pattern(variable).subn(lambda _: f'{variable} = """\n{_table(entries.items())}"""',
+                                                      source, count=1)
+        if count != 1:
+            raise ValueError(f"{variable} table not found in {output}")
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write(source)
+
+
+def generate(sig_repo, output=ASSIGNED_NUMBERS_FILE):
+    """
+    Rewrite _UUIDS and _COMPANIES of output from a checkout of the SIG repository.
+    Return : {'uuids' : count, 'companies' : count}
+    """
+    base = os.path.join(sig_repo, 'assigned_numbers')
+    uuids = {}
+    for name in UUID_FILES:
+        file_name = os.path.join(base, 'uuids', name + '.yaml')
+        if not os.path.exists(file_name):
+            print(f"missing {file_name}, skipped", file=sys.stderr)
+            continue
+        for number, uuid_name in read_entries(file_name):
+            uuids.setdefault(number, uuid_name)
+    companies = dict(read_entries(os.path.join(base, COMPANY_FILE)))
+
+    write_tables(output, {'_UUIDS': uuids, '_COMPANIES': companies})
+    return {'uuids': len(uuids), 'companies': len(companies)}
+
+
+def generate_from_bluetooth_numbers(output=ASSIGNED_NUMBERS_FILE):
+    """
+    Complete the tables of output from the bluetooth-numbers package.
+    Return : {'uuids' : count, 'vendor_uuids' : count, 'companies' : count}
+    """
+    import bluetooth_numbers
+
+    with open(output, encoding='utf-8') as f:
+        source = f.read()
+    uuids = read_table(source, '_UUIDS')
+    vendor_uuids = read_table(source, '_VENDOR_UUIDS', key=str)
+    for table in (bluetooth_numbers.service, bluetooth_numbers.characteristic, bluetooth_numbers.descriptor):
+        for number, name in table.items():
+            name = ' '.join(name.split())
+            if isinstance(number, int):
+                uuids.setdefault(number, name)
+            else:
+                vendor_uuids.setdefault(str(number).lower(), name)
+    companies = {number: ' '.join(name.split()) for number, name in bluetooth_numbers.company.items()}
+
+    write_tables(output, {'_UUIDS': uuids, '_VENDOR_UUIDS': vendor_uuids, '_COMPANIES': companies})
+    return {'uuids': len(uuids), 'vendor_uuids': len(vendor_uuids), 'companies': len(companies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sig_repo", nargs='?', help="checkout of https://bitbucket.org/bluetooth-SIG/public")
+    parser.add_argument("--bluetooth-numbers", action='store_true',
+                        help="complete the tables from the bluetooth-numbers package instead")
+    parser.add_argument("-o", "--output", default=ASSIGNED_NUMBERS_FILE)
+    args = parser.parse_args()
+    if (args.sig_repo is None) == (not args.bluetooth_numbers):
+        parser.error("give either sig_repo or --bluetooth-numbers")
+
+    if args.bluetooth_numbers:
+        counts = generate_from_bluetooth_numbers(args.output)
+    else:
+        counts = generate(args.sig_repo, args.output)
+    print(f"{args.output} : " + ", ".join(f"{count} {name}" for name, count in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
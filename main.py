@@ -11,3 +11,4 @@ if __name__ == '__main__':
     bt.on_new_device_found = on_new_device_found
     bt.start(OperationModes.SCAN_ALL)
     print("tt")
+    bt.wait()
@@ -1,10 +1,61 @@
+import asyncio
+import csv
+import importlib.util
+import json
+import os
+import tempfile
+import threading
 import time
 
-from components.bluetoothcontroller import Adapter
+import benchmarks
+from common.logger import Logger, LogLevels
+from components import assigned_numbers
+from components.advertisement import (EddystoneTLM, EddystoneUID, EddystoneURL, IBeacon, RuuviData,
+                                      decode_advertisement, decode_manufacturer_data)
+from components.asynccontroller import AsyncBluetoothController
+from components.bluetoothcontroller import (Adapter, AdapterRoles, BluetoothController, BluetoothScanner,
+                                           OperationModes)
+from components.coalescer import ChangeCoalescer
+from components.device import DeviceRecord
+from components.dispatcher import DeviceEvents, EventDispatcher, OverflowPolicies
+from components.eviction import DeviceEvictor
+from components.proximity import ProximityEngine, ProximityEvents, SmoothingMethods, np
+from components.provisioning import BulkProvisioner, load_targets
+from components.registry import DeviceRegistry
+from components.store import DeviceStore
+from components.lazyimport import lazy_import
+from components.mainloop import MainLoopThread
+from components.scheduler import ScanScheduler, ScanStates, pause_scanning, resume_scanning
+from components.subscriptions import SignalRouter
+import components.conf as c
+import components.utils as u
 import unittest
 
+dbus = lazy_import('dbus')
+HAS_DBUS = importlib.util.find_spec('dbus') is not None
 
-class TestBluetoothAdapter(unittest.TestCase):
+# BusTestCase tests run against fakebluez on a private bus, started by the first of them and shared by all
+# (the system bus connection of components.utils is opened once); set BT_TEST_REAL_ADAPTER=1 to use hci0 of
+# the system bus. The other tests need neither dbus-python nor gi.
+fake_bluez = None
+
+
+def tearDownModule():
+    if fake_bluez is not None:
+        fake_bluez.stop()
+
+
+@unittest.skipUnless(HAS_DBUS, "needs dbus-python")
+class BusTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        global fake_bluez
+        if fake_bluez is None and not os.environ.get('BT_TEST_REAL_ADAPTER'):
+            from fakebluez import FakeBluezProcess
+            fake_bluez = FakeBluezProcess(devices=100, added_rate=200, changed_rate=500).start()
+
+
+class TestBluetoothAdapter(BusTestCase):
     def testSetDiscoverble(self):
         adapter = Adapter()
         discoverable = adapter.discoverable
@@ -66,3 +117,636 @@ class TestBluetoothAdapter(unittest.TestCase):
         adapter.start_discovery()
         self.assertEqual(adapter.stop_discovery(), True)
         self.assertEqual(adapter.discovering, False)
+
+    def testAsyncSetters(self):
+        adapter = Adapter()
+        alias, pairable = adapter.alias, adapter.pairable
+
+        results = u.wait_all(adapter.set_properties_async({'Alias': "berkay-async", 'Pairable': not pairable}), 5)
+
+        self.assertEqual(results, [None, None])
+        self.assertEqual(adapter.alias, "berkay-async")
+        self.assertEqual(adapter.refresh_async().result(5)['Pairable'], not pairable)
+
+        # backup last state.
+        u.wait_all(adapter.set_properties_async({'Alias': alias, 'Pairable': pairable}), 5)
+
+    def testSnapshot(self):
+        adapter = Adapter()
+        snapshot = adapter.snapshot()
+
+        self.assertEqual(snapshot['Powered'], adapter.powered)
+        self.assertEqual(snapshot['Address'], adapter.address)
+        self.assertEqual(adapter.refresh()['Address'], snapshot['Address'])
+
+
+@unittest.skipUnless(HAS_DBUS, "needs dbus-python")
+class TestDbusToPython(unittest.TestCase):
+    def testConvertDeviceProperties(self):
+        props = dbus.Dictionary({
+            'RSSI': dbus.Int16(-42),
+            'Class': dbus.UInt32(0x240404),
+            'Paired': dbus.Boolean(False),
+            'ManufacturerData': dbus.Dictionary({dbus.UInt16(0x004C): dbus.Array([dbus.Byte(2), dbus.Byte(21)],
+                                                                                 signature='y')}, signature='qv'),
+            'UUIDs': dbus.Array([dbus.String('0000180f-0000-1000-8000-00805f9b34fb')], signature='s'),
+        }, signature='sv')
+
+        converted = u.dbus_to_python(props)
+
+        self.assertEqual(converted['RSSI'], -42)
+        self.assertEqual(converted['Class'], 0x240404)
+        self.assertIs(converted['Paired'], False)
+        self.assertEqual(converted['ManufacturerData'], {0x004C: b'\x02\x15'})
+        self.assertEqual(type(converted['UUIDs'][0]), str)
+
+    def testLazyConversion(self):
+        props = dbus.Dictionary({'Name': dbus.String('fake'), 'RSSI': dbus.Int16(-42)}, signature='sv')
+
+        converted = u.dbus_to_python(props, lazy=True)
+
+        self.assertEqual(len(converted), 2)
+        self.assertEqual(type(converted['Name']), str)
+        self.assertEqual(dict(converted), {'Name': 'fake', 'RSSI': -42})
+
+
+class TestDeviceRecord(unittest.TestCase):
+    def testDictView(self):
+        props = {'Address': '12:34:44:00:66:D5', 'Name': 'tag', 'RSSI': -60, 'Paired': False,
+                 'UUIDs': ['0000180f-0000-1000-8000-00805f9b34fb'], 'Modalias': 'usb:v1D6B'}
+        record = DeviceRecord(props)
+
+        self.assertEqual(dict(record), props)
+        self.assertEqual(record.address, 0x1234440066D5)
+
+        record.update({'RSSI': -40, 'Paired': True})
+        del record['Modalias']
+        self.assertEqual(record['RSSI'], -40)
+        self.assertIs(record['Paired'], True)
+        self.assertNotIn('Modalias', record)
+        self.assertNotIn('Trusted', record)
+
+
+class TestScanScheduler(unittest.TestCase):
+    def setUp(self):
+        self.timers = {}
+        self.calls = []
+        self.scheduler = ScanScheduler(lambda: self.calls.append('start'), lambda: self.calls.append('stop'),
+                                       scan_sec=10, idle_sec=5, max_idle_sec=20, backoff=2, burst_devices=3,
+                                       timeout_add=self._timeout_add, source_remove=self.timers.pop)
+
+    def _timeout_add(self, interval_ms, callback):
+        timer_id = object()
+        self.timers[timer_id] = callback
+        return timer_id
+
+    def _fire(self):
+        _, callback = self.timers.popitem()
+        callback()
+
+    def testBackoffAndBurst(self):
+        self.scheduler.start()
+        self._fire()
+        self.assertEqual(self.scheduler.state, ScanStates.IDLE)
+        self.assertEqual(self.scheduler.metrics.get('idle_sec'), 10)
+
+        self._fire()
+        for _ in range(3):
+            self.scheduler.device_found()
+        self._fire()
+
+        self.assertEqual(self.scheduler.state, ScanStates.SCANNING)
+        self.assertEqual(self.scheduler.metrics.get('bursts'), 1)
+        self.assertEqual(self.calls, ['start', 'stop', 'start'])
+
+    def testPause(self):
+        self.scheduler.start()
+        with self.scheduler.pausing('pairing'):
+            self.assertEqual(self.scheduler.state, ScanStates.PAUSED)
+            self.assertEqual(self.timers, {})
+
+        self.assertEqual(self.scheduler.state, ScanStates.SCANNING)
+        self.assertEqual(self.calls, ['start', 'stop', 'start'])
+
+    def testPauseScanning(self):
+        self.scheduler.start()
+        pause_scanning('pairing /org/bluez/hci0/dev_02_00_00_00_00_01')
+        self.assertEqual(self.scheduler.state, ScanStates.PAUSED)
+
+        # started while a pairing runs.
+        self.scheduler.stop()
+        self.scheduler.start()
+        self.assertEqual(self.scheduler.state, ScanStates.PAUSED)
+
+        resume_scanning('pairing /org/bluez/hci0/dev_02_00_00_00_00_01')
+        self.assertEqual(self.scheduler.state, ScanStates.SCANNING)
+        self.scheduler.stop()
+
+
+class TestChangeCoalescer(unittest.TestCase):
+    def setUp(self):
+        self.emitted = []
+        self.coalescer = ChangeCoalescer(lambda path, properties, keys: self.emitted.append((path, properties, keys)),
+                                         interval=0.05, min_rssi=-70, watch_rssi=True)
+
+    def testCoalesce(self):
+        self.coalescer.update('/dev_1', {'RSSI': -50})
+        self.coalescer.update('/dev_1', {'RSSI': -55})
+        self.coalescer.update('/dev_1', {'Name': 'dev-1'})
+        self.coalescer.flush()
+        self.assertEqual(len(self.emitted), 1)
+
+        time.sleep(0.06)
+        self.coalescer.flush()
+
+        self.assertEqual(self.emitted[1], ('/dev_1', {'RSSI': -55, 'Name': 'dev-1'}, {'RSSI', 'Name'}))
+        self.assertEqual(self.coalescer.metrics.get('changes'), 3)
+
+    def testMinRssi(self):
+        self.coalescer.update('/dev_1', {'RSSI': -90, 'Name': 'far'})
+        self.coalescer.update('/dev_2', {'RSSI': -60})
+
+        self.assertEqual([path for path, _, _ in self.emitted], ['/dev_2'])
+        self.assertEqual(self.coalescer.metrics.get('filtered'), 1)
+
+    def testWatchRssi(self):
+        self.coalescer.watch_rssi = False
+        self.coalescer.update('/dev_1', {'RSSI': -50})
+        self.coalescer.update('/dev_1', {'Name': 'dev-1'})
+
+        self.assertEqual(self.emitted, [('/dev_1', {'RSSI': -50, 'Name': 'dev-1'}, {'Name'})])
+
+
+class TestAdvertisement(unittest.TestCase):
+    def testBeacons(self):
+        eddystone = '0000feaa-0000-1000-8000-00805f9b34fb'
+        ibeacon = bytes([0x02, 0x15]) + bytes(range(16)) + bytes([0x00, 0x01, 0x00, 0x02, 0xC5])
+        decoded = decode_advertisement({
+            'ManufacturerData': {0x004C: ibeacon,
+                                 0x0499: bytes.fromhex('0512FC5394C37C0004FFFC040CAC364200CDCBB8334C884F')},
+            'ServiceData': {eddystone: bytes.fromhex('00E800112233445566778899AABBCCDDEEFF0000')},
+        })
+
+        self.assertEqual(decoded[0], IBeacon('00010203-0405-0607-0809-0a0b0c0d0e0f', 1, 2, -59))
+        self.assertIsInstance(decoded[1], RuuviData)
+        self.assertAlmostEqual(decoded[1].temperature, 24.3)
+        self.assertEqual(decoded[1].mac, 'CB:B8:33:4C:88:4F')
+        self.assertEqual(decoded[2], EddystoneUID('00112233445566778899', 'aabbccddeeff', -24))
+
+        url, tlm = decode_advertisement({'ServiceData': {
+            eddystone: bytes.fromhex('10EC03676F6F676C6500'),
+            eddystone.upper(): bytes.fromhex('20000BB81800000000640000012C')}})
+        self.assertEqual(url, EddystoneURL('https://google.com/', -20))
+        self.assertEqual(tlm, EddystoneTLM(0, 3000, 24.0, 100, 30.0))
+
+    def testCache(self):
+        data = bytes([0x02, 0x15]) + bytes(16) + bytes(5)
+        hits = decode_manufacturer_data.cache_info().hits
+        first = decode_manufacturer_data(0x004C, data)
+
+        self.assertIs(decode_manufacturer_data(0x004C, bytes(data)), first)
+        self.assertEqual(decode_manufacturer_data.cache_info().hits, hits + 1)
+        self.assertIsNone(decode_manufacturer_data(0x004C, b'\x10\x05'))
+        self.assertEqual(u.byteArrayToHexString([0x0A, 0xFF]), '0AFF')
+
+
+class TestAssignedNumbers(unittest.TestCase):
+    def testLookups(self):
+        self.assertEqual(assigned_numbers.uuid_name('0000180f-0000-1000-8000-00805F9B34FB'), 'Battery')
+        self.assertEqual(assigned_numbers.uuid_name(0x2A19), 'Battery Level')
+        self.assertEqual(assigned_numbers.uuid_name('0x110B'), 'Audio Sink')
+        self.assertEqual(assigned_numbers.uuid_name('6E400001-B5A3-F393-E0A9-E50E24DCCA9E'), 'Nordic UART Service')
+        self.assertEqual(assigned_numbers.uuid_name('12345678-0000-1000-8000-00805f9b34fa'), 'Unknown')
+        self.assertEqual(assigned_numbers.company_name(0x004C), 'Apple, Inc.')
+        self.assertEqual(assigned_numbers.expand_uuid(0x180F), '0000180f-0000-1000-8000-00805f9b34fb')
+        self.assertEqual(u.get_name_from_uuid('0000180a-0000-1000-8000-00805f9b34fb'), 'Device Information')
+
+    def testResolveUuids(self):
+        uuids = ['0000110b-0000-1000-8000-00805f9b34fb', '0000feaa-0000-1000-8000-00805f9b34fb']
+
+        names = assigned_numbers.resolve_uuids(uuids)
+
+        self.assertEqual(list(names.values()), ['Audio Sink', 'Google LLC'])
+        self.assertIs(names[uuids[0]], assigned_numbers.uuid_name(uuids[0].upper()))
+
+
+class TestStartup(unittest.TestCase):
+    def testLazyImports(self):
+        results = benchmarks.bench_startup(repeat=1)
+
+        self.assertEqual(results['startup_eager_modules'], [])
+
+    # wall-clock budgets depend on the machine and its load, set BT_TEST_STARTUP_BUDGETS=1 to check them.
+    @unittest.skipUnless(os.environ.get('BT_TEST_STARTUP_BUDGETS'), "startup budgets not requested")
+    def testBudgets(self):
+        results = benchmarks.bench_startup()
+
+        for key, budget in benchmarks.STARTUP_BUDGETS_MS.items():
+            self.assertLess(results[key], budget, key)
+
+
+@unittest.skipIf(np is None, "needs numpy")
+class TestProximityEngine(unittest.TestCase):
+    def feed(self, engine, rssi, ticks, now):
+        events = []
+        for _ in range(ticks):
+            engine.update('a', rssi)
+            events.extend(event for key, event, _, _ in engine.tick(now))
+            now += 1
+        return events, now
+
+    def testHysteresis(self):
+        for smoothing in (SmoothingMethods.EMA, SmoothingMethods.KALMAN):
+            engine = ProximityEngine(capacity=1, smoothing=smoothing, enter_rssi=-70, leave_rssi=-80,
+                                     near=1.0, far=2.0, leave_after=5)
+
+            events, now = self.feed(engine, -50, 5, 0)
+            self.assertEqual(events, [ProximityEvents.ENTER, ProximityEvents.NEAR])
+            self.assertAlmostEqual(engine.get('a')['RSSI'], -50)
+            # between the thresholds : no transition.
+            events, now = self.feed(engine, -75, 20, now)
+            self.assertEqual(events, [ProximityEvents.FAR])
+            events, now = self.feed(engine, -90, 20, now)
+            self.assertEqual(events, [ProximityEvents.LEAVE])
+
+            self.assertEqual(len(engine.get_history('a')), engine.history)
+            self.assertEqual(engine.tick(now + 10), [])
+            self.assertIsNone(engine.get('a'))
+
+    def testVectorizedTick(self):
+        engine = ProximityEngine(capacity=2, smoothing=SmoothingMethods.EMA, alpha=0.5)
+        for i in range(100):
+            engine.update(i, -40 - i % 3)
+            engine.update(i, -60)
+
+        events = engine.tick(0)
+
+        self.assertGreaterEqual(engine.capacity, 100)
+        self.assertEqual(len([event for event in events if event[1] == ProximityEvents.ENTER]), 100)
+        self.assertEqual(list(engine.get_history(4)), [-41, -60])
+        self.assertAlmostEqual(engine.get(4)['RSSI'], -50.5)
+        self.assertEqual(engine.metrics.get('updates'), 200)
+
+
+class TestEventDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.delivered = []
+
+    def _consume(self, events):
+        self.delivered.extend((event.kind, event.key, event.payload) for event in events)
+
+    def testDropOldest(self):
+        dispatcher = EventDispatcher(self._consume, max_size=3, batch_size=2, policy=OverflowPolicies.DROP_OLDEST)
+        for i in range(5):
+            self.assertTrue(dispatcher.put(DeviceEvents.FOUND, i))
+        self.assertEqual(dispatcher.depth, 3)
+
+        dispatcher.start()
+        dispatcher.stop(drain=True)
+
+        self.assertEqual([key for _, key, _ in self.delivered], [2, 3, 4])
+        self.assertEqual(dispatcher.metrics.get('dropped'), 2)
+        self.assertEqual(dispatcher.metrics.get('batches'), 2)
+
+    def testCoalesce(self):
+        dispatcher = EventDispatcher(self._consume, policy=OverflowPolicies.COALESCE)
+        payload = {'RSSI': -50}
+        dispatcher.put(DeviceEvents.CHANGED, '/dev_1', payload)
+        dispatcher.put(DeviceEvents.CHANGED, '/dev_2', {'RSSI': -60})
+        dispatcher.put(DeviceEvents.CHANGED, '/dev_1', {'RSSI': -55, 'Name': 'dev-1'})
+        dispatcher.put(DeviceEvents.REMOVED, '/dev_1')
+
+        dispatcher.start()
+        dispatcher.stop(drain=True)
+
+        self.assertEqual(self.delivered, [(DeviceEvents.CHANGED, '/dev_1', {'RSSI': -55, 'Name': 'dev-1'}),
+                                          (DeviceEvents.CHANGED, '/dev_2', {'RSSI': -60}),
+                                          (DeviceEvents.REMOVED, '/dev_1', None)])
+        self.assertEqual(payload, {'RSSI': -50})
+        self.assertEqual(dispatcher.metrics.get('coalesced'), 1)
+
+    def testBackpressure(self):
+        consuming = threading.Event()
+        release = threading.Event()
+
+        def consume(events):
+            consuming.set()
+            release.wait(5)
+            self._consume(events)
+
+        dispatcher = EventDispatcher(consume, max_size=1, batch_size=1, policy=OverflowPolicies.BACKPRESSURE,
+                                     block_timeout=0.05)
+        dispatcher.start()
+        dispatcher.put(DeviceEvents.FOUND, 0)
+        self.assertTrue(consuming.wait(5))
+        self.assertTrue(dispatcher.put(DeviceEvents.FOUND, 1))
+
+        # queue full and the consumer busy : waits block_timeout, then drops.
+        started_at = time.monotonic()
+        self.assertFalse(dispatcher.put(DeviceEvents.FOUND, 2))
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.05)
+
+        # waits until the consumer takes the queued event.
+        dispatcher.block_timeout = 5
+        threading.Timer(0.05, release.set).start()
+        self.assertTrue(dispatcher.put(DeviceEvents.FOUND, 3))
+        dispatcher.stop(drain=True)
+
+        self.assertEqual([key for _, key, _ in self.delivered], [0, 1, 3])
+        self.assertEqual(dispatcher.metrics.get('dropped'), 1)
+
+
+class TestLogger(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, "test.log")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _lines(self, file_name):
+        with open(file_name) as f:
+            return f.read().splitlines()
+
+    def testLevelsAndJsonLines(self):
+        logger = Logger("test", threading.Lock(), file_name=self.file_name, level=LogLevels.INFO, json_lines=True)
+        logger.debug("dropped %s", 1, log_type='f')
+        logger.info("device %s", '02:00:00:00:00:01', log_type='f')
+        logger.warning("rssi %d", -80, log_type='f')
+        logger.close()
+
+        records = [json.loads(line) for line in self._lines(self.file_name)]
+        self.assertEqual([(record['level'], record['msg']) for record in records],
+                         [('INFO', 'device 02:00:00:00:00:01'), ('WARNING', 'rssi -80')])
+        self.assertTrue(all(record['app'] == "test" for record in records))
+        self.assertFalse(logger.is_enabled_for(LogLevels.DEBUG))
+
+    def testRotation(self):
+        logger = Logger("test", threading.Lock(), file_name=self.file_name, max_bytes=100, backup_count=2)
+        for i in range(40):
+            logger.info("line %02d", i, log_type='f')
+        logger.close()
+
+        self.assertFalse(os.path.exists(self.file_name + ".3"))
+        lines = []
+        for file_name in (self.file_name + ".2", self.file_name + ".1", self.file_name):
+            self.assertLessEqual(os.path.getsize(file_name), 100)
+            lines += self._lines(file_name)
+        # oldest lines were rotated out.
+        self.assertEqual(lines, ["line %02d" % i for i in range(40 - len(lines), 40)])
+
+    def testCloseWritesQueuedMessages(self):
+        logger = Logger("test", threading.Lock(), file_name=self.file_name)
+        for i in range(1000):
+            logger.info("line %d", i, log_type='f')
+        logger.close()
+
+        self.assertEqual(len(self._lines(self.file_name)), 1000)
+        self.assertEqual(logger.dropped, 0)
+        self.assertIsNone(logger._writer)
+
+
+class TestDeviceStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, "devices.store")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _lines(self):
+        with open(self.file_name, 'rb') as f:
+            return f.read().split(b'\n')[:-1]
+
+    def testWarmStart(self):
+        store = DeviceStore(self.file_name)
+        store.update('02:00:00:00:00:01', {'Name': 'dev-1', 'RSSI': -50, 'UUIDs': ('180f',)}, seen_at=1)
+        store.update('02:00:00:00:00:02', {'Name': 'dev-2', 'Alias': 'not stored'}, seen_at=2)
+        store.close()
+
+        store = DeviceStore(self.file_name)
+        self.assertIsNone(store._index)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.get('02:00:00:00:00:01'),
+                         {'Address': '02:00:00:00:00:01', 'FirstSeen': 1, 'LastSeen': 1, 'Name': 'dev-1',
+                          'RSSI': -50, 'UUIDs': ['180f']})
+        self.assertNotIn('Alias', store.get('02:00:00:00:00:02'))
+        self.assertIn('02:00:00:00:00:02', store)
+        self.assertIsNone(store.get('02:00:00:00:00:03'))
+
+    def testTornLine(self):
+        store = DeviceStore(self.file_name)
+        store.update('02:00:00:00:00:01', {'Name': 'dev-1'})
+        store.close()
+        with open(self.file_name, 'ab') as f:
+            f.write(b'02:00:00:00:00:02\t{"Name":"de')
+
+        store = DeviceStore(self.file_name)
+        self.assertEqual(store.addresses(), {'02:00:00:00:00:01'})
+        store.update('02:00:00:00:00:03', {'Name': 'dev-3'})
+        store.close()
+
+        # the torn line is overwritten by the next append.
+        lines = self._lines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual([json.loads(line.split(b'\t', 1)[1])['Name'] for line in lines], ['dev-1', 'dev-3'])
+
+    def testCompact(self):
+        store = DeviceStore(self.file_name, compact_ratio=2.0, compact_min_lines=8)
+        for i in range(4):
+            store.update('02:00:00:00:00:01', {'RSSI': -50 - i}, seen_at=i)
+            store.update('02:00:00:00:00:02', {'RSSI': -60 - i}, seen_at=i)
+            store.flush()
+        self.assertEqual(len(self._lines()), 8)
+
+        # over compact_min_lines and compact_ratio lines per device.
+        store.update('02:00:00:00:00:01', {'RSSI': -40}, seen_at=4)
+        store.flush()
+
+        self.assertEqual(len(self._lines()), 2)
+        self.assertEqual(store.get('02:00:00:00:00:01')['RSSI'], -40)
+        self.assertEqual(store.get('02:00:00:00:00:02')['LastSeen'], 3)
+        store.close()
+        self.assertEqual(DeviceStore(self.file_name).get('02:00:00:00:00:01')['FirstSeen'], 0)
+
+
+@unittest.skipIf(os.environ.get('BT_TEST_REAL_ADAPTER'), "needs fakebluez")
+class TestFakeBluez(BusTestCase):
+    def testScannerUsesSignalPayload(self):
+        scanner = BluetoothScanner()
+        found = []
+        scanner.new_device_discovered = found.append
+
+        scanner.start_discovery_blocking(scan_sec=1)
+
+        self.assertGreater(len(found), 0)
+        self.assertIn('Address', found[0])
+        self.assertEqual(scanner.metrics.get('properties_fetched'), 0)
+
+    def testAdapterFollowsExternalChanges(self):
+        adapter = Adapter()
+        powered = adapter.powered
+        properties = dbus.Interface(dbus.SystemBus(private=True).get_object(c.BluetoothConstants.BLUEZ_SERVICE_NAME,
+                                                                            adapter.path),
+                                    c.BluetoothConstants.DBUS_PROPERTIES)
+
+        properties.Set(c.BluetoothConstants.ADAPTER_INTERFACE, 'Powered', dbus.Boolean(not powered))
+        deadline = time.monotonic() + 2
+        while adapter.powered == powered and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.assertEqual(adapter.powered, not powered)
+        properties.Set(c.BluetoothConstants.ADAPTER_INTERFACE, 'Powered', dbus.Boolean(powered))
+
+    def testAsyncController(self):
+        async def scan():
+            controller = AsyncBluetoothController()
+            alias = await controller.alias()
+            await controller.set_alias("async-alias")
+            changed_alias = await controller.alias()
+            await controller.set_alias(alias)
+
+            events = [event async for event in controller.discover(duration=1)]
+            return changed_alias, events, await controller.discovering()
+
+        changed_alias, events, discovering = asyncio.run(scan())
+
+        self.assertEqual(changed_alias, "async-alias")
+        self.assertIn(DeviceEvents.FOUND, {event.kind for event in events})
+        self.assertTrue(all(event.path.startswith(c.BluetoothConstants.ADAPTER_PATH + '/') for event in events))
+        found = next(event for event in events if event.kind == DeviceEvents.FOUND)
+        self.assertEqual(found.address, found.properties['Address'])
+        self.assertFalse(discovering)
+
+    def testDiscoveryFilter(self):
+        adapter = Adapter()
+        self.assertIn('RSSI', adapter.get_discovery_filters())
+
+        self.assertTrue(adapter.set_discovery_filter({'RSSI': -60, 'Transport': 'le'}))
+        self.assertEqual(adapter.discovery_filter.rssi, -60)
+        self.assertEqual(dict(adapter.discovery_filter.to_dbus()), {'RSSI': -60, 'Transport': 'le'})
+        self.assertTrue(adapter.set_discovery_filter(None))
+
+    def testEvictStaleDevices(self):
+        devices = {path: interfaces[c.BluetoothConstants.DEVICE_INTERFACE]
+                   for path, interfaces in u.dbus_to_python(u.get_managed_objects()).items()
+                   if c.BluetoothConstants.DEVICE_INTERFACE in interfaces}
+        kept = [path for path, device in devices.items() if device['Paired'] or device['Trusted']]
+        evictor = DeviceEvictor(max_age=3600, max_devices=50, batch_size=8)
+        self.addCleanup(self._restore_devices, devices)
+
+        evicted = evictor.sweep().result(10)
+
+        self.assertEqual(evicted, len(devices) - max(50, len(kept)))
+        self.assertEqual(evictor.metrics.get('tree_size'), max(50, len(kept)))
+        for path in kept:
+            self.assertIsNotNone(u.find_device(devices[path]['Address']))
+
+    def _restore_devices(self, devices):
+        # the module shares one fakebluez, later tests need the evicted devices.
+        from fakebluez import FAKE_CONTROL_INTERFACE
+        present = u.dbus_to_python(u.get_managed_objects())
+        control = u.bus_connection.get_interface('/', FAKE_CONTROL_INTERFACE)
+        control.RestoreDevices([device['Address'] for path, device in devices.items() if path not in present],
+                               signature='as')
+
+    def testPairTarget(self):
+        controller = BluetoothController()
+        done = threading.Event()
+        controller.on_target_paired = lambda result: done.set()
+        self.assertTrue(controller.set_target('02:00:00:00:00:07'))
+
+        controller.start(OperationModes.PAIR_TARGET)
+
+        self.assertTrue(done.wait(10))
+        result = controller.pairing_result
+        self.assertTrue(result.success, result)
+        self.assertEqual(result.done, ['pair', 'trust', 'connect'])
+        self.assertIn('discover', result.timings)
+        self.assertTrue(u.get_device_properties_by_addr('02:00:00:00:00:07')['Trusted'])
+
+    def testPairTargetAdapterRole(self):
+        controller = BluetoothController()
+        self.assertTrue(controller.set_target('02:00:00:00:FF:FF'))
+        controller.start(OperationModes.PAIR_TARGET)
+        try:
+            # pair-target runs without a scan scheduler.
+            adapter = Adapter()
+            for role, discovering in ((AdapterRoles.CONNECT, False), (AdapterRoles.SCAN, True)):
+                controller.set_adapter_role(c.BluetoothConstants.ADAPTER_PATH, role)
+                deadline = time.monotonic() + 2
+                while adapter.discovering != discovering and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                self.assertEqual(adapter.discovering, discovering)
+        finally:
+            controller.stop()
+
+    def testBulkProvisioning(self):
+        with tempfile.TemporaryDirectory() as directory:
+            targets_file = os.path.join(directory, "targets.csv")
+            with open(targets_file, 'w') as f:
+                f.write("address,alias\n02:00:00:00:00:0B,line-1\n02:00:00:00:00:0C,\n02-00-00-00-00-0d,\nbad,\n")
+
+            provisioner = BulkProvisioner(load_targets(targets_file), timeout=20)
+            results = {row['address']: row for row in provisioner.run()}
+            provisioner.write_report(os.path.join(directory, "report.csv"))
+            with open(os.path.join(directory, "report.csv")) as f:
+                self.assertEqual(len(list(csv.DictReader(f))), 4)
+
+        self.assertTrue(all(results[address]['success'] for address in
+                            ('02:00:00:00:00:0B', '02:00:00:00:00:0C', '02:00:00:00:00:0D')), results)
+        self.assertEqual(results['bad']['error'], 'invalid address')
+        self.assertEqual(u.get_device_properties_by_addr('02:00:00:00:00:0B')['Alias'], 'line-1')
+        self.assertEqual(provisioner.metrics.get('succeeded'), 3)
+
+    def testRemoveDevicesAsync(self):
+        addresses = ['02:00:00:00:00:14', '02:00:00:00:00:15', '02:00:00:00:00:16']
+
+        results = u.wait_all(u.remove_devices_async(addresses + addresses[:1]), 5)
+
+        self.assertEqual(results[:3], [None, None, None])
+        self.assertIsInstance(results[3], dbus.exceptions.DBusException)
+        self.assertIsNone(u.find_device(addresses[0]))
+
+    def testSignalRouter(self):
+        MainLoopThread.get()
+        router = SignalRouter.get()
+        paths = []
+        subscription = router.subscribe(c.BluetoothConstants.DBUS_PROPERTIES, "PropertiesChanged",
+                                        lambda interface, changed, invalidated, path: paths.append(path),
+                                        path_namespace=c.BluetoothConstants.ADAPTER_PATH,
+                                        arg0=c.BluetoothConstants.DEVICE_INTERFACE, path_keyword='path')
+        adapter = Adapter()
+        adapter.start_discovery()
+        time.sleep(1)
+        adapter.stop_discovery()
+        subscription.remove()
+
+        self.assertGreater(len(paths), 0)
+        self.assertTrue(all(path.startswith(c.BluetoothConstants.ADAPTER_PATH + '/') for path in paths))
+        self.assertGreaterEqual(router.metrics.get('rules'), 1)
+
+    def testSignalRouterDropsIdleRules(self):
+        MainLoopThread.get()
+        router = SignalRouter(u.bus_connection.bus, grace_sec=0.2)
+        subscription = router.subscribe(c.BluetoothConstants.DBUS_OM_IFACE, "InterfacesRemoved", lambda *args: None,
+                                        path='/')
+        subscription.remove()
+        self.assertEqual(router.metrics.get('rules'), 1)
+
+        deadline = time.monotonic() + 2
+        while router.metrics.get('rules') and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.assertEqual(router.metrics.get('rules'), 0)
+        self.assertEqual(router.metrics.get('rules_dropped'), 1)
+
+    def testRegistryLookups(self):
+        registry = DeviceRegistry()
+        registry.load()
+
+        self.assertGreaterEqual(len(registry), 100)
+        path = registry.find_by_address('02:00:00:00:00:05')
+        self.assertEqual(registry.get_device(path)['Name'], 'fake-5')
+        self.assertIn(path, registry.find_by_name_prefix('FAKE-5'))
+        self.assertIn(path, registry.find_by_uuid('0000180F-0000-1000-8000-00805F9B34FB'))